@@ -12,6 +12,7 @@ import json
 import os
 import tempfile
 import shutil
+import numpy as np
 import pandas as pd
 from typing import Dict, Any, List
 from unittest.mock import patch, Mock, MagicMock, mock_open
@@ -88,6 +89,1041 @@ class TestDataProcessing(unittest.TestCase):
         self.assertIsInstance(result, pd.DataFrame)
         self.assertTrue(result.empty)
 
+class TestDataServiceSnapshot(unittest.TestCase):
+    """Test the columnar snapshot cache used by data_service.get_csvdf."""
+    
+    def setUp(self):
+        """Set up test fixtures."""
+        self.temp_dir = tempfile.mkdtemp()
+        self.shard_path = os.path.join(self.temp_dir, "csrcdtlall20230101000000.csv")
+        pd.DataFrame({
+            "名称": ["Test Case 1", "Test Case 2"],
+            "链接": ["http://test1.com", "http://test2.com"],
+            "序列号": [1, "A2"]
+        }).to_csv(self.shard_path, index=False, encoding='utf-8-sig')
+    
+    def tearDown(self):
+        """Clean up test fixtures."""
+        shutil.rmtree(self.temp_dir)
+    
+    def test_snapshot_reused_until_shards_change(self):
+        """Test warm loads come from the snapshot and shard changes rebuild it."""
+        import data_service
+        if data_service.get_pyarrow() is None:
+            self.skipTest("pyarrow not installed")
+        
+        first = data_service.get_csvdf(self.temp_dir, "csrcdtlall")
+        self.assertTrue(os.path.exists(os.path.join(self.temp_dir, ".snapshot", "csrcdtlall.parquet")))
+        
+        with patch('data_service.get_pandas') as mock_pandas:
+            mock_pandas.return_value.read_csv.side_effect = AssertionError("CSV parsed on warm load")
+            warm = data_service.get_csvdf(self.temp_dir, "csrcdtlall")
+        self.assertEqual(warm["链接"].tolist(), first["链接"].tolist())
+        
+        pd.DataFrame({"名称": ["Test Case 3"], "链接": ["http://test3.com"], "序列号": [3]}).to_csv(
+            os.path.join(self.temp_dir, "csrcdtlall20230102000000.csv"), index=False, encoding='utf-8-sig')
+        refreshed = data_service.get_csvdf(self.temp_dir, "csrcdtlall")
+        self.assertEqual(len(refreshed), 3)
+    
+    def test_parallel_load_keeps_order_and_skips_bad_shards(self):
+        """Test concurrent shard reads keep file order and skip unreadable shards."""
+        import data_service
+        pd.DataFrame({"名称": ["Test Case 3"], "链接": ["http://test3.com"], "序列号": [3]}).to_csv(
+            os.path.join(self.temp_dir, "csrcdtlall20230102000000.csv"), index=False, encoding='utf-8-sig')
+        bad_path = os.path.join(self.temp_dir, "csrcdtlall20230103000000.csv")
+        with open(bad_path, "wb") as f:
+            f.write(b"\xff\xfe\x00broken")
+        
+        files = sorted([self.shard_path, os.path.join(self.temp_dir, "csrcdtlall20230102000000.csv"), bad_path])
+        dflist, timings, skipped = data_service.read_csv_shards(files, include_filename=True)
+        self.assertEqual(skipped, 1)
+        self.assertEqual([t["file"] for t in timings], [os.path.basename(f) for f in files[:2]])
+        self.assertEqual(dflist[1]["source_filename"].tolist(), ["csrcdtlall20230102000000.csv"])
+
+class TestDatasetRegistry(unittest.TestCase):
+    """Test the shared dataset registry."""
+    
+    def test_generation_and_read_only_views(self):
+        """Test loads are shared, views are read-only and invalidation bumps the generation."""
+        from dataset_registry import DatasetRegistry
+        
+        registry = DatasetRegistry()
+        loader = Mock(return_value=pd.DataFrame({"链接": ["a", "b"], "amount": [1.0, 2.0]}))
+        registry.register("cat", loader)
+        
+        view = registry.get("cat")
+        first_generation = registry.generation("cat")
+        self.assertEqual(loader.call_count, 1)
+        with self.assertRaises(ValueError):
+            view.loc[view["amount"] > 1, "amount"] = 0
+        
+        registry.invalidate("cat")
+        registry.get("cat")
+        self.assertEqual(loader.call_count, 2)
+        self.assertGreater(registry.generation("cat"), first_generation)
+    
+    def test_signature_checked_once_per_ttl(self):
+        """Test the files are checked once per TTL, and invalidation rechecks them and the datasets built on them."""
+        from dataset_registry import DatasetRegistry
+        
+        registry = DatasetRegistry(signature_ttl=60)
+        signature = Mock(return_value=["cat1.csv"])
+        loader = Mock(return_value=pd.DataFrame({"amount": [1.0, 2.0]}))
+        registry.register("cat", loader, signature)
+        registry.register("total", lambda: registry.get("cat").sum().to_frame(),
+                          lambda: [registry.generation("cat")])
+        for _ in range(3):
+            registry.get("total")
+        # Checked before and once more after the load
+        self.assertEqual((signature.call_count, loader.call_count), (2, 1))
+        
+        # Within the TTL a changed file set is not seen until invalidated
+        signature.return_value = ["cat1.csv", "cat2.csv"]
+        generation = registry.generation("total")
+        self.assertEqual(loader.call_count, 1)
+        registry.invalidate("cat")
+        self.assertGreater(registry.generation("total"), generation)
+        self.assertEqual((signature.call_count, loader.call_count), (4, 2))
+        
+        registry.signature_ttl = 0
+        registry.get("cat")
+        registry.get("cat")
+        self.assertEqual(signature.call_count, 6)
+
+class TestIncrementalShardLoading(unittest.TestCase):
+    """Test append-only refresh of datasets when new shards arrive."""
+    
+    def setUp(self):
+        """Set up test fixtures."""
+        self.temp_dir = tempfile.mkdtemp()
+        self.write_shard("csrccat_20230101000000.csv", ["http://test1.com", "http://test2.com"], ["1000", ""])
+    
+    def tearDown(self):
+        """Clean up test fixtures."""
+        shutil.rmtree(self.temp_dir)
+    
+    def write_shard(self, name, ids, amounts):
+        pd.DataFrame({"id": ids, "amount": amounts, "law": ["证券法"] * len(ids)}).to_csv(
+            os.path.join(self.temp_dir, name), index=False, encoding='utf-8-sig')
+    
+    def test_get_appended_shards(self):
+        """Test only pure additions of later shards count as append-only."""
+        import data_service
+        old = [["a1.csv", 10, 1]]
+        self.assertEqual(data_service.get_appended_shards(old, old + [["a2.csv", 5, 2]]), ["a2.csv"])
+        self.assertIsNone(data_service.get_appended_shards(old, [["a1.csv", 11, 3], ["a2.csv", 5, 2]]))
+        self.assertIsNone(data_service.get_appended_shards(old, [["a0.csv", 5, 2]] + old))
+        self.assertIsNone(data_service.get_appended_shards(old, old))
+    
+    def test_registry_appends_new_shards_only(self):
+        """Test a new shard is parsed alone and appended to the loaded frame."""
+        import data_service
+        from dataset_registry import DatasetRegistry
+        
+        test_registry = DatasetRegistry()
+        get_folder = lambda: self.temp_dir
+        test_registry.register(
+            "cat",
+            lambda: data_service._process_csrc2cat(data_service.get_csvdf(self.temp_dir, "csrccat")),
+            lambda: data_service.get_folder_signature(self.temp_dir, "csrccat"),
+            data_service._shard_extender(get_folder, "csrccat", data_service._process_csrc2cat)
+        )
+        first = test_registry.entry("cat")
+        self.assertEqual(first.frame["amount"].tolist(), [1000, 0])
+        
+        self.write_shard("csrccat_20230102000000.csv", ["http://test3.com"], ["500"])
+        test_registry.invalidate("cat")
+        with patch('data_service.read_csv_shards', wraps=data_service.read_csv_shards) as mock_read:
+            second = test_registry.entry("cat")
+        read_files = [os.path.basename(f) for f in mock_read.call_args[0][0]]
+        self.assertEqual(read_files, ["csrccat_20230102000000.csv"])
+        self.assertEqual(second.extends, first.generation)
+        self.assertEqual(second.base_rows, 2)
+        self.assertEqual(second.frame["id"].tolist(), ["http://test1.com", "http://test2.com", "http://test3.com"])
+        self.assertEqual(second.frame["lawlist"].tolist(), ["证券法"] * 3)
+    
+    def test_shard_landing_during_load_is_not_appended_twice(self):
+        """Test a shard written between the signature check and the loader ends up in the stored signature."""
+        import data_service
+        from dataset_registry import DatasetRegistry
+        
+        test_registry = DatasetRegistry(signature_ttl=60)
+        landed = []
+        
+        def load():
+            if not landed:
+                # Arrives after the signature was computed
+                self.write_shard("csrccat_20230102000000.csv", ["http://test3.com"], ["500"])
+                landed.append(True)
+            return data_service._process_csrc2cat(data_service.get_csvdf(self.temp_dir, "csrccat"))
+        
+        test_registry.register(
+            "cat",
+            load,
+            lambda: data_service.get_folder_signature(self.temp_dir, "csrccat"),
+            data_service._shard_extender(lambda: self.temp_dir, "csrccat", data_service._process_csrc2cat)
+        )
+        first = test_registry.entry("cat")
+        self.assertEqual(len(first.frame), 3)
+        self.assertEqual([shard[0] for shard in first.signature],
+                         ["csrccat_20230101000000.csv", "csrccat_20230102000000.csv"])
+        test_registry.invalidate("cat")
+        second = test_registry.entry("cat")
+        self.assertEqual(second.frame["id"].tolist(), ["http://test1.com", "http://test2.com", "http://test3.com"])
+
+class TestShardCompaction(unittest.TestCase):
+    """Test merging a shard family into one compacted file."""
+    
+    def setUp(self):
+        """Set up test fixtures."""
+        self.temp_dir = tempfile.mkdtemp()
+        self.write_shard("csrccat_20230101000000.csv", ["b", "a"], ["1000", "200"])
+        self.write_shard("csrccat_20230102000000.csv", ["b", "c"], ["1500", ""])
+    
+    def tearDown(self):
+        """Clean up test fixtures."""
+        shutil.rmtree(self.temp_dir)
+    
+    def write_shard(self, name, ids, amounts):
+        pd.DataFrame({"id": ids, "amount": amounts}).to_csv(
+            os.path.join(self.temp_dir, name), index=False, encoding='utf-8-sig')
+    
+    def test_compaction_dedupes_sorts_and_archives(self):
+        """Test newest rows win, rows are sorted by key and shards are archived."""
+        import data_service
+        from shard_compaction import compact_shards
+        
+        report = compact_shards(["cat"], self.temp_dir)
+        entry = report["families"]["cat"]
+        self.assertTrue(entry["compacted"])
+        self.assertEqual(entry["duplicatesDropped"], 1)
+        self.assertEqual(len(os.listdir(os.path.join(self.temp_dir, entry["archivedTo"]))), 2)
+        
+        files = data_service.list_shard_files(self.temp_dir, "csrccat")
+        self.assertEqual([os.path.basename(f) for f in files], ["csrccat-compacted.csv.gz"])
+        df = data_service.get_csvdf(self.temp_dir, "csrccat")
+        self.assertEqual(df["id"].tolist(), ["a", "b", "c"])
+        self.assertEqual(df["amount"].tolist()[:2], [200, 1500])
+    
+    def test_new_shards_sort_after_compacted_file(self):
+        """Test shards written after compaction are appended and folded in next time."""
+        import data_service
+        from shard_compaction import compact_shards
+        
+        compact_shards(["cat"], self.temp_dir)
+        old_signature = data_service.get_folder_signature(self.temp_dir, "csrccat")
+        self.write_shard("csrccat_20230103000000.csv", ["a"], ["300"])
+        new_signature = data_service.get_folder_signature(self.temp_dir, "csrccat")
+        self.assertEqual(data_service.get_appended_shards(old_signature, new_signature), ["csrccat_20230103000000.csv"])
+        
+        report = compact_shards(["cat"], self.temp_dir)
+        self.assertEqual(report["families"]["cat"]["duplicatesDropped"], 1)
+        df = data_service.get_csvdf(self.temp_dir, "csrccat")
+        self.assertEqual(df.set_index("id")["amount"].to_dict()["a"], 300)
+    
+    def test_merged_shards_are_read_until_the_swap(self):
+        """Test readers keep the original shards while the manifest names another file."""
+        import data_service
+        from shard_compaction import compact_shards
+        
+        compact_shards(["cat"], self.temp_dir, dry_run=True)
+        self.assertEqual(len(data_service.list_shard_files(self.temp_dir, "csrccat")), 2)
+        with open(data_service.get_compaction_manifest_path(self.temp_dir, "csrccat"), "w") as f:
+            json.dump({"size": 1, "mtimeNs": 1, "shards": ["csrccat_20230101000000.csv"]}, f)
+        self.assertEqual(len(data_service.list_shard_files(self.temp_dir, "csrccat")), 2)
+
+class TestPublishDateNormalization(unittest.TestCase):
+    """Test the vectorized 发文日期 normalization."""
+    
+    def test_timestamps_strings_and_blanks(self):
+        """Test seconds vs milliseconds, free-form strings and blank fallback."""
+        import data_service
+        values = pd.Series([1609459200, "1609459200000", "2023/1/5", "2023-01-05 12:30:00", "", None, "not a date"], dtype=object)
+        display, parsed = data_service.normalize_publish_dates(values)
+        self.assertEqual(display.tolist(), ["2021-01-01", "2021-01-01", "2023-01-05", "2023-01-05", "", "", ""])
+        self.assertEqual(str(parsed.dtype), "datetime64[ns]")
+        self.assertEqual(parsed[3], pd.Timestamp("2023-01-05"))
+        self.assertTrue(parsed[4:].isna().all())
+    
+    def test_derived_column_is_not_exported(self):
+        """Test the datetime helper column is kept in memory but dropped on save."""
+        import data_service
+        df = data_service._process_csrc2detail(pd.DataFrame({"发文日期": ["2023-01-05", None], "名称": ["a", None]}))
+        self.assertEqual(df["名称"].tolist(), ["a", ""])
+        self.assertTrue(df[data_service.PUBLISH_DATE_COLUMN].isna().iloc[1])
+        self.assertEqual(list(data_service.drop_derived_columns(df).columns), ["发文日期", "名称"])
+
+class TestDatasetSchema(unittest.TestCase):
+    """Test the compact dtype schema of the case tables."""
+    
+    def test_schema_dtypes_and_counts(self):
+        """Test declared dtypes are applied and unused categories are not counted."""
+        import data_service
+        cat_df = data_service.apply_dataset_schema(pd.DataFrame({
+            "id": ["a", "b", "c"],
+            "amount": [1000, "", "n/a"],
+            "province": ["北京", "上海", "北京"]
+        }), "cat")
+        self.assertEqual(str(cat_df["amount"].dtype), "float64")
+        self.assertEqual(cat_df["amount"].isna().tolist(), [False, True, True])
+        self.assertEqual(str(cat_df["province"].dtype), "category")
+        self.assertIn("cat", data_service.schema_memory_stats)
+        
+        counts = data_service.count_values(cat_df[cat_df["id"] != "b"]["province"])
+        self.assertEqual(counts.to_dict(), {"北京": 2})
+    
+    def test_append_rows_keeps_categories(self):
+        """Test appended rows with new categories keep the column categorical."""
+        import data_service
+        frame = data_service.apply_schema(pd.DataFrame({"org": ["北京", "上海"]}), {"org": "category"})
+        delta = data_service.apply_schema(pd.DataFrame({"org": ["深圳"]}), {"org": "category"})
+        combined = data_service.append_rows(frame, delta)
+        self.assertEqual(str(combined["org"].dtype), "category")
+        self.assertEqual(combined["org"].tolist(), ["北京", "上海", "深圳"])
+
+class CsrcDataTestCase(unittest.TestCase):
+    """Base for tests running the registered datasets over shards in a temporary csrc2 directory."""
+    
+    def shards(self):
+        """Shard file name -> columns, written before the datasets are registered."""
+        return {}
+    
+    def setUp(self):
+        """Set up test fixtures."""
+        import data_service
+        self.temp_dir = tempfile.mkdtemp()
+        for name, columns in self.shards().items():
+            self.write(name, columns)
+        self.dir_patcher = patch('data_service.get_csrc2_dir', return_value=self.temp_dir)
+        self.dir_patcher.start()
+        data_service._register_datasets()
+    
+    def tearDown(self):
+        """Clean up test fixtures."""
+        import data_service
+        self.dir_patcher.stop()
+        data_service._register_datasets()
+        shutil.rmtree(self.temp_dir)
+    
+    def write(self, name, columns):
+        pd.DataFrame(columns).to_csv(os.path.join(self.temp_dir, name), index=False, encoding='utf-8-sig')
+
+class TestMaterializedIntersection(CsrcDataTestCase):
+    """Test the shared analysis/category/split intersection."""
+    
+    def shards(self):
+        return {
+            "csrc2analysis20230101000000.csv": {
+                "名称": ["Case 1", "Case 2", "Case 3"],
+                "发文日期": ["2023-01-01", "2023-01-02", "2023-01-03"],
+                "链接": ["http://test1.com", "http://test2.com", "http://test3.com"]
+            },
+            "csrccat20230101000000.csv": {"id": ["http://test1.com", "http://test3.com"], "amount": [100, 300]},
+            "csrcsplit20230101000000.csv": {"id": ["http://test3.com", "http://test1.com"], "people": ["C", "A"]},
+        }
+    
+    def test_intersection_extended_in_analysis_order(self):
+        """Test new labels append rows in the order a full rebuild gives."""
+        import data_service
+        from dataset_registry import registry
+        
+        first = data_service.get_csrc2_intersection()
+        self.assertEqual(first["链接"].tolist(), ["http://test1.com", "http://test3.com"])
+        self.assertEqual(first["people"].tolist(), ["A", "C"])
+        self.assertEqual(first["罚款金额"].tolist(), [100, 300])
+        first_generation = registry.generation("intersection")
+        
+        self.write("csrccat_20230102000000.csv", {"id": ["http://test2.com"], "amount": [200]})
+        self.write("csrcsplit_20230102000000.csv", {"id": ["http://test2.com"], "people": ["B"]})
+        registry.invalidate("cat", "split")
+        
+        extended = data_service.get_csrc2_intersection()
+        self.assertEqual(registry.entry("intersection").extends, first_generation)
+        self.assertEqual(extended["链接"].tolist(), ["http://test1.com", "http://test2.com", "http://test3.com"])
+        self.assertEqual(extended["people"].tolist(), ["A", "B", "C"])
+
+class TestHotColdColumns(CsrcDataTestCase):
+    """Test loading case metadata apart from the full text."""
+    
+    def shards(self):
+        return {"csrc2analysis20230101000000.csv": {
+            "名称": ["Case 1", "Case 2", "Case 3"],
+            "内容": ["正文一", "正文二", "正文三"],
+            "链接": ["http://test1.com", "http://test2.com", "http://test3.com"]
+        }}
+    
+    def test_projection_skips_text_columns(self):
+        """Test a metadata projection never returns 内容, with or without snapshots."""
+        import data_service
+        
+        for enabled in (True, False):
+            with patch('data_service.SNAPSHOT_ENABLED', enabled):
+                df = data_service.get_csvdf(self.temp_dir, "csrc2analysis", columns=data_service.is_metadata_column)
+            self.assertEqual(list(df.columns), ["名称", "链接"])
+        meta = data_service.get_csrc2analysis(columns=["名称"])
+        self.assertNotIn("内容", meta.columns)
+    
+    def test_texts_fetched_by_link(self):
+        """Test page texts come from the text store without loading the text dataset."""
+        import data_service
+        from dataset_registry import registry
+        
+        if data_service.get_pyarrow() is None:
+            self.skipTest("pyarrow not installed")
+        links = pd.Series(["http://test3.com", "http://missing.com", "http://test1.com"])
+        texts = data_service.get_case_texts(links)
+        self.assertEqual(texts.tolist(), ["正文三", "", "正文一"])
+        self.assertIsNone(registry.peek("analysis_text"))
+        
+        loaded = data_service.get_case_texts(links, load=True)
+        self.assertEqual(loaded.tolist(), texts.tolist())
+        self.assertIsNotNone(registry.peek("analysis_text"))
+
+class TestSharedDatasets(unittest.TestCase):
+    """Test publishing datasets as memory-mapped Arrow IPC files."""
+    
+    def setUp(self):
+        """Set up test fixtures."""
+        from shared_datasets import SharedDatasetStore
+        import data_service
+        if data_service.get_pyarrow() is None:
+            self.skipTest("pyarrow not installed")
+        self.temp_dir = tempfile.mkdtemp()
+        self.store = SharedDatasetStore(self.temp_dir, version="v1")
+        self.frame = pd.DataFrame({"链接": ["http://test1.com", "http://test2.com"], "金额": [1.0, 2.0]})
+    
+    def tearDown(self):
+        """Clean up test fixtures."""
+        shutil.rmtree(self.temp_dir)
+    
+    def test_publish_and_map(self):
+        """Test a published frame maps back with pyarrow strings and is keyed by signature."""
+        from shared_datasets import SharedDatasetStore
+        
+        mapped = self.store.publish("detail", ["sig1"], self.frame)
+        self.assertEqual(mapped["链接"].tolist(), self.frame["链接"].tolist())
+        self.assertEqual(str(mapped["链接"].dtype), "string")
+        self.assertEqual(mapped["金额"].tolist(), [1.0, 2.0])
+        self.assertIsNone(self.store.read("detail", ["sig2"]))
+        self.assertIsNone(SharedDatasetStore(self.temp_dir, version="v2").read("detail", ["sig1"]))
+        
+        mixed = pd.DataFrame({"id": ["a", 1]})
+        self.assertIsNone(self.store.publish("mixed", ["sig1"], mixed))
+    
+    def test_registry_maps_published_generation(self):
+        """Test a second registry maps the dataset another one published instead of loading it."""
+        from dataset_registry import DatasetRegistry
+        
+        loads = []
+        
+        def loader():
+            loads.append(1)
+            return self.frame
+        
+        first, second = DatasetRegistry(), DatasetRegistry()
+        for registry in (first, second):
+            registry.register("detail", loader, signature=lambda: ["sig1"])
+            registry.set_shared_store(self.store)
+        self.assertEqual(len(first.get("detail")), 2)
+        self.assertTrue(first.entry("detail").shared)
+        self.assertEqual(second.get("detail")["链接"].tolist(), self.frame["链接"].tolist())
+        self.assertTrue(second.entry("detail").shared)
+        self.assertEqual(len(loads), 1)
+
+class TestNgramSearchIndex(CsrcDataTestCase):
+    """Test keyword search through the character bigram index."""
+    
+    def shards(self):
+        links = ["http://test1.com", "http://test2.com", "http://test3.com"]
+        return {
+            "csrc2analysis20230101000000.csv": {
+                "名称": ["内幕交易案", "Market Case", "信息披露案"],
+                "内容": ["当事人利用内幕信息交易", "操纵市场", "未按规定披露信息"],
+                "链接": links
+            },
+            "csrccat20230101000000.csv": {"id": links, "amount": [1, 2, 3]},
+            "csrcsplit20230101000000.csv": {"id": links, "people": ["张三", "李四", "张三丰"]},
+        }
+    
+    def search(self, keyword, columns=("名称", "内容")):
+        import data_service
+        from search_index import keyword_mask
+        df = data_service.get_csrc2_intersection()
+        return df[keyword_mask(df, keyword, columns)]["链接"].tolist()
+    
+    def test_matches_full_scan(self):
+        """Test indexed, short and regex keywords give the str.contains results."""
+        self.assertEqual(self.search("内幕"), ["http://test1.com"])
+        self.assertEqual(self.search("market"), ["http://test2.com"])
+        self.assertEqual(self.search("披露信息"), ["http://test3.com"])
+        self.assertEqual(self.search("信息"), ["http://test1.com", "http://test3.com"])
+        self.assertEqual(self.search("不存在"), [])
+        self.assertEqual(self.search("案"), ["http://test1.com", "http://test3.com"])
+        self.assertEqual(self.search("操纵|披露"), ["http://test2.com", "http://test3.com"])
+        self.assertEqual(self.search("张三", columns=("people",)), ["http://test1.com", "http://test3.com"])
+    
+    def test_index_updated_for_appended_rows(self):
+        """Test new shards are merged into the previous generation's postings."""
+        import search_index
+        
+        self.assertEqual(self.search("内幕"), ["http://test1.com"])
+        self.write("csrc2analysis20230102000000.csv", {"名称": ["新案"], "内容": ["内幕消息"], "链接": ["http://test4.com"]})
+        self.write("csrccat20230102000000.csv", {"id": ["http://test4.com"], "amount": [4]})
+        self.write("csrcsplit20230102000000.csv", {"id": ["http://test4.com"], "people": ["王五"]})
+        from dataset_registry import registry
+        registry.invalidate("analysis_meta", "analysis_text", "cat", "split")
+        
+        self.assertEqual(self.search("内幕"), ["http://test1.com", "http://test4.com"])
+        stats = search_index.index_build_stats["intersection:内容"]
+        self.assertEqual((stats["mode"], stats["rowsTokenized"]), ("updated", 1))
+    
+    def test_rank_by_relevance(self):
+        """Test BM25 ranking puts matches in 名称 and repeated matches first."""
+        import data_service
+        from search_index import keyword_mask, rank_by_relevance
+        
+        df = data_service.get_csrc2_intersection()
+        df = df[keyword_mask(df, "信息")]
+        ranked = df.iloc[rank_by_relevance(df, "信息", 10)]["链接"].tolist()
+        self.assertEqual(ranked, ["http://test3.com", "http://test1.com"])
+        self.assertEqual(len(rank_by_relevance(df, "信息", 1)), 1)
+        self.assertEqual(rank_by_relevance(df, "信", 10).tolist(), [0, 1])
+    
+    def test_rank_ties_keep_k_rows_in_order(self):
+        """Test rows tied with the k-th score are cut at k, in df order."""
+        import data_service
+        from search_index import rank_by_relevance
+        
+        # 张三 only occurs in people, so every score is 0
+        df = data_service.get_csrc2_intersection().iloc[[2, 0, 1]]
+        self.assertEqual(rank_by_relevance(df, "张三", 2).tolist(), [0, 1])
+    
+    def test_bm25_scores_any_row_order(self):
+        """Test scores of a subset in any order equal those of the whole index."""
+        from search_index import NgramIndex
+        
+        index = NgramIndex.build(["内幕信息内幕", "操纵市场", "", "内幕交易", "信息披露"])
+        full = index.bm25("内幕信息", np.arange(5))
+        self.assertGreater(full[0], full[3])
+        self.assertEqual(full[1], 0.0)
+        np.testing.assert_allclose(index.bm25("内幕信息", np.array([3, 0, 4])), full[[3, 0, 4]])
+        np.testing.assert_allclose(index.bm25("内幕信息", np.array([4])), full[[4]])
+
+class TestDateIndex(unittest.TestCase):
+    """Test date ranges and newest-first order from the sorted date index."""
+    
+    def setUp(self):
+        """Set up test fixtures."""
+        self.dates = pd.to_datetime(pd.Series(["2023-01-02", None, "2023-03-01", "2023-01-02", "2022-12-31"])).to_numpy()
+    
+    def test_rows_newest_first(self):
+        """Test undated rows come last and same-day rows keep their order."""
+        from search_index import DateIndex
+        
+        index = DateIndex(self.dates)
+        self.assertEqual(index.rows().tolist(), [2, 0, 3, 4, 1])
+        self.assertEqual(index.rows(pd.Timestamp("2023-01-02").value).tolist(), [2, 0, 3])
+        self.assertEqual(index.rows(None, pd.Timestamp("2023-01-02").value).tolist(), [0, 3, 4])
+        self.assertEqual(index.rows(pd.Timestamp("2023-01-03").value, pd.Timestamp("2023-02-01").value).tolist(), [])
+    
+    def test_frame_outside_registry(self):
+        """Test frames that are not a dataset subset are indexed on the fly."""
+        from search_index import date_range_mask, sort_newest_first
+        
+        df = pd.DataFrame({"发文日期": ["2023-01-02", "", "2023-03-01"]}, index=["a", "b", "c"])
+        self.assertEqual(sort_newest_first(df).index.tolist(), ["c", "a", "b"])
+        self.assertEqual(sort_newest_first(df, "2023-02-01").index.tolist(), ["c"])
+        self.assertEqual(date_range_mask(df, None, "2023-02-01").tolist(), [True, False, False])
+
+class TestKeyIndex(CsrcDataTestCase):
+    """Test exact-match lookups through the per-generation key indexes."""
+    
+    def shards(self):
+        return {"csrc2analysis20230101000000.csv": {
+            "名称": ["Case 1", "Case 2", "Case 3"],
+            "机构": ["北京", "上海", "北京"],
+            "链接": ["http://test1.com", "http://test2.com", "http://test3.com"]
+        }}
+    
+    def test_lookup(self):
+        """Test point and batch lookups return the matching rows."""
+        from search_index import lookup
+        
+        self.assertEqual(lookup("analysis", "链接", ["http://test2.com"]).tolist(), [1])
+        self.assertEqual(lookup("analysis", "链接", ["http://test3.com", "http://missing.com", "http://test1.com"]).tolist(), [0, 2])
+        self.assertEqual(lookup("analysis", "机构", ["北京"]).tolist(), [0, 2])
+        self.assertEqual(lookup("analysis", "文号", ["x"]).tolist(), [])
+    
+    def test_key_mask_on_subsets(self):
+        """Test masks over filtered and private frames match an equality filter."""
+        import data_service
+        from search_index import KeyIndex, key_mask
+        
+        df = data_service.get_csrc2analysis()
+        subset = df.iloc[[2, 1]]
+        self.assertEqual(key_mask(subset, "机构", "北京", "analysis").tolist(), [True, False])
+        private = df.copy()
+        private.index = ["a", "b", "c"]
+        self.assertEqual(key_mask(private, "机构", "北京", "analysis").tolist(), [True, False, True])
+        self.assertEqual(KeyIndex(pd.Series(["x", None, "x"])).lookup(["x", None]).tolist(), [0, 2])
+
+class TestCursorPagination(CsrcDataTestCase):
+    """Test keyset pagination along the date order."""
+    
+    def shards(self):
+        links = [f"http://test{i}.com" for i in range(6)]
+        return {
+            "csrc2analysis20230101000000.csv": {
+                "名称": [f"Case {i}" for i in range(6)],
+                "发文日期": ["2023-01-01", "2023-01-03", "", "2023-01-02", "2023-01-03", "2023-01-05"],
+                "链接": links
+            },
+            "csrccat20230101000000.csv": {"id": links, "amount": [1, 2, 3, 4, 5, 6]},
+            "csrcsplit20230101000000.csv": {"id": links, "people": ["A"] * 6},
+        }
+    
+    def walk(self, keep=lambda rows: rows, fingerprint="q"):
+        import data_service
+        from search_index import cursor_after, page_after_cursor
+        
+        df = data_service.get_csrc2_intersection()
+        # Start after the newest case, row 5
+        links, more = ["http://test5.com"], True
+        cursor = cursor_after(5, 6, fingerprint)
+        while more:
+            page, more, total = page_after_cursor(df, cursor, fingerprint, 2, keep)
+            links += page["链接"].tolist()
+            if len(page):
+                cursor = cursor_after(int(page.index[-1]), total, fingerprint)
+        return links
+    
+    def test_pages_follow_date_order(self):
+        """Test cursor pages continue newest first, undated rows last."""
+        self.assertEqual(self.walk(), [f"http://test{i}.com" for i in (5, 1, 4, 3, 0, 2)])
+        even_amounts = lambda rows: rows[rows["罚款金额"] % 2 == 0]
+        self.assertEqual(self.walk(even_amounts), ["http://test5.com", "http://test1.com", "http://test3.com"])
+    
+    def test_cursor_checks_query_and_generation(self):
+        """Test a cursor is bound to its query and resumes by 链接 in a new generation."""
+        import data_service
+        from dataset_registry import registry
+        from search_index import cursor_after, page_after_cursor
+        
+        df = data_service.get_csrc2_intersection()
+        cursor = cursor_after(1, 6, "q")
+        with self.assertRaises(ValueError):
+            page_after_cursor(df, cursor, "other", 2, lambda rows: rows)
+        with self.assertRaises(ValueError):
+            page_after_cursor(df, "not-a-cursor", "q", 2, lambda rows: rows)
+        
+        registry.invalidate("intersection")
+        df = data_service.get_csrc2_intersection()
+        page, more, total = page_after_cursor(df, cursor, "q", 2, lambda rows: rows)
+        self.assertEqual(page["链接"].tolist(), ["http://test4.com", "http://test3.com"])
+        self.assertIsNone(total)
+
+class TestQueryResultCache(unittest.TestCase):
+    """Test the byte-bounded query result cache."""
+    
+    def test_lru_eviction_and_generations(self):
+        """Test entries are evicted least recently used first and dropped with their generation."""
+        from search_index import QueryResultCache
+        
+        rows = lambda n: np.arange(n, dtype=np.int32)
+        cache = QueryResultCache(max_bytes=2 * (400 + QueryResultCache.ENTRY_OVERHEAD))
+        cache.put("intersection", 1, ("a",), rows(100))
+        cache.put("intersection", 1, ("b",), rows(100))
+        self.assertIsNotNone(cache.get("intersection", 1, ("a",)))
+        cache.put("intersection", 1, ("c",), rows(100))
+        self.assertIsNone(cache.get("intersection", 1, ("b",)))
+        self.assertIsNotNone(cache.get("intersection", 1, ("a",)))
+        
+        cache.put("intersection", 2, ("a",), rows(10))
+        self.assertIsNone(cache.get("intersection", 1, ("c",)))
+        stats = cache.stats()
+        self.assertEqual((stats["entries"], stats["hits"], stats["misses"], stats["evictions"]), (1, 2, 2, 1))
+    
+    def test_cached_rows_computes_once(self):
+        """Test the rows of a query are computed once per generation."""
+        from dataset_registry import DatasetRegistry
+        import search_index
+        
+        test_registry = DatasetRegistry()
+        frame = pd.DataFrame({"名称": ["a", "b", "c"]})
+        test_registry.register("test", lambda: frame)
+        calls = []
+        compute = lambda: calls.append(1) or frame.iloc[[2, 0]]
+        query = search_index.normalize_query(keyword="x", org="", minAmount=5)
+        self.assertEqual(query, (("keyword", "x"), ("minAmount", 5.0)))
+        with patch.object(search_index, "registry", test_registry), \
+                patch.object(search_index, "query_cache", search_index.QueryResultCache(1 << 20)):
+            df = test_registry.get("test")
+            self.assertEqual(search_index.cached_rows(df, query, compute, "test").tolist(), [2, 0])
+            self.assertEqual(search_index.cached_rows(df, query, compute, "test").tolist(), [2, 0])
+            self.assertEqual(len(calls), 1)
+            test_registry.invalidate("test")
+            search_index.cached_rows(test_registry.get("test"), query, compute, "test")
+            self.assertEqual(len(calls), 2)
+            # A subset of the dataset is not cached
+            self.assertEqual(search_index.cached_rows(df.iloc[[0, 2]], query, compute, "test").tolist(), [1, 0])
+    
+    def test_request_keeps_its_generation(self):
+        """Test a request holding an older generation neither caches nor indexes its rows under a newer one."""
+        from dataset_registry import DatasetRegistry
+        import search_index
+        
+        frames = [pd.DataFrame({"机构": ["北京", "上海", "北京"]}), pd.DataFrame({"机构": ["上海", "上海", "北京"]})]
+        test_registry = DatasetRegistry()
+        test_registry.register("test", lambda: frames[0])
+        query = search_index.normalize_query(org="北京")
+        matches = lambda df: lambda: df[df["机构"].isin(["北京"])]
+        with patch.object(search_index, "registry", test_registry), \
+                patch.object(search_index, "query_cache", search_index.QueryResultCache(1 << 20)), \
+                patch.dict(search_index._key_indexes, clear=True):
+            old = test_registry.entry("test")
+            # Full reload with the same row count while the request runs
+            frames.pop(0)
+            test_registry.invalidate("test")
+            new = test_registry.entry("test")
+            self.assertEqual(search_index.key_rows(new.view(), "机构", ["北京"], "test").tolist(), [2])
+            self.assertEqual(search_index.key_rows(old.view(), "机构", ["北京"], old).tolist(), [0, 2])
+            self.assertEqual(search_index._key_indexes[("test", "机构")][0], new.generation)
+            self.assertEqual(search_index.cached_rows(old.view(), query, matches(old.view()), old).tolist(), [0, 2])
+            self.assertEqual(search_index.cached_rows(new.view(), query, matches(new.view()), "test").tolist(), [2])
+            self.assertEqual(search_index.cached_rows(old.view(), query, matches(old.view()), old).tolist(), [0, 2])
+
+class TestSearchPlanner(unittest.TestCase):
+    """Test the selectivity-aware ordering of search filters."""
+    
+    def test_cheap_selective_filters_run_first(self):
+        """Test filters are ordered by cost and selectivity without changing the result."""
+        from search_planner import FILTER_COSTS, FilterStep, QueryPlan
+        
+        df = pd.DataFrame({"law": ["证券法"] * 90 + ["期货法"] * 10, "机构": ["北京", "上海"] * 50})
+        calls = []
+        def step(name, mask, cost, rows=None):
+            return FilterStep(name, lambda frame: calls.append((name, len(frame))) or frame[mask(frame)], cost, rows)
+        steps = [
+            step("legalBasis", lambda frame: frame["law"].str.contains("证券"), FILTER_COSTS["scan"]),
+            step("organization", lambda frame: frame["机构"] == "上海", FILTER_COSTS["key"], 50),
+            step("law", lambda frame: frame["law"] == "期货法", FILTER_COSTS["scan"]),
+        ]
+        plan = QueryPlan(df, steps)
+        self.assertEqual([s.name for s in plan.steps], ["organization", "law", "legalBasis"])
+        self.assertEqual(plan.describe(), "organization~50.0%(index) > law~10.0%(sample) > legalBasis~90.0%(sample)")
+        
+        calls.clear()
+        self.assertTrue(plan.apply(df).empty)
+        self.assertEqual(calls, [("organization", 100), ("law", 50), ("legalBasis", 5)])
+
+class TestFacetCodes(unittest.TestCase):
+    """Test facet counts over categorical codes."""
+    
+    def test_counts_of_matched_rows(self):
+        """Test top values are counted over the given rows only, blanks skipped."""
+        from search_index import FacetCodes
+        
+        orgs = pd.Series(["北京", "上海", "", "北京", "深圳", "上海", "北京"]).astype("category")
+        facet = FacetCodes(orgs)
+        self.assertEqual(facet.counts(np.arange(7), 2), [("北京", 3), ("上海", 2)])
+        self.assertEqual(facet.counts(np.array([1, 2, 4]), 5), [("上海", 1), ("深圳", 1)])
+        self.assertEqual(FacetCodes(orgs.astype(object)).counts(np.arange(7), 1), [("北京", 3)])
+    
+    def test_dates_are_counted_by_year(self):
+        """Test a datetime column is faceted by year, missing dates skipped."""
+        from search_index import FacetCodes
+        
+        dates = pd.to_datetime(pd.Series(["2021-03-01", None, "2023-01-01", "2021-12-31"]))
+        self.assertEqual(FacetCodes(dates).counts(np.arange(4), 10), [(2021, 2), (2023, 1)])
+
+class TestAmountIndex(unittest.TestCase):
+    """Test amount ranges and histograms from the sorted amount index."""
+    
+    def setUp(self):
+        """Set up test fixtures."""
+        from search_index import AmountIndex
+        self.index = AmountIndex(pd.Series(["5000", "", "200000", "abc", "0", "200000", "1500000"]))
+    
+    def test_ranges(self):
+        """Test inclusive ranges, with missing amounts counted as 0 only when asked."""
+        self.assertEqual(self.index.rows(100000, 200000).tolist(), [2, 5])
+        self.assertEqual(self.index.rows(None, 5000).tolist(), [0, 1, 3, 4])
+        self.assertEqual(self.index.rows(None, 5000, missing_as_zero=False).tolist(), [0, 4])
+        self.assertEqual(self.index.rows(1, None).tolist(), [0, 2, 5, 6])
+        self.assertEqual(self.index.count(None, 5000), 4)
+    
+    def test_histogram(self):
+        """Test bucket counts over all rows and over a row subset."""
+        counts, missing = self.index.histogram([0, 10000, 1000000])
+        self.assertEqual((counts.tolist(), missing), ([2, 2, 1], 2))
+        counts, missing = self.index.histogram([0, 10000, 1000000], rows=[1, 2, 6])
+        self.assertEqual((counts.tolist(), missing), ([0, 1, 1], 1))
+
+class TestPartyIndex(unittest.TestCase):
+    """Test the party-name index."""
+    
+    def test_split_parties(self):
+        """Test a people field is split into individual names."""
+        from search_index import split_parties
+        
+        self.assertEqual(split_parties("当事人：某某股份有限公司（住所：北京），张三、李四; John Smith"),
+                         ["某某股份有限公司", "张三", "李四", "John Smith"])
+        self.assertEqual(split_parties(None), [])
+    
+    def test_exact_prefix_and_fuzzy_lookup(self):
+        """Test lookups return the rows naming the party, not every substring match."""
+        from search_index import PartyIndex
+        
+        index = PartyIndex(pd.Series(["张三，某某公司", "张三丰、张三", "李四", "某某公司;张小三", None]))
+        self.assertEqual(index.rows_of(index.exact("张三")).tolist(), [0, 1])
+        self.assertEqual([index.names[i] for i in index.prefix("张三")], ["张三", "张三丰"])
+        self.assertEqual([index.names[i] for i in index.fuzzy("张三", 1)], ["张三", "张三丰", "张小三"])
+        self.assertEqual(index.rows_of(index.lookup("JOHN", "exact")).tolist(), [])
+
+    def test_fuzzy_matches_full_scan(self):
+        """Test the deletion neighbourhoods find every name a scan of all names finds."""
+        from search_index import PartyIndex, _edit_distance
+
+        names = ["张三", "张三丰", "张小三", "李四", "三张", "某某公司", "某公司", "某某科技公司", "ab", "a", "abc", "bca"]
+        index = PartyIndex(pd.Series(["，".join(names)]))
+        for query in names + ["张", "某某某公司", "xbc", "", "张三李四"]:
+            for distance in (1, 2):
+                scan = sorted((_edit_distance(query, name, distance), i) for i, name in enumerate(index.names)
+                              if query and _edit_distance(query, name, distance) <= distance)
+                self.assertEqual(index.fuzzy(query, distance), [i for _, i in scan], (query, distance))
+
+class TestLawIndex(unittest.TestCase):
+    """Test the law-article index."""
+    
+    def test_parse_citations(self):
+        """Test articles are read from Chinese and Arabic numerals and abbreviations resolved."""
+        from law_index import article_number, parse_citations, parse_legal_basis
+        
+        self.assertEqual(article_number("第一百零三条"), 103)
+        self.assertEqual(article_number("第十条"), 10)
+        self.assertEqual(article_number("第193条"), 193)
+        self.assertIsNone(article_number("第X条"))
+        self.assertEqual(parse_citations("《证券法》第一百八十条、第193条，《期货交易管理条例》", {"证券法": "中华人民共和国证券法"}),
+                         [("中华人民共和国证券法", 180), ("中华人民共和国证券法", 193), ("期货交易管理条例", None)])
+        self.assertEqual(parse_legal_basis("证券法第193条"), ("证券法", 193))
+    
+    def test_lookup_by_law_and_article(self):
+        """Test full names, abbreviations and numerals of a citation find the same cases."""
+        from law_index import LawIndex
+        
+        laws = pd.Series(["《中华人民共和国证券法》第一百九十三条", "《证券法》第193条", "《证券法》第一百八十条",
+                          "《上市公司信息披露管理办法》（以下简称《办法》）第三条", "《办法》第3条", None])
+        index = LawIndex(laws)
+        self.assertEqual(index.lookup("证券法", 193).tolist(), [0, 1])
+        self.assertEqual(index.lookup("《中华人民共和国证券法》").tolist(), [0, 1, 2])
+        self.assertEqual(index.lookup("办法", 3).tolist(), [3, 4])
+        self.assertEqual(index.lookup("刑法").tolist(), [])
+    
+    def test_query_naming_no_law_falls_back(self):
+        """Test free text and bare articles name no law, so the substring match runs instead."""
+        from law_index import LawIndex, citing_rows, parse_legal_basis
+        
+        index = LawIndex(pd.Series(["《中华人民共和国证券法》第一百九十三条", "《证券法》第一百八十条"]))
+        self.assertIsNone(parse_legal_basis("第193条"))
+        self.assertIsNone(parse_legal_basis("内幕交易", index))
+        self.assertEqual(parse_legal_basis("证券法第193条", index), ("证券法", 193))
+        self.assertEqual(parse_legal_basis("《刑法》", index), ("刑法", None))
+        with patch('law_index.get_law_index', return_value=index):
+            self.assertIsNone(citing_rows("内幕交易"))
+            self.assertEqual(citing_rows("中华人民共和国证券法第180条").tolist(), [1])
+            self.assertEqual(citing_rows("《刑法》").tolist(), [])
+
+class TestSimilarCases(unittest.TestCase):
+    """Test the TF-IDF similar-case model."""
+    
+    def test_cosine_matches_dense_tfidf(self):
+        """Test the scores over the postings equal the cosine of dense TF-IDF rows, also after an update."""
+        from search_index import NgramIndex
+        from similar_cases import TfidfModel, _top_k
+        
+        texts = ["内幕交易违法所得", "内幕交易罚款", "信息披露违法", "", "操纵市场内幕交易"]
+        index = NgramIndex.build(texts[:3]).update(texts[3:], np.arange(3, 5))
+        model = TfidfModel(index, len(texts))
+        dense = np.zeros((len(texts), len(index.codes)))
+        dense[index.rows, model.term_ids] = model.weights
+        norms = np.linalg.norm(dense, axis=1)
+        dense[norms > 0] /= norms[norms > 0, None]
+        # A few postings per chunk, so the bigrams are gathered in several steps
+        with patch('similar_cases.SIMILAR_CHUNK_POSTINGS', 3):
+            for row in range(len(texts)):
+                np.testing.assert_allclose(model.scores(row, max_df=1.0), dense @ dense[row], atol=1e-12)
+            # Bigrams of more than half of the cases (内幕, 幕交, 交易) drop out of the dot products only
+            common = np.count_nonzero(dense, axis=0) > len(texts) / 2
+            self.assertEqual(np.count_nonzero(common), 3)
+            for row in range(len(texts)):
+                np.testing.assert_allclose(model.scores(row), dense[:, ~common] @ dense[row, ~common], atol=1e-12)
+        rows, _ = _top_k(model.scores(0, max_df=1.0), 2)
+        self.assertEqual(rows.tolist(), [0, 1])
+
+class TestNearDuplicates(unittest.TestCase):
+    """Test the MinHash near-duplicate clusters."""
+    
+    def test_clusters_near_duplicates_only(self):
+        """Test reformatted copies cluster together while different and short texts stay apart."""
+        from near_duplicates import DuplicateClusters, minhash_signatures, normalize_text
+        
+        base = "".join(f"当事人{i}号公司未按规定披露重大事项违反证券法第{i}条" for i in range(8))
+        other = "".join(f"某基金{i}号在第{i}季度操纵市场价格获利{i}万元" for i in range(8))
+        texts = [base, other, "短文本", base.replace("公司", "公司，\n", 3), other[::-1], "短文本"]
+        clusters = DuplicateClusters(minhash_signatures([normalize_text(text) for text in texts]))
+        self.assertEqual(len(clusters), 1)
+        self.assertEqual(clusters.members(0).tolist(), [0, 3])
+        self.assertEqual(clusters.cluster_of.tolist(), [0, -1, -1, 0, -1, -1])
+
+class TestCaseRecords(unittest.TestCase):
+    """Test the columnar CaseDetail records of the search responses."""
+    
+    def setUp(self):
+        # Non-string ids, a missing 文号, categorical 机构 and a missing amount;
+        # 处罚类型, province and industry are absent
+        self.page = pd.DataFrame({
+            "链接": [101, 102, 103],
+            "名称": ["案一", "案二", "案三"],
+            "文号": ["〔2023〕1号", None, "〔2023〕3号"],
+            "发文日期": ["2023-01-01", "2023-01-02", "2023-01-03"],
+            "机构": pd.Categorical(["北京", "上海", "北京"]),
+            "内容": ["正文一", "正文二", "正文三"],
+            "罚款金额": [1000.0, np.nan, 50.5],
+            "people": ["张三", "李四", "王五"],
+            "event": ["内幕交易", "信息披露", "操纵市场"],
+            "law": ["证券法", "证券法", "刑法"],
+            "penalty": ["罚款", "警告", "罚款"],
+            "category": ["行政处罚", "监管措施", "行政处罚"],
+        })
+    
+    @staticmethod
+    def search_case(row):
+        """A /search case as the iterrows loop built it."""
+        from main import CaseDetail
+        amount = row.get('amount', row.get('罚款金额', 0))
+        return CaseDetail(
+            id=str(row.get('链接', '')), title=str(row.get('名称', '')), name=str(row.get('名称', '')),
+            docNumber=str(row.get('文号', '')), date=str(row.get('date', row.get('发文日期', ''))),
+            org=str(row.get('org', row.get('机构', ''))), content=str(row.get('内容', '')),
+            penalty=str(row.get('category', '')), amount=float(amount) if pd.notna(amount) else 0,
+            party=str(row.get('people', '')), violationFacts=str(row.get('event', '')),
+            penaltyBasis=str(row.get('law', '')), penaltyDecision=str(row.get('penalty', '')),
+            category=str(row.get('category', '')), region=str(row.get('province', '')),
+            industry=str(row.get('industry', '')))
+    
+    @staticmethod
+    def enhanced_case(row):
+        """An /api/search-enhanced case as the iterrows loop built it."""
+        from main import CaseDetail
+        return CaseDetail(
+            id=str(row.get('链接', '')), title=str(row.get('名称', '')), name=str(row.get('名称', '')),
+            docNumber=str(row.get('文号', '')), date=str(row.get('发文日期', '')),
+            org=row.get('机构', ''), content=row.get('内容', ''), penalty=row.get('处罚类型', ''),
+            amount=row.get('罚款金额', 0), party=row.get('people', ''), violationFacts=row.get('event', ''),
+            penaltyBasis=row.get('law', ''), penaltyDecision=row.get('penalty', ''),
+            category=row.get('category', ''), region=row.get('province', ''), industry=row.get('industry', ''))
+    
+    def assert_records(self, records, expected):
+        from main import CaseDetail
+        self.assertEqual(len(records), len(expected))
+        for record, case in zip(records, expected):
+            self.assertEqual(list(record), list(CaseDetail.model_fields))
+            CaseDetail.model_validate(record)
+            self.assertEqual(json.loads(json.dumps(record)), json.loads(case.model_dump_json()))
+    
+    def test_search_records_match_case_details(self):
+        """Test /search records equal the validated CaseDetail of each row, missing amounts as 0."""
+        from main import SEARCH_CASE_COLUMNS, case_records
+        
+        intersection = self.page.assign(date=["2023-01-05"] * 3, org=pd.Categorical(["广东", "广东", "深圳"]),
+                                        amount=[np.nan, 20.0, 30.0])
+        for page in (self.page, intersection, self.page.drop(columns=["罚款金额"])):
+            expected = [self.search_case(row) for _, row in page.iterrows()]
+            self.assert_records(case_records(page, SEARCH_CASE_COLUMNS), expected)
+        self.assertEqual(case_records(self.page, SEARCH_CASE_COLUMNS)[1]["amount"], 0.0)
+    
+    def test_enhanced_records_match_case_details(self):
+        """Test /api/search-enhanced records equal the validated CaseDetail of each row, missing amounts as null."""
+        from main import ENHANCED_CASE_COLUMNS, case_records
+        
+        for page in (self.page, self.page.drop(columns=["罚款金额"])):
+            expected = [self.enhanced_case(row) for _, row in page.iterrows()]
+            self.assert_records(case_records(page, ENHANCED_CASE_COLUMNS, missing_amount=None), expected)
+        self.assertIsNone(case_records(self.page, ENHANCED_CASE_COLUMNS, missing_amount=None)[1]["amount"])
+
+class TestCsvExport(unittest.TestCase):
+    """Test the chunked CSV exports."""
+    
+    def setUp(self):
+        self.df = pd.DataFrame({
+            "链接": [f"https://example.com/{i}" for i in range(5)],
+            "名称": [f"案{i}" for i in range(5)],
+            "机构": ["北京", "上海", "北京", "深圳", "上海"],
+            "罚款金额": [1000.0, np.nan, 2.5, 0.0, 30.0],
+            "law": ["证券法", None, "刑法", "证券法", "公司法"],
+            "extra": range(5),
+        })
+    
+    @staticmethod
+    def add_texts(df, name="analysis", load=False):
+        return df.assign(内容=[f"正文,{link}" for link in df["链接"]])
+    
+    def csv_bytes(self, df, prepare=None, chunk_rows=2):
+        from main import csv_chunks
+        return list(csv_chunks(df, prepare, chunk_rows))
+    
+    def test_chunks_equal_single_csv(self):
+        """Test the BOM comes once and the header only with the first chunk, as a single to_csv."""
+        chunks = self.csv_bytes(self.df)
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(chunks[0], "\ufeff".encode("utf-8"))
+        self.assertEqual(sum(chunk.count("\ufeff".encode("utf-8")) for chunk in chunks), 1)
+        self.assertEqual(sum(chunk.count("名称".encode("utf-8")) for chunk in chunks), 1)
+        self.assertEqual(b"".join(chunks), self.df.to_csv(index=False).encode("utf-8-sig"))
+    
+    def test_empty_frame_is_header_only(self):
+        """Test an empty frame still exports its header."""
+        empty = self.df.iloc[:0]
+        self.assertEqual(b"".join(self.csv_bytes(empty)), empty.to_csv(index=False).encode("utf-8-sig"))
+        self.assertEqual(b"".join(self.csv_bytes(pd.DataFrame())), "\ufeff\n".encode("utf-8"))
+    
+    def test_prepared_chunks_keep_columns(self):
+        """Test the search and diff exports select and rename the same columns in every chunk."""
+        from main import search_export_chunk, select_upload_fields
+        
+        for prepare in (search_export_chunk, select_upload_fields):
+            with patch('main.with_case_texts', side_effect=self.add_texts):
+                exported = b"".join(self.csv_bytes(self.df, prepare))
+                expected = prepare(self.df).to_csv(index=False).encode("utf-8-sig")
+            self.assertEqual(exported, expected)
+        with patch('main.with_case_texts', side_effect=self.add_texts):
+            self.assertEqual(list(search_export_chunk(self.df.iloc[:2]).columns),
+                             ["发文名称", "发文地区", "罚款金额", "案例详情", "法律依据", "案例链接"])
+    
+    def test_prepare_errors(self):
+        """Test an error in the first chunk is raised before the response and a later one marks the file truncated."""
+        from main import CSV_EXPORT_ABORTED, csv_response
+        
+        def failing(after):
+            calls = []
+            def prepare(chunk):
+                calls.append(chunk)
+                if len(calls) > after:
+                    raise ValueError("texts unavailable")
+                return chunk
+            return prepare
+        
+        with self.assertRaises(ValueError):
+            csv_response(self.df, "export.csv", failing(0))
+        
+        async def body(response):
+            return b"".join([chunk async for chunk in response.body_iterator])
+        
+        response = csv_response(self.df, "export.csv", failing(1), chunk_rows=2)
+        with self.assertLogs('main', level='ERROR'):
+            content = asyncio.run(body(response))
+        self.assertEqual(content, self.df.iloc[:2].to_csv(index=False).encode("utf-8-sig") + CSV_EXPORT_ABORTED.encode("utf-8"))
+
 class TestAPIEndpoints(unittest.TestCase):
     """Test API endpoints functionality."""
     
@@ -286,6 +1322,29 @@ class TestSuite:
         # Add unit test classes
         suite.addTests(loader.loadTestsFromTestCase(TestWebCrawlerUtilities))
         suite.addTests(loader.loadTestsFromTestCase(TestDataProcessing))
+        suite.addTests(loader.loadTestsFromTestCase(TestDataServiceSnapshot))
+        suite.addTests(loader.loadTestsFromTestCase(TestDatasetRegistry))
+        suite.addTests(loader.loadTestsFromTestCase(TestIncrementalShardLoading))
+        suite.addTests(loader.loadTestsFromTestCase(TestShardCompaction))
+        suite.addTests(loader.loadTestsFromTestCase(TestPublishDateNormalization))
+        suite.addTests(loader.loadTestsFromTestCase(TestDatasetSchema))
+        suite.addTests(loader.loadTestsFromTestCase(TestMaterializedIntersection))
+        suite.addTests(loader.loadTestsFromTestCase(TestHotColdColumns))
+        suite.addTests(loader.loadTestsFromTestCase(TestSharedDatasets))
+        suite.addTests(loader.loadTestsFromTestCase(TestNgramSearchIndex))
+        suite.addTests(loader.loadTestsFromTestCase(TestDateIndex))
+        suite.addTests(loader.loadTestsFromTestCase(TestKeyIndex))
+        suite.addTests(loader.loadTestsFromTestCase(TestCursorPagination))
+        suite.addTests(loader.loadTestsFromTestCase(TestQueryResultCache))
+        suite.addTests(loader.loadTestsFromTestCase(TestSearchPlanner))
+        suite.addTests(loader.loadTestsFromTestCase(TestFacetCodes))
+        suite.addTests(loader.loadTestsFromTestCase(TestAmountIndex))
+        suite.addTests(loader.loadTestsFromTestCase(TestPartyIndex))
+        suite.addTests(loader.loadTestsFromTestCase(TestLawIndex))
+        suite.addTests(loader.loadTestsFromTestCase(TestSimilarCases))
+        suite.addTests(loader.loadTestsFromTestCase(TestNearDuplicates))
+        suite.addTests(loader.loadTestsFromTestCase(TestCaseRecords))
+        suite.addTests(loader.loadTestsFromTestCase(TestCsvExport))
         suite.addTests(loader.loadTestsFromTestCase(TestContentAnalysis))
         
         # Run tests
@@ -1,11 +1,61 @@
+import bisect
 import glob
 import os
 import glob
+import json
+import threading
+import warnings
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from typing import Optional
 
+from dataset_registry import registry
+from shared_datasets import SharedDatasetStore
+
 # Lazy import pandas to reduce memory usage during startup
 pd = None
 
+# Columnar snapshot cache for CSV shard folders
+SNAPSHOT_DIRNAME = ".snapshot"
+SNAPSHOT_ENABLED = os.getenv("CSV_SNAPSHOT_ENABLED", "true").lower() != "false"
+SNAPSHOT_SIGNATURE_KEY = b"dbcsrc_shard_signature"
+
+# Memory-mapped Arrow copies of the datasets shared by all worker processes
+SHARED_DATASETS_ENABLED = os.getenv("SHARED_DATASETS_ENABLED", "false").lower() == "true"
+SHARED_DATASETS_DIRNAME = ".published"
+
+# Compacted shard families (see shard_compaction.py)
+COMPACTED_SUFFIX = "-compacted.csv.gz"
+COMPACTION_MANIFEST_SUFFIX = "-compacted.manifest.json"
+
+# Typed helper columns derived at load time; never written back to CSV
+PUBLISH_DATE_COLUMN = "发文日期_dt"
+DERIVED_COLUMNS = [PUBLISH_DATE_COLUMN]
+
+# Cold columns: full case text, loaded apart from the case metadata and
+# fetched by 链接 only when a result page or export needs it
+TEXT_COLUMNS = ["内容"]
+TEXT_KEY_COLUMN = "链接"
+TEXT_STORE_ROW_GROUP_SIZE = 256
+
+# Declared column dtypes of the case tables, applied at load time. Columns a
+# dataset does not have are skipped; "string" is Arrow-backed when pyarrow is
+# installed and stays object otherwise. Dates are kept as PUBLISH_DATE_COLUMN.
+# 内容 stays object: long Chinese text takes 3 bytes per character as UTF-8 in
+# Arrow but 2 in CPython, so Arrow only pays off for short strings like 名称.
+DATASET_SCHEMAS = {
+    "detail": {"机构": "category", "名称": "string"},
+    "analysis": {"机构": "category", "名称": "string"},
+    "cat": {"amount": "float64", "category": "category", "province": "category", "industry": "category"},
+    "split": {"org": "category"},
+}
+# The metadata-only datasets share the schema of their full counterparts
+DATASET_SCHEMAS["detail_meta"] = DATASET_SCHEMAS["detail"]
+DATASET_SCHEMAS["analysis_meta"] = DATASET_SCHEMAS["analysis"]
+
+# Memory of each dataset before and after its schema was applied
+schema_memory_stats = {}
+
 def get_pandas():
     """Lazy import pandas to reduce startup memory usage"""
     global pd
@@ -19,7 +69,421 @@ def get_pandas():
     return pd
 
 
-def get_csvdf(penfolder: str, beginwith: str, include_filename: bool = False):
+def get_numpy():
+    """Lazy import numpy"""
+    import numpy as np
+    return np
+
+
+def get_pyarrow():
+    """Import pyarrow lazily; returns None when it is not installed"""
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.parquet
+        return pyarrow
+    except ImportError:
+        return None
+
+
+def get_shard_signature(files):
+    """
+    Build a signature of a shard set from file names, sizes and mtimes.
+    
+    Args:
+        files: List of shard file paths
+        
+    Returns:
+        List of [basename, size, mtime_ns] entries sorted by basename
+    """
+    signature = []
+    for filepath in files:
+        stat = os.stat(filepath)
+        signature.append([os.path.basename(filepath), stat.st_size, stat.st_mtime_ns])
+    return sorted(signature)
+
+
+def get_appended_shards(old_signature, new_signature):
+    """
+    Find the shards added since an earlier signature of the same family.
+    
+    Args:
+        old_signature: Signature the loaded data corresponds to
+        new_signature: Current signature of the shard family
+        
+    Returns:
+        Sorted names of the new shards, or None when the change is not
+        append-only (a shard was rewritten or removed, no shard was added, or
+        a new shard sorts before an existing one)
+    """
+    old = {entry[0]: list(entry) for entry in old_signature}
+    new = {entry[0]: list(entry) for entry in new_signature}
+    if any(new.get(name) != entry for name, entry in old.items()):
+        return None
+    added = sorted(name for name in new if name not in old)
+    if not added or (old and added[0] < max(old)):
+        return None
+    return added
+
+
+def is_metadata_column(name) -> bool:
+    """Column projection keeping everything but the full-text columns"""
+    return name not in TEXT_COLUMNS
+
+
+def _column_selector(columns):
+    """Turn a columns= projection (list of names or predicate) into a predicate"""
+    if callable(columns):
+        return columns
+    return set(columns).__contains__
+
+
+def _snapshot_path(penfolder: str, beginwith: str, include_filename: bool) -> str:
+    """Path of the Parquet snapshot for one shard family"""
+    suffix = "_src" if include_filename else ""
+    return os.path.join(penfolder, SNAPSHOT_DIRNAME, f"{beginwith}{suffix}.parquet")
+
+
+def _text_store_path(penfolder: str, beginwith: str) -> str:
+    """Path of the 链接-sorted full-text store of one shard family"""
+    return os.path.join(penfolder, SNAPSHOT_DIRNAME, f"{beginwith}_text.parquet")
+
+
+def _prepare_snapshot_frame(df):
+    """
+    Make object columns Parquet-safe.
+    
+    Shards written at different times can parse the same column as numbers in
+    one file and strings in another, which leaves mixed values after concat.
+    Non-null values of such columns are converted to strings.
+    """
+    pandas = get_pandas()
+    for col in df.columns:
+        if df[col].dtype == object:
+            inferred = pandas.api.types.infer_dtype(df[col], skipna=True)
+            if inferred not in ("string", "empty"):
+                df[col] = df[col].map(lambda v: v if pandas.isna(v) else str(v))
+    return df
+
+
+def read_snapshot_signature(penfolder: str, beginwith: str, include_filename: bool):
+    """Signature stored in the Parquet snapshot of a shard family, or None"""
+    pyarrow = get_pyarrow()
+    if not SNAPSHOT_ENABLED or pyarrow is None:
+        return None
+    path = _snapshot_path(penfolder, beginwith, include_filename)
+    if not os.path.exists(path):
+        return None
+    try:
+        metadata = pyarrow.parquet.read_schema(path).metadata or {}
+        stored = metadata.get(SNAPSHOT_SIGNATURE_KEY)
+        return json.loads(stored) if stored is not None else None
+    except Exception as e:
+        print(f"Failed to read snapshot {path}: {e}")
+        return None
+
+
+def load_snapshot(penfolder: str, beginwith: str, include_filename: bool, signature, columns=None):
+    """
+    Load the Parquet snapshot of a shard family if it matches the signature.
+    
+    Args:
+        columns: Optional projection, a list of column names or a predicate;
+            only the selected column chunks are read from the file
+    
+    Returns:
+        DataFrame, or None when there is no usable snapshot
+    """
+    pyarrow = get_pyarrow()
+    if not SNAPSHOT_ENABLED or pyarrow is None:
+        return None
+    path = _snapshot_path(penfolder, beginwith, include_filename)
+    if not os.path.exists(path):
+        return None
+    try:
+        schema = pyarrow.parquet.read_schema(path)
+        stored = (schema.metadata or {}).get(SNAPSHOT_SIGNATURE_KEY)
+        if stored is None or json.loads(stored) != signature:
+            return None
+        if columns is not None:
+            selected = _column_selector(columns)
+            columns = [name for name in schema.names if selected(name)]
+        return pyarrow.parquet.read_table(path, columns=columns).to_pandas()
+    except Exception as e:
+        print(f"Failed to read snapshot {path}: {e}")
+        return None
+
+
+def save_snapshot(df, penfolder: str, beginwith: str, include_filename: bool, signature):
+    """
+    Write the Parquet snapshot of a shard family, tagged with its signature.
+    
+    The file is written under a temporary name and swapped in with os.replace,
+    so concurrent readers never see a partial snapshot.
+    """
+    pyarrow = get_pyarrow()
+    if not SNAPSHOT_ENABLED or pyarrow is None:
+        return False
+    path = _snapshot_path(penfolder, beginwith, include_filename)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        table = pyarrow.Table.from_pandas(df, preserve_index=False)
+        metadata = dict(table.schema.metadata or {})
+        metadata[SNAPSHOT_SIGNATURE_KEY] = json.dumps(signature).encode("utf-8")
+        table = table.replace_schema_metadata(metadata)
+        pyarrow.parquet.write_table(table, tmp_path, compression="zstd")
+        os.replace(tmp_path, path)
+        return True
+    except Exception as e:
+        print(f"Failed to write snapshot {path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+
+def save_text_store(df, penfolder: str, beginwith: str, signature):
+    """
+    Write the full-text store of a shard family: 链接 and the text columns,
+    one row per 链接 (the last one wins), sorted by 链接 in small row groups.
+    
+    Sorting lets read_text_store pick the row groups holding the requested
+    links from the row-group statistics, so a page of texts is read without
+    decompressing the whole column.
+    """
+    pyarrow = get_pyarrow()
+    text_columns = [col for col in TEXT_COLUMNS if col in df.columns]
+    if not SNAPSHOT_ENABLED or pyarrow is None or TEXT_KEY_COLUMN not in df.columns or not text_columns:
+        return False
+    path = _text_store_path(penfolder, beginwith)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        texts = df[[TEXT_KEY_COLUMN] + text_columns].drop_duplicates(TEXT_KEY_COLUMN, keep="last")
+        texts = texts.astype(str).sort_values(TEXT_KEY_COLUMN)
+        table = pyarrow.Table.from_pandas(texts, preserve_index=False)
+        table = table.replace_schema_metadata({SNAPSHOT_SIGNATURE_KEY: json.dumps(signature).encode("utf-8")})
+        pyarrow.parquet.write_table(table, tmp_path, compression="zstd",
+                                    row_group_size=TEXT_STORE_ROW_GROUP_SIZE)
+        os.replace(tmp_path, path)
+        return True
+    except Exception as e:
+        print(f"Failed to write text store {path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+
+def read_text_store(penfolder: str, beginwith: str, links, signature):
+    """
+    Read the texts of the given links from the full-text store.
+    
+    Returns:
+        DataFrame of 链接 and the text columns, or None when the store is
+        missing or does not match the signature
+    """
+    pyarrow = get_pyarrow()
+    if not SNAPSHOT_ENABLED or pyarrow is None:
+        return None
+    path = _text_store_path(penfolder, beginwith)
+    if not os.path.exists(path):
+        return None
+    try:
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        metadata = parquet_file.metadata
+        stored = (parquet_file.schema_arrow.metadata or {}).get(SNAPSHOT_SIGNATURE_KEY)
+        if stored is None or json.loads(stored) != signature:
+            return None
+        links = sorted({str(link) for link in links})
+        
+        # Each link can only be in the last row group starting at or before it
+        key_index = parquet_file.schema_arrow.get_field_index(TEXT_KEY_COLUMN)
+        starts = []
+        for i in range(metadata.num_row_groups):
+            statistics = metadata.row_group(i).column(key_index).statistics
+            if statistics is None or not statistics.has_min_max:
+                starts = None
+                break
+            starts.append(statistics.min)
+        if starts is None:
+            groups = list(range(metadata.num_row_groups))
+        else:
+            groups = sorted({max(bisect.bisect_right(starts, link) - 1, 0) for link in links})
+        table = parquet_file.read_row_groups(groups) if links else parquet_file.schema_arrow.empty_table()
+        table = table.filter(pyarrow.compute.is_in(table[TEXT_KEY_COLUMN], value_set=pyarrow.array(links, pyarrow.string())))
+        return table.to_pandas()
+    except Exception as e:
+        print(f"Failed to read text store {path}: {e}")
+        return None
+
+
+def _text_store_current(penfolder: str, beginwith: str, signature) -> bool:
+    """True when the text store of a shard family matches the signature"""
+    pyarrow = get_pyarrow()
+    path = _text_store_path(penfolder, beginwith)
+    if pyarrow is None or not os.path.exists(path):
+        return False
+    try:
+        stored = (pyarrow.parquet.read_schema(path).metadata or {}).get(SNAPSHOT_SIGNATURE_KEY)
+        return stored is not None and json.loads(stored) == signature
+    except Exception:
+        return False
+
+
+def get_csrc2_dir() -> str:
+    """Absolute path of the csrc2 data directory, independent of the working directory"""
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    project_root = os.path.dirname(backend_dir)
+    return os.path.join(project_root, "data", "penalty", "csrc2")
+
+
+def get_csrc2_tempdir() -> str:
+    """Absolute path of the csrc2 temp directory"""
+    return os.path.join(get_csrc2_dir(), "temp")
+
+
+def get_compacted_path(penfolder: str, beginwith: str) -> str:
+    """Path of the compacted file of a shard family.
+    
+    The "-" sorts before the digits and "_" of the timestamped shard names, so
+    the compacted rows always come first and later shards append after them.
+    """
+    return os.path.join(penfolder, f"{beginwith}{COMPACTED_SUFFIX}")
+
+
+def get_compaction_manifest_path(penfolder: str, beginwith: str) -> str:
+    """Path of the manifest describing the compacted file of a shard family"""
+    return os.path.join(penfolder, f"{beginwith}{COMPACTION_MANIFEST_SUFFIX}")
+
+
+def read_compaction_manifest(penfolder: str, beginwith: str):
+    """Compaction manifest of a shard family, or None when it was never compacted"""
+    path = get_compaction_manifest_path(penfolder, beginwith)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Failed to read compaction manifest {path}: {e}")
+        return None
+
+
+def list_shard_files(penfolder: str, beginwith: str):
+    """
+    List the shard files of a family in load order.
+    
+    Plain and gzip-compressed CSV shards are both picked up. Shards that the
+    compaction manifest records as merged are left out, but only while the
+    compacted file on disk is the one the manifest was written for; during a
+    swap readers may see the old and new files side by side, never a file
+    without its rows.
+    
+    Args:
+        penfolder: Path to the folder containing the shards
+        beginwith: String that shard names begin with
+        
+    Returns:
+        Sorted list of shard file paths
+    """
+    files = [f for f in glob.glob(os.path.join(penfolder, f"{beginwith}*")) if f.endswith((".csv", ".csv.gz"))]
+    manifest = read_compaction_manifest(penfolder, beginwith)
+    if manifest:
+        compacted_path = get_compacted_path(penfolder, beginwith)
+        try:
+            stat = os.stat(compacted_path)
+            current = [stat.st_size, stat.st_mtime_ns] == [manifest.get("size"), manifest.get("mtimeNs")]
+        except OSError:
+            current = False
+        if current:
+            merged = set(manifest.get("shards", []))
+            files = [f for f in files if os.path.basename(f) not in merged]
+    return sorted(files)
+
+
+def get_folder_signature(penfolder: str, beginwith: str):
+    """Shard signature of the CSV files in a folder that begin with a specific string"""
+    if not os.path.exists(penfolder):
+        return []
+    return get_shard_signature(list_shard_files(penfolder, beginwith))
+
+
+# Shared pool for shard reads, reused across get_csvdf calls
+CSV_LOADER_WORKERS = int(os.getenv("CSV_LOADER_WORKERS", str(min(16, (os.cpu_count() or 1) + 4))))
+FILE_SEARCH_TIMEOUT = 30  # seconds
+FILE_READ_TIMEOUT = 20  # seconds per file
+_loader_executor = None
+_loader_executor_lock = threading.Lock()
+
+# Per-shard timings of the most recent load of each shard family
+shard_load_stats = {}
+
+
+def get_loader_executor():
+    """Get the bounded thread pool shared by all shard loads"""
+    global _loader_executor
+    with _loader_executor_lock:
+        if _loader_executor is None:
+            _loader_executor = ThreadPoolExecutor(
+                max_workers=CSV_LOADER_WORKERS,
+                thread_name_prefix="csv-loader"
+            )
+    return _loader_executor
+
+
+def read_csv_shards(files, include_filename: bool = False, dtype=None, columns=None):
+    """
+    Read CSV shards concurrently on the shared loader pool.
+    
+    Args:
+        files: List of shard file paths
+        include_filename: If True, adds a 'source_filename' column to each shard
+        dtype: Optional dtype passed to read_csv, e.g. str to keep the raw text
+        columns: Optional projection (list of names or predicate); columns a
+            shard does not have are ignored
+        
+    Returns:
+        Tuple of (list of DataFrames in file order, per-shard timings, number of skipped files)
+    """
+    usecols = _column_selector(columns) if columns is not None else None
+    
+    def read_single_file(filepath):
+        started = time.time()
+        df = get_pandas().read_csv(filepath, encoding='utf-8-sig', dtype=dtype, usecols=usecols)
+        return df, time.time() - started
+    
+    executor = get_loader_executor()
+    futures = [(filepath, executor.submit(read_single_file, filepath)) for filepath in files]
+    
+    dflist = []
+    timings = []
+    skipped_files = 0
+    for i, (filepath, future) in enumerate(futures):
+        filename = os.path.basename(filepath)
+        try:
+            df, elapsed = future.result(timeout=FILE_READ_TIMEOUT)
+        except FutureTimeoutError:
+            future.cancel()
+            print(f"Timeout reading {filepath}, skipping")
+            skipped_files += 1
+            continue
+        except Exception as e:
+            print(f"Error reading {filepath}: {e}")
+            skipped_files += 1
+            continue
+        
+        print(f"Read file {i+1}/{len(files)}: {filename} ({len(df)} rows in {elapsed:.2f} seconds)")
+        timings.append({"file": filename, "rows": len(df), "seconds": round(elapsed, 3)})
+        
+        # Add filename column if requested
+        if include_filename and not df.empty:
+            df['source_filename'] = filename
+        
+        dflist.append(df)
+    
+    return dflist, timings, skipped_files
+
+
+def get_csvdf(penfolder: str, beginwith: str, include_filename: bool = False, columns=None):
     """
     Load and concatenate CSV files from a folder that begin with a specific string.
     
@@ -27,14 +491,22 @@ def get_csvdf(penfolder: str, beginwith: str, include_filename: bool = False):
         penfolder: Path to the folder containing CSV files
         beginwith: String that filenames should begin with
         include_filename: If True, adds a 'source_filename' column to track which file each row came from
+        columns: Optional projection, a list of column names or a predicate
+            such as is_metadata_column; unselected columns are never loaded
         
     Returns:
         Concatenated DataFrame from all matching CSV files
+        
+    Shards are read concurrently on a shared thread pool, in file name order; a
+    shard that fails or exceeds FILE_READ_TIMEOUT is skipped. When pyarrow is
+    installed, the concatenated result is kept as a Parquet snapshot in the
+    folder's .snapshot directory and reused until a shard is added, removed or
+    modified (by name, size or mtime). When shards were only added, just the
+    new files are parsed and appended to the snapshot. A full load also writes
+    the 链接-sorted text store read by read_text_store. A projected load reads
+    only the selected columns of the snapshot, building the snapshot first
+    when it is stale.
     """
-    import time
-    import threading
-    from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
-    
     # Check if directory exists first to avoid long waits
     if not os.path.exists(penfolder):
         print(f"Directory does not exist: {penfolder}")
@@ -42,19 +514,18 @@ def get_csvdf(penfolder: str, beginwith: str, include_filename: bool = False):
     
     def search_files():
         """Search for CSV files with timeout protection"""
-        return glob.glob(os.path.join(penfolder, f"{beginwith}*.csv"), recursive=False)
+        return list_shard_files(penfolder, beginwith)
     
     try:
         start_time = time.time()
         
-        # Use ThreadPoolExecutor with timeout for file search
-        with ThreadPoolExecutor(max_workers=1) as executor:
-            future = executor.submit(search_files)
-            try:
-                files = future.result(timeout=30)  # Increased to 30 second timeout for file search
-            except FutureTimeoutError:
-                print(f"File search timed out after 30 seconds in {penfolder}")
-                return get_pandas().DataFrame()
+        # Run the file search on the shared pool with timeout
+        future = get_loader_executor().submit(search_files)
+        try:
+            files = sorted(future.result(timeout=FILE_SEARCH_TIMEOUT))
+        except FutureTimeoutError:
+            print(f"File search timed out after {FILE_SEARCH_TIMEOUT} seconds in {penfolder}")
+            return get_pandas().DataFrame()
         
         search_time = time.time() - start_time
         print(f"File search took {search_time:.2f} seconds, found {len(files)} files")
@@ -63,38 +534,61 @@ def get_csvdf(penfolder: str, beginwith: str, include_filename: bool = False):
             print(f"No CSV files found matching pattern: {beginwith}*.csv in {penfolder}")
             return get_pandas().DataFrame()
         
-        dflist = []
+        # Serve from the columnar snapshot when no shard was added, removed or modified
+        signature = get_shard_signature(files)
+        snapshot_df = load_snapshot(penfolder, beginwith, include_filename, signature, columns)
+        if snapshot_df is not None:
+            print(f"Loaded {len(snapshot_df)} rows from snapshot in {time.time() - start_time:.2f} seconds")
+            has_text = any(col in snapshot_df.columns for col in TEXT_COLUMNS)
+            if has_text and not _text_store_current(penfolder, beginwith, signature):
+                save_text_store(snapshot_df, penfolder, beginwith, signature)
+            return snapshot_df
         
-        for i, filepath in enumerate(files):
-            try:
-                print(f"Reading file {i+1}/{len(files)}: {os.path.basename(filepath)}")
-                
-                # Use ThreadPoolExecutor with timeout for individual file reading
-                def read_single_file():
-                    return get_pandas().read_csv(filepath, encoding='utf-8-sig')
-                
-                with ThreadPoolExecutor(max_workers=1) as executor:
-                    future = executor.submit(read_single_file)
-                    try:
-                        df = future.result(timeout=20)  # Increased to 20 second timeout per file
-                        
-                        # Add filename column if requested
-                        if include_filename and not df.empty:
-                            filename = os.path.basename(filepath)
-                            df['source_filename'] = filename
-                        
-                        dflist.append(df)
-                    except FutureTimeoutError:
-                        print(f"Timeout reading {filepath}, skipping")
-                        continue
-                    
-            except Exception as e:
-                print(f"Error reading {filepath}: {e}")
-                continue
+        if columns is not None:
+            if SNAPSHOT_ENABLED and get_pyarrow() is not None:
+                # Build the snapshot once, then serve projections from it
+                full_df = get_csvdf(penfolder, beginwith, include_filename)
+                selected = _column_selector(columns)
+                return full_df[[col for col in full_df.columns if selected(col)]]
+            dflist, timings, skipped_files = read_csv_shards(files, include_filename, columns=columns)
+            if not dflist:
+                return get_pandas().DataFrame()
+            result_df = get_pandas().concat(dflist, ignore_index=True)
+            print(f"Loaded {len(result_df)} rows ({len(result_df.columns)} columns) from {len(dflist)} files in {time.time() - start_time:.2f} seconds")
+            return result_df
+        
+        # Only parse the shards added since the snapshot was written
+        base_df = None
+        files_to_read = files
+        added = None
+        stored_signature = read_snapshot_signature(penfolder, beginwith, include_filename)
+        if stored_signature is not None:
+            added = get_appended_shards(stored_signature, signature)
+        if added:
+            base_df = load_snapshot(penfolder, beginwith, include_filename, stored_signature)
+            if base_df is not None:
+                files_to_read = [os.path.join(penfolder, name) for name in added]
+                print(f"Snapshot has {len(base_df)} rows, reading {len(added)} new files")
+        
+        dflist, timings, skipped_files = read_csv_shards(files_to_read, include_filename)
+        shard_load_stats[f"{penfolder}:{beginwith}"] = {
+            "files": timings,
+            "skipped": skipped_files,
+            "snapshotRows": len(base_df) if base_df is not None else 0,
+            "totalSeconds": round(time.time() - start_time, 3)
+        }
+        if base_df is not None:
+            dflist.insert(0, base_df)
         
         if len(dflist) > 0:
             result_df = get_pandas().concat(dflist, ignore_index=True)
-            print(f"Successfully loaded {len(result_df)} rows from {len(dflist)} files")
+            print(f"Successfully loaded {len(result_df)} rows from {len(dflist)} files in {time.time() - start_time:.2f} seconds")
+            if SNAPSHOT_ENABLED and get_pyarrow() is not None:
+                result_df = _prepare_snapshot_frame(result_df)
+                # Never snapshot a partial load, it would hide the skipped shards
+                if skipped_files == 0:
+                    save_snapshot(result_df, penfolder, beginwith, include_filename, signature)
+                    save_text_store(result_df, penfolder, beginwith, signature)
             return result_df
         else:
             print("No data loaded from any files")
@@ -105,287 +599,752 @@ def get_csvdf(penfolder: str, beginwith: str, include_filename: bool = False):
         return get_pandas().DataFrame()
 
 
-def get_csrc2detail():
+def normalize_publish_dates(values):
     """
-    Get CSRC2 detail data from CSV files.
+    Normalize a column of publication dates in one vectorized pass.
+    
+    Numeric values (or digit strings) are Unix timestamps, in milliseconds
+    when larger than 1e10 and in seconds otherwise; anything else is parsed as
+    a free-form date string. Each distinct string is parsed only once.
     
+    Args:
+        values: Series of raw date values as read from the shards
+        
     Returns:
-        DataFrame with CSRC2 detail data
+        Tuple of (display Series of 'YYYY-MM-DD' strings, "" when the value is
+        blank or unparseable, and the matching datetime64 Series at midnight)
     """
-    # Use absolute path to ensure it works from any working directory
-    import os
-    # Get the project root directory (dbcsrc)
-    current_file = os.path.abspath(__file__)
-    backend_dir = os.path.dirname(current_file)
-    project_root = os.path.dirname(backend_dir)
-    pencsrc2 = os.path.join(project_root, "data", "penalty", "csrc2")
-    print(f"Looking for CSRC2 data in: {pencsrc2}")
-    pendf = get_csvdf(pencsrc2, "csrcdtlall")
-    
-    if not pendf.empty:
-        # Format date - handle both timestamp and date formats
-        if "发文日期" in pendf.columns:
-            # First try to convert timestamps (numeric values) to datetime
-            def convert_date(date_val):
-                if get_pandas().isna(date_val) or date_val == "":
-                    return ""
-                
-                # If it's a numeric timestamp, convert it
+    pandas = get_pandas()
+    parsed = pandas.Series(pandas.NaT, index=values.index, dtype="datetime64[ns]")
+    
+    blank = values.isna()
+    text = values.astype(str)
+    if values.dtype == object:
+        blank |= values.eq("")
+    numeric = ~blank & text.str.replace(".", "", regex=False).str.isdigit()
+    
+    if numeric.any():
+        timestamps = pandas.to_numeric(text[numeric], errors="coerce").astype("float64")
+        # If timestamp is in milliseconds (> 1e10), convert to seconds
+        timestamps = timestamps.where(timestamps <= 1e10, timestamps / 1000)
+        parsed[numeric] = pandas.to_datetime(timestamps, unit="s", errors="coerce")
+    
+    strings = ~blank & ~numeric
+    if strings.any():
+        uniques = pandas.unique(values[strings])
+        unique_dates = None
+        if all(isinstance(value, str) for value in uniques):
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
                 try:
-                    # Check if it's a numeric timestamp (seconds or milliseconds)
-                    if str(date_val).replace('.', '').isdigit():
-                        timestamp = float(date_val)
-                        # If timestamp is in milliseconds (> 1e10), convert to seconds
-                        if timestamp > 1e10:
-                            timestamp = timestamp / 1000
-                        return get_pandas().to_datetime(timestamp, unit='s').strftime('%Y-%m-%d')
-                    else:
-                        # Try to parse as regular date string and return as string
-                        parsed_date = get_pandas().to_datetime(date_val, errors='coerce')
-                        if get_pandas().isna(parsed_date):
-                            return ""
-                        return parsed_date.strftime('%Y-%m-%d')
+                    unique_dates = pandas.to_datetime(pandas.Series(uniques), format="mixed", errors="coerce")
                 except (ValueError, TypeError, OverflowError):
-                    # If conversion fails, return empty string
-                    return ""
-            
-            pendf["发文日期"] = pendf["发文日期"].apply(convert_date)
-        # Fill NaN values
-        pendf = pendf.fillna("")
+                    unique_dates = None
+            if unique_dates is not None and isinstance(unique_dates.dtype, pandas.DatetimeTZDtype):
+                unique_dates = unique_dates.dt.tz_localize(None)
+        if unique_dates is None or unique_dates.dtype != "datetime64[ns]":
+            # Mixed time zones or non-string values; parse the distinct values one by one
+            unique_dates = pandas.Series([_parse_date_string(value) for value in uniques], dtype="datetime64[ns]")
+        lookup = pandas.Series(unique_dates.values, index=uniques)
+        parsed[strings] = lookup.reindex(values[strings].values).values
     
+    parsed = parsed.dt.normalize()
+    display = parsed.dt.strftime("%Y-%m-%d").fillna("")
+    return display, parsed
+
+
+def _parse_date_string(value):
+    """Parse one date string to a naive Timestamp, or NaT"""
+    pandas = get_pandas()
+    try:
+        parsed_date = pandas.to_datetime(value, errors="coerce")
+    except (ValueError, TypeError, OverflowError):
+        return pandas.NaT
+    if pandas.isna(parsed_date):
+        return pandas.NaT
+    if parsed_date.tzinfo is not None:
+        parsed_date = parsed_date.tz_localize(None)
+    return parsed_date
+
+
+def drop_derived_columns(df):
+    """Drop the load-time helper columns before a frame is saved or exported"""
+    columns = [col for col in DERIVED_COLUMNS if col in df.columns]
+    return df.drop(columns=columns) if columns else df
+
+
+def count_values(series):
+    """
+    Count the values of a column, most frequent first.
+    
+    Unlike value_counts(), unused categories of a categorical column are not
+    reported with a zero count.
+    """
+    counts = series.value_counts()
+    return counts[counts > 0]
+
+
+def get_publish_dates(df):
+    """
+    Get the publication dates of a frame as datetime64.
+    
+    Uses the column stored at load time when present, otherwise parses the
+    '发文日期' strings.
+    """
+    if PUBLISH_DATE_COLUMN in df.columns:
+        return df[PUBLISH_DATE_COLUMN]
+    return get_pandas().to_datetime(df["发文日期"], errors="coerce")
+
+
+def _process_csrc2detail(pendf):
+    """Normalize freshly read CSRC2 detail rows"""
+    if pendf.empty:
+        return pendf
+    # Format date - handle both timestamp and date formats
+    publish_dates = None
+    if "发文日期" in pendf.columns:
+        pendf["发文日期"], publish_dates = normalize_publish_dates(pendf["发文日期"])
+    # Fill NaN values
+    pendf = pendf.fillna("")
+    if publish_dates is not None:
+        pendf[PUBLISH_DATE_COLUMN] = publish_dates
     return pendf
 
 
-def get_csrc2label():
+def _load_csrc2detail(columns=None):
+    """
+    Load CSRC2 detail data from CSV files.
+    
+    Args:
+        columns: Optional projection passed to get_csvdf
+    
+    Returns:
+        DataFrame with CSRC2 detail data
+    """
+    pencsrc2 = get_csrc2_dir()
+    print(f"Looking for CSRC2 data in: {pencsrc2}")
+    return _process_csrc2detail(get_csvdf(pencsrc2, "csrcdtlall", columns=columns))
+
+
+def _process_csrc2label(labeldf):
+    """Normalize freshly read CSRC2 label rows"""
+    if labeldf.empty:
+        return labeldf
+    # Fill NaN values
+    return labeldf.fillna("")
+
+
+def _load_csrc2label():
     """
-    Get CSRC2 label data from CSV files.
+    Load CSRC2 label data from CSV files.
     
     Returns:
         DataFrame with CSRC2 label data
     """
-    # Use absolute path to ensure it works from any working directory
-    import os
-    # Get the project root directory (dbcsrc)
-    current_file = os.path.abspath(__file__)
-    backend_dir = os.path.dirname(current_file)
-    project_root = os.path.dirname(backend_dir)
-    pencsrc2 = os.path.join(project_root, "data", "penalty", "csrc2")
+    pencsrc2 = get_csrc2_dir()
     print(f"Looking for CSRC2 label data in: {pencsrc2}")
-    labeldf = get_csvdf(pencsrc2, "csrc2label")
-    
-    if not labeldf.empty:
-        # Fill NaN values
-        labeldf = labeldf.fillna("")
-    
-    return labeldf
+    return _process_csrc2label(get_csvdf(pencsrc2, "csrc2label"))
 
 
-def get_csrc2analysis():
+def _load_csrc2analysis(columns=None):
     """
-    Get CSRC2 analysis data from CSV files.
+    Load CSRC2 analysis data from CSV files.
+    
+    Args:
+        columns: Optional projection passed to get_csvdf
     
     Returns:
         DataFrame with CSRC2 analysis data including source filename
     """
-    # Use absolute path to ensure it works from any working directory
-    import os
-    # Get the project root directory (dbcsrc)
-    current_file = os.path.abspath(__file__)
-    backend_dir = os.path.dirname(current_file)
-    project_root = os.path.dirname(backend_dir)
-    pencsrc2 = os.path.join(project_root, "data", "penalty", "csrc2")
+    pencsrc2 = get_csrc2_dir()
     print(f"Looking for CSRC2 analysis data in: {pencsrc2}")
-    pendf = get_csvdf(pencsrc2, "csrc2analysis", include_filename=True)
-    
-    if not pendf.empty:
-        # Format date - handle both timestamp and date formats
-        if "发文日期" in pendf.columns:
-            # First try to convert timestamps (numeric values) to datetime
-            def convert_date(date_val):
-                if get_pandas().isna(date_val) or date_val == "":
-                    return ""
-                
-                # If it's a numeric timestamp, convert it
-                try:
-                    # Check if it's a numeric timestamp (seconds or milliseconds)
-                    if str(date_val).replace('.', '').isdigit():
-                        timestamp = float(date_val)
-                        # If timestamp is in milliseconds (> 1e10), convert to seconds
-                        if timestamp > 1e10:
-                            timestamp = timestamp / 1000
-                        return get_pandas().to_datetime(timestamp, unit='s').strftime('%Y-%m-%d')
-                    else:
-                        # Try to parse as regular date string and return as string
-                        parsed_date = get_pandas().to_datetime(date_val, errors='coerce')
-                        if get_pandas().isna(parsed_date):
-                            return ""
-                        return parsed_date.strftime('%Y-%m-%d')
-                except (ValueError, TypeError, OverflowError):
-                    # If conversion fails, return empty string
-                    return ""
-            
-            pendf["发文日期"] = pendf["发文日期"].apply(convert_date)
-        # Fill NaN values
-        pendf = pendf.fillna("")
-    
-    return pendf
+    # Analysis shards share the date handling of the detail shards
+    return _process_csrc2detail(get_csvdf(pencsrc2, "csrc2analysis", include_filename=True, columns=columns))
 
 
-def get_csrc2cat():
+def _process_csrc2cat(amtdf):
+    """Normalize freshly read CSRC2 category rows"""
+    if amtdf.empty:
+        return amtdf
+    # Process amount column
+    if "amount" in amtdf.columns:
+        # Only fill blank/null values with 0, leave other values unchanged
+        # First, identify truly blank values (empty strings, None, NaN)
+        blank_mask = amtdf["amount"].isna() | (amtdf["amount"] == "") | (amtdf["amount"] == "")
+        # Fill only blank values with 0
+        amtdf.loc[blank_mask, "amount"] = 0
+        # Convert to numeric, but preserve existing non-blank values
+        amtdf["amount"] = get_pandas().to_numeric(amtdf["amount"], errors='coerce')
+    # Rename columns law to lawlist
+    if "law" in amtdf.columns:
+        amtdf.rename(columns={"law": "lawlist"}, inplace=True)
+    # Fill NaN values for other columns
+    return amtdf.fillna("")
+
+
+def _load_csrc2cat():
     """
-    Get CSRC2 category data from CSV files.
+    Load CSRC2 category data from CSV files.
     
     Returns:
         DataFrame with CSRC2 category data
     """
-    # Use absolute path to ensure it works from any working directory
-    import os
-    # Get the project root directory (dbcsrc)
-    current_file = os.path.abspath(__file__)
-    backend_dir = os.path.dirname(current_file)
-    project_root = os.path.dirname(backend_dir)
-    pencsrc2 = os.path.join(project_root, "data", "penalty", "csrc2")
+    pencsrc2 = get_csrc2_dir()
     print(f"Looking for CSRC2 category data in: {pencsrc2}")
-    amtdf = get_csvdf(pencsrc2, "csrccat")
-    
-    if not amtdf.empty:
-        # Process amount column
-        if "amount" in amtdf.columns:
-            # Only fill blank/null values with 0, leave other values unchanged
-            # First, identify truly blank values (empty strings, None, NaN)
-            blank_mask = amtdf["amount"].isna() | (amtdf["amount"] == "") | (amtdf["amount"] == "")
-            # Fill only blank values with 0
-            amtdf.loc[blank_mask, "amount"] = 0
-            # Convert to numeric, but preserve existing non-blank values
-            amtdf["amount"] = get_pandas().to_numeric(amtdf["amount"], errors='coerce')
-        # Rename columns law to lawlist
-        if "law" in amtdf.columns:
-            amtdf.rename(columns={"law": "lawlist"}, inplace=True)
-        # Fill NaN values for other columns
-        amtdf = amtdf.fillna("")
-    
-    return amtdf
+    return _process_csrc2cat(get_csvdf(pencsrc2, "csrccat"))
 
 
-def get_csrc2split():
+def _load_csrc2split():
     """
-    Get CSRC2 split data from CSV files.
+    Load CSRC2 split data from CSV files.
     
     Returns:
         DataFrame with CSRC2 split data
     """
-    # Use absolute path to ensure it works from any working directory
-    import os
-    # Get the project root directory (dbcsrc)
-    current_file = os.path.abspath(__file__)
-    backend_dir = os.path.dirname(current_file)
-    project_root = os.path.dirname(backend_dir)
-    pencsrc2 = os.path.join(project_root, "data", "penalty", "csrc2")
+    pencsrc2 = get_csrc2_dir()
     print(f"Looking for CSRC2 split data in: {pencsrc2}")
-    pendf = get_csvdf(pencsrc2, "csrcsplit")
-    
-    if not pendf.empty:
-        # Fill NaN values
-        pendf = pendf.fillna("")
-    
-    return pendf
+    return _process_csrc2label(get_csvdf(pencsrc2, "csrcsplit"))
 
 
-def get_csrc2_intersection():
+# Columns the three-way intersection takes from the category and split tables
+INTERSECTION_CAT_COLUMNS = ["amount", "lawlist", "category", "province", "industry"]
+INTERSECTION_SPLIT_COLUMNS = ["wenhao", "people", "event", "law", "penalty", "org", "date"]
+INTERSECTION_SOURCES = ("analysis_meta", "cat", "split")
+
+# Row positions (analysis, cat, split) behind each row of the materialized
+# intersection and the source generations it was built from, used to append
+# new rows in the order a full rebuild gives
+_intersection_positions = {"generations": None, "positions": None}
+
+
+def _join_intersection(analysis_df, cat_df, split_df, offsets=(0, 0, 0)):
     """
-    Get intersection of csrc2analysis, csrccat, and csrcsplit data.
+    Inner-join analysis, category and split rows on 链接 / id.
     
+    Args:
+        analysis_df, cat_df, split_df: Rows to join
+        offsets: Row number of the first row of each frame within its dataset
+        
     Returns:
-        DataFrame with intersection of three data sources based on common IDs
+        Tuple of (joined DataFrame in analysis row order, int64 array of the
+        (analysis, cat, split) row positions of each joined row)
     """
-    print("Loading three data sources for intersection...")
+    pandas = get_pandas()
+    np = get_numpy()
+    
+    analysis_part = analysis_df.copy(deep=False)
+    analysis_part["_analysis_row"] = np.arange(offsets[0], offsets[0] + len(analysis_df))
+    
+    cat_columns = [col for col in INTERSECTION_CAT_COLUMNS if col in cat_df.columns]
+    cat_part = cat_df[["id"] + cat_columns].rename(columns={"id": "链接"})
+    cat_part["_cat_row"] = np.arange(offsets[1], offsets[1] + len(cat_df))
+    
+    split_columns = [col for col in INTERSECTION_SPLIT_COLUMNS if col in split_df.columns]
+    split_part = split_df[["id"] + split_columns].rename(columns={"id": "链接"})
+    split_part["_split_row"] = np.arange(offsets[2], offsets[2] + len(split_df))
     
-    # Load all three data sources
-    analysis_df = get_csrc2analysis()
-    cat_df = get_csrc2cat()
-    split_df = get_csrc2split()
+    # Inner merges keep the order of the left keys
+    joined = analysis_part.merge(cat_part, on="链接", how="inner")
+    joined = joined.merge(split_part, on="链接", how="inner")
     
+    position_columns = ["_analysis_row", "_cat_row", "_split_row"]
+    positions = joined[position_columns].to_numpy(dtype="int64")
+    joined = joined.drop(columns=position_columns)
+    
+    # Rename amount to 罚款金额 for consistency
+    if "amount" in joined.columns:
+        joined["罚款金额"] = joined["amount"]
+    # Rename lawlist to 法律依据 for consistency
+    if "lawlist" in joined.columns:
+        joined["法律依据"] = joined["lawlist"]
+    return joined, positions
+
+
+def _remember_intersection(frame, entries, positions):
+    """Keep the row positions of the intersection built from the given source entries"""
+    _intersection_positions["generations"] = [entry.generation for entry in entries]
+    _intersection_positions["positions"] = positions
+    return frame
+
+
+def _sources_ready(frames):
+    """True when analysis, cat and split all have the columns the join needs"""
+    analysis_df, cat_df, split_df = frames
     if analysis_df.empty or cat_df.empty or split_df.empty:
         print("One or more data sources are empty, returning empty DataFrame")
-        return get_pandas().DataFrame()
+        return False
+    if "链接" not in analysis_df.columns:
+        print("Missing '链接' column in analysis data")
+        return False
+    if "id" not in cat_df.columns or "id" not in split_df.columns:
+        print("Missing 'id' column in category or split data")
+        return False
+    return True
+
+
+def _load_csrc2_intersection():
+    """
+    Build the intersection of csrc2analysis, csrccat and csrcsplit data.
     
-    print(f"Analysis data: {len(analysis_df)} rows")
-    print(f"Category data: {len(cat_df)} rows")
-    print(f"Split data: {len(split_df)} rows")
+    Returns:
+        DataFrame of the analysis rows whose 链接 also appears in the category
+        and split data, with the category and split fields merged in
+    """
+    print("Building three-way intersection of analysis, category and split data...")
+    entries = [registry.entry(name) for name in INTERSECTION_SOURCES]
+    frames = [entry.frame for entry in entries]
+    if not _sources_ready(frames):
+        return _remember_intersection(get_pandas().DataFrame(), entries, None)
     
-    # Check if required columns exist
-    # Analysis uses '链接', others use 'id'
-    if '链接' not in analysis_df.columns:
-        print("Missing '链接' column in analysis data")
-        return get_pandas().DataFrame()
-    if 'id' not in cat_df.columns:
-        print("Missing 'id' column in category data")
-        return get_pandas().DataFrame()
-    if 'id' not in split_df.columns:
-        print("Missing 'id' column in split data")
-        return get_pandas().DataFrame()
+    intersection_df, positions = _join_intersection(*frames)
+    print(f"Intersection result: {len(intersection_df)} rows with {len(intersection_df.columns)} columns")
+    return _remember_intersection(intersection_df, entries, positions)
+
+
+def _extend_csrc2_intersection(frame, old_signature, new_signature):
+    """
+    Append the intersection rows contributed by newly appended source rows.
     
-    # Get common IDs across all three datasets
-    # Convert analysis '链接' to match 'id' format
-    analysis_ids = set(analysis_df['链接'].dropna())
-    cat_ids = set(cat_df['id'].dropna())
-    split_ids = set(split_df['id'].dropna())
+    Only works when each source dataset is unchanged or was extended
+    append-only straight from the generation the intersection was built on;
+    returns None otherwise so the registry rebuilds it.
+    """
+    positions = _intersection_positions["positions"]
+    if frame.empty or positions is None or len(positions) != len(frame):
+        return None
+    if _intersection_positions["generations"] != list(old_signature):
+        return None
+    entries = [registry.entry(name) for name in INTERSECTION_SOURCES]
+    if [entry.generation for entry in entries] != list(new_signature):
+        return None
     
-    common_ids = analysis_ids & cat_ids & split_ids
-    print(f"Found {len(common_ids)} common IDs in intersection")
+    base_rows = []
+    for entry, old_generation in zip(entries, old_signature):
+        if entry.generation == old_generation:
+            base_rows.append(len(entry.frame))
+        elif entry.extends == old_generation:
+            base_rows.append(entry.base_rows)
+        else:
+            return None
     
-    if not common_ids:
-        print("No common IDs found, returning empty DataFrame")
-        return get_pandas().DataFrame()
+    pandas = get_pandas()
+    np = get_numpy()
+    analysis_df, cat_df, split_df = [entry.frame for entry in entries]
+    a0, c0, s0 = base_rows
     
-    # Filter datasets to only include common IDs
-    analysis_filtered = analysis_df[analysis_df['链接'].isin(common_ids)].copy()
-    cat_filtered = cat_df[cat_df['id'].isin(common_ids)].copy()
-    split_filtered = split_df[split_df['id'].isin(common_ids)].copy()
+    # New joined rows involve at least one new source row
+    parts = [
+        _join_intersection(analysis_df.iloc[a0:], cat_df, split_df, (a0, 0, 0)),
+        _join_intersection(analysis_df.iloc[:a0], cat_df.iloc[c0:], split_df, (0, c0, 0)),
+        _join_intersection(analysis_df.iloc[:a0], cat_df.iloc[:c0], split_df.iloc[s0:], (0, 0, s0)),
+    ]
+    parts = [(part, positions) for part, positions in parts if len(part)]
+    if not parts:
+        return _remember_intersection(frame.copy(deep=False), entries, positions)
     
-    # Rename 'id' columns to '链接' for consistent merging
-    cat_filtered = cat_filtered.rename(columns={'id': '链接'})
-    split_filtered = split_filtered.rename(columns={'id': '链接'})
+    result_df = frame
+    for part, _ in parts:
+        result_df = append_rows(result_df, part)
+    positions = np.concatenate([positions] + [p for _, p in parts])
     
-    # Merge with category data to get additional fields like amount, lawlist, category, province, industry
-    cat_subset = cat_filtered[['链接', 'amount', 'lawlist', 'category', 'province', 'industry']]
-    intersection_df = analysis_filtered.merge(cat_subset, on='链接', how='left')
+    # Restore the (analysis, cat, split) row order of a full rebuild
+    order = np.lexsort((positions[:, 2], positions[:, 1], positions[:, 0]))
+    if not (order == np.arange(len(order))).all():
+        result_df = result_df.take(order).reset_index(drop=True)
+        positions = positions[order]
+    print(f"Intersection extended: {len(frame)} -> {len(result_df)} rows")
+    return _remember_intersection(result_df, entries, positions)
+
+
+# Datasets with a full-text column group: loader, shard family, include_filename
+TEXT_SOURCES = {
+    "detail": (_load_csrc2detail, "csrcdtlall", False),
+    "analysis": (_load_csrc2analysis, "csrc2analysis", True),
+}
+TEXT_LOOKUP_COLUMNS = [TEXT_KEY_COLUMN] + TEXT_COLUMNS
+
+# 链接-indexed text Series of each loaded *_text dataset, keyed by generation
+_text_lookups = {}
+_text_store_locks = {name: threading.Lock() for name in TEXT_SOURCES}
+
+
+def _process_case_texts(textdf):
+    """Normalize freshly read (链接, 内容) rows"""
+    if textdf.empty:
+        return textdf
+    return textdf.fillna("")
+
+
+def _load_case_texts(beginwith: str, include_filename: bool):
+    """Load only the 链接 and full-text columns of a shard family"""
+    pencsrc2 = get_csrc2_dir()
+    return _process_case_texts(get_csvdf(pencsrc2, beginwith, include_filename, columns=TEXT_LOOKUP_COLUMNS))
+
+
+def _text_lookup(name: str):
+    """Text of each 链接 in the loaded text dataset; the last row of a 链接 wins"""
+    entry = registry.entry(f"{name}_text")
+    cached = _text_lookups.get(name)
+    if cached is not None and cached[0] == entry.generation:
+        return cached[1]
+    frame = entry.frame
+    if frame.empty or TEXT_KEY_COLUMN not in frame.columns:
+        lookup = get_pandas().DataFrame(columns=TEXT_COLUMNS)
+    else:
+        text_columns = [col for col in TEXT_COLUMNS if col in frame.columns]
+        lookup = frame.drop_duplicates(TEXT_KEY_COLUMN, keep="last").set_index(TEXT_KEY_COLUMN)[text_columns]
+    _text_lookups[name] = (entry.generation, lookup)
+    return lookup
+
+
+def _read_texts_from_store(name: str, links):
+    """Texts of the given links from the on-disk text store, rebuilding it when stale"""
+    loader, beginwith, include_filename = TEXT_SOURCES[name]
+    pencsrc2 = get_csrc2_dir()
+    signature = get_folder_signature(pencsrc2, beginwith)
+    texts = read_text_store(pencsrc2, beginwith, links, signature)
+    if texts is None and SNAPSHOT_ENABLED and get_pyarrow() is not None:
+        with _text_store_locks[name]:
+            texts = read_text_store(pencsrc2, beginwith, links, signature)
+            if texts is None:
+                # Rewrites the snapshot and text store; the frame is not kept
+                get_csvdf(pencsrc2, beginwith, include_filename, columns=TEXT_LOOKUP_COLUMNS)
+                texts = read_text_store(pencsrc2, beginwith, links, signature)
+    if texts is None:
+        return None
+    return texts.drop_duplicates(TEXT_KEY_COLUMN, keep="last").set_index(TEXT_KEY_COLUMN)
+
+
+def get_case_texts(links, name: str = "analysis", load: bool = False):
+    """
+    Fetch the full text (内容) of cases by 链接.
     
-    # Merge with split data to get people, event, law, penalty, org, date
-    split_subset = split_filtered[['链接', 'people', 'event', 'law', 'penalty', 'org', 'date']]
-    intersection_df = intersection_df.merge(split_subset, on='链接', how='left')
+    Args:
+        links: Series of 链接 values
+        name: "analysis" or "detail"
+        load: If True, load the whole text column group into memory, for
+            callers that scan every text (keyword filters, exports). Otherwise
+            only the requested texts are read from the text store unless the
+            column group is loaded already.
     
-    # Rename amount to 罚款金额 for consistency
-    if 'amount' in intersection_df.columns:
-        intersection_df['罚款金额'] = intersection_df['amount']
+    Returns:
+        Series of texts aligned with links, "" where a 链接 has no text
+    """
+    pandas = get_pandas()
+    lookup = None
+    if not load and registry.peek(f"{name}_text") is None:
+        lookup = _read_texts_from_store(name, links.dropna().unique())
+    if lookup is None:
+        lookup = _text_lookup(name)
+    if "内容" not in lookup.columns:
+        return pandas.Series("", index=links.index, dtype=object)
+    texts = lookup["内容"].reindex(links.astype(str).values)
+    return pandas.Series(texts.fillna("").values, index=links.index, dtype=object)
+
+
+def with_case_texts(df, name: str = "analysis", load: bool = False):
+    """
+    Add the 内容 column to a metadata-only frame, fetching the texts by 链接.
     
-    # Rename lawlist to 法律依据 for consistency
-    if 'lawlist' in intersection_df.columns:
-        intersection_df['法律依据'] = intersection_df['lawlist']
+    Returns:
+        Shallow copy of df with 内容 filled in; df itself when it already has it
+    """
+    if "内容" in df.columns or TEXT_KEY_COLUMN not in df.columns:
+        return df
+    df = df.copy(deep=False)
+    df["内容"] = get_case_texts(df[TEXT_KEY_COLUMN], name, load)
+    return df
+
+
+def get_csrc2_intersection():
+    """
+    Get the intersection of csrc2analysis, csrccat, and csrcsplit data.
     
-    print(f"Intersection result: {len(intersection_df)} rows with {len(intersection_df.columns)} columns")
-    return intersection_df
+    The intersection is materialized once per generation of its three sources
+    and appended to when they only grow, so requests never re-run the join.
+    
+    Returns:
+        Read-only view of the intersection keyed by 链接
+    """
+    return registry.get("intersection")
 
 
-def get_csrclenanalysis():
+def get_csrc2_intersection_entry():
     """
-    Get CSRC length analysis dataframe including source filename.
+    Current DatasetEntry of the intersection.
+    
+    Searches take their frame from it (entry.view()) and pass the entry to
+    the search indexes, so all of them use the generation of that frame.
+    
+    Returns:
+        DatasetEntry of the intersection
+    """
+    return registry.entry("intersection")
+
+
+def _load_csrclenanalysis():
+    """
+    Load CSRC length analysis dataframe including source filename.
     
     Returns:
         DataFrame with CSRC length analysis data from temp directory
     """
-    # Use absolute path to ensure it works from any working directory
-    import os
-    # Get the project root directory (dbcsrc)
-    current_file = os.path.abspath(__file__)
-    backend_dir = os.path.dirname(current_file)
-    project_root = os.path.dirname(backend_dir)
-    tempdir = os.path.join(project_root, "data", "penalty", "csrc2", "temp")
+    tempdir = get_csrc2_tempdir()
     
     print(f"Looking for CSRC length analysis data in: {tempdir}")
-    pendf = get_csvdf(tempdir, "csrclenanalysis", include_filename=True)
+    return _process_csrc2label(get_csvdf(tempdir, "csrclenanalysis", include_filename=True))
+
+
+def apply_schema(df, schema):
+    """
+    Convert the columns of a loaded frame to their declared dtypes.
+    
+    Args:
+        df: DataFrame after NaN values were filled with ""
+        schema: Mapping of column name to "category", "string" or "float64"
+        
+    Returns:
+        The same DataFrame with converted columns
+    """
+    pandas = get_pandas()
+    for col, dtype in schema.items():
+        if col not in df.columns:
+            continue
+        if dtype == "category":
+            values = df[col].astype("category")
+            # Keep "" a valid category so later fillna("") and comparisons work
+            if "" not in values.cat.categories:
+                values = values.cat.add_categories("")
+            df[col] = values
+        elif dtype == "string":
+            if get_pyarrow() is not None:
+                df[col] = df[col].astype("string[pyarrow]")
+        elif dtype == "float64":
+            # Blank and non-numeric values become NaN
+            df[col] = pandas.to_numeric(df[col], errors="coerce").astype("float64")
+    return df
+
+
+def apply_dataset_schema(df, name: str, report: bool = True):
+    """
+    Apply the declared schema of a dataset, recording memory before and after.
+    
+    Args:
+        df: Loaded DataFrame
+        name: Dataset name, a key of DATASET_SCHEMAS
+        report: If True, measures and prints the memory saving
+        
+    Returns:
+        DataFrame with the declared dtypes
+    """
+    schema = DATASET_SCHEMAS.get(name)
+    if not schema or df.empty:
+        return df
+    if not report:
+        return apply_schema(df, schema)
+    before = int(df.memory_usage(deep=True).sum())
+    df = apply_schema(df, schema)
+    after = int(df.memory_usage(deep=True).sum())
+    schema_memory_stats[name] = {"rows": len(df), "bytesBefore": before, "bytesAfter": after}
+    print(f"Dataset {name} schema applied: {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB")
+    return df
+
+
+def append_rows(frame, delta):
+    """
+    Append rows to a frame, keeping its categorical columns categorical.
+    
+    Categories of both sides are merged first; a plain concat would fall back
+    to object columns whenever the category sets differ.
+    """
+    pandas = get_pandas()
+    frame = frame.copy(deep=False)
+    for col in frame.columns:
+        if isinstance(frame[col].dtype, pandas.CategoricalDtype) and col in delta.columns:
+            categories = frame[col].cat.categories.union(pandas.Index(delta[col].astype(object).unique()))
+            frame[col] = frame[col].cat.set_categories(categories)
+            delta[col] = delta[col].astype(pandas.CategoricalDtype(categories))
+    return pandas.concat([frame, delta], ignore_index=True)
+
+
+def _shard_extender(get_folder, beginwith: str, process, include_filename: bool = False, columns=None):
+    """
+    Build the append-only refresh function of a shard family for the registry.
+    
+    The returned function parses only the shards added since the loaded
+    signature, normalizes them with the family's process function and appends
+    them to the loaded frame. It returns None, asking for a full reload, when
+    the change is not append-only or a new shard could not be read. columns is
+    the projection the dataset was loaded with.
+    """
+    def extend(frame, old_signature, new_signature):
+        added = get_appended_shards(old_signature, new_signature)
+        if not added or frame.empty:
+            return None
+        penfolder = get_folder()
+        start_time = time.time()
+        dflist, timings, skipped_files = read_csv_shards(
+            [os.path.join(penfolder, name) for name in added], include_filename, columns=columns
+        )
+        if skipped_files or not dflist:
+            return None
+        delta = get_pandas().concat(dflist, ignore_index=True)
+        if SNAPSHOT_ENABLED and get_pyarrow() is not None:
+            delta = _prepare_snapshot_frame(delta)
+        delta = process(delta)
+        result_df = append_rows(frame, delta)
+        # Columns present on only one side come back as NaN after concat
+        new_columns = [col for col in result_df.columns if (col in frame.columns) != (col in delta.columns)]
+        if new_columns:
+            result_df[new_columns] = result_df[new_columns].fillna("")
+        shard_load_stats[f"{penfolder}:{beginwith}"] = {
+            "files": timings,
+            "skipped": 0,
+            "appendedTo": len(frame),
+            "totalSeconds": round(time.time() - start_time, 3)
+        }
+        return result_df
+    return extend
+
+
+def _register_datasets():
+    """Register the case datasets with the shared registry, keyed by their shard families"""
+    def register(name, loader, get_folder, beginwith, process, include_filename=False, columns=None):
+        registry.register(
+            name,
+            lambda: apply_dataset_schema(loader(), name),
+            lambda: get_folder_signature(get_folder(), beginwith),
+            _shard_extender(
+                get_folder,
+                beginwith,
+                lambda delta: apply_dataset_schema(process(delta), name, report=False),
+                include_filename,
+                columns
+            )
+        )
+    
+    register("detail", _load_csrc2detail, get_csrc2_dir, "csrcdtlall", _process_csrc2detail)
+    register("label", _load_csrc2label, get_csrc2_dir, "csrc2label", _process_csrc2label)
+    register("analysis", _load_csrc2analysis, get_csrc2_dir, "csrc2analysis", _process_csrc2detail, include_filename=True)
+    # Hot metadata and cold text column groups of the detail and analysis tables
+    for name, (loader, beginwith, include_filename) in TEXT_SOURCES.items():
+        register(f"{name}_meta", lambda loader=loader: loader(columns=is_metadata_column), get_csrc2_dir,
+                 beginwith, _process_csrc2detail, include_filename, columns=is_metadata_column)
+        register(f"{name}_text", lambda beginwith=beginwith, include_filename=include_filename: _load_case_texts(beginwith, include_filename),
+                 get_csrc2_dir, beginwith, _process_case_texts, include_filename, columns=TEXT_LOOKUP_COLUMNS)
+    register("cat", _load_csrc2cat, get_csrc2_dir, "csrccat", _process_csrc2cat)
+    register("split", _load_csrc2split, get_csrc2_dir, "csrcsplit", _process_csrc2label)
+    register("lenanalysis", _load_csrclenanalysis, get_csrc2_tempdir, "csrclenanalysis", _process_csrc2label, include_filename=True)
+    registry.register(
+        "intersection",
+        _load_csrc2_intersection,
+        lambda: [registry.generation(name) for name in INTERSECTION_SOURCES],
+        _extend_csrc2_intersection,
+        # Generations are per process; other workers know the sources by their shard signatures
+        shared_key=lambda generations: [registry.entry(name).signature for name in INTERSECTION_SOURCES]
+    )
+    registry.set_shared_store(get_shared_store())
+
+
+def get_shared_store():
+    """
+    Store the registry publishes datasets to when SHARED_DATASETS_ENABLED is set.
+    
+    Published files are stamped with the size and mtime of this module, so a
+    deployment with different loading code never maps frames built by the old one.
+    
+    Returns:
+        SharedDatasetStore in the csrc2 .published directory, or None
+    """
+    if not SHARED_DATASETS_ENABLED or get_pyarrow() is None:
+        return None
+    version = get_shard_signature([os.path.abspath(__file__)])
+    return SharedDatasetStore(os.path.join(get_csrc2_dir(), SHARED_DATASETS_DIRNAME), version)
+
+
+_register_datasets()
+
+
+def _get_projected(name: str, columns):
+    """
+    Get a dataset with a column projection.
+    
+    Projections without any text column are served from the metadata-only
+    dataset, so the full text is never loaded for them. Derived helper columns
+    such as 发文日期_dt are always kept.
+    """
+    if columns is None:
+        return registry.get(name)
+    selected = _column_selector(columns)
+    source = name if any(selected(col) for col in TEXT_COLUMNS) else f"{name}_meta"
+    frame = registry.get(source)
+    keep = [col for col in frame.columns if selected(col) or col in DERIVED_COLUMNS]
+    return frame if len(keep) == len(frame.columns) else frame[keep]
+
+
+def get_csrc2detail(columns=None):
+    """
+    Get CSRC2 detail data from the shared dataset registry.
     
-    if not pendf.empty:
-        pendf = pendf.fillna("")
+    Args:
+        columns: Optional projection, a list of column names or a predicate
+            such as is_metadata_column
     
-    return pendf
\ No newline at end of file
+    Returns:
+        Read-only view of the CSRC2 detail DataFrame
+    """
+    return _get_projected("detail", columns)
+
+
+def get_csrc2label():
+    """
+    Get CSRC2 label data from the shared dataset registry.
+    
+    Returns:
+        Read-only view of the CSRC2 label DataFrame
+    """
+    return registry.get("label")
+
+
+def get_csrc2analysis(columns=None):
+    """
+    Get CSRC2 analysis data from the shared dataset registry.
+    
+    Args:
+        columns: Optional projection, a list of column names or a predicate
+            such as is_metadata_column
+    
+    Returns:
+        Read-only view of the CSRC2 analysis DataFrame including source filename
+    """
+    return _get_projected("analysis", columns)
+
+
+def get_csrc2cat():
+    """
+    Get CSRC2 category data from the shared dataset registry.
+    
+    Returns:
+        Read-only view of the CSRC2 category DataFrame
+    """
+    return registry.get("cat")
+
+
+def get_csrc2split():
+    """
+    Get CSRC2 split data from the shared dataset registry.
+    
+    Returns:
+        Read-only view of the CSRC2 split DataFrame
+    """
+    return registry.get("split")
+
+
+def get_csrclenanalysis():
+    """
+    Get CSRC length analysis data from the shared dataset registry.
+    
+    Returns:
+        Read-only view of the CSRC length analysis DataFrame including source filename
+    """
+    return registry.get("lenanalysis")
@@ -0,0 +1,327 @@
+"""Process-wide registry of the shared case datasets
+
+Every endpoint used to load its own private copy of the CSV-backed
+DataFrames. The registry keeps a single immutable DataFrame per dataset,
+hands out read-only views of it and tags each load with a monotonically
+increasing generation number, so dependent caches can tell precisely when
+the data underneath them changed.
+
+Datasets registered with an ``extend`` function are refreshed append-only:
+when only new shards arrived, the new rows are appended to the previous
+frame instead of reloading the whole archive. The resulting entry records
+the generation it extends and how many leading rows it shares with it.
+
+With a shared store set (see shared_datasets.py), every loaded generation
+is published to it and served memory-mapped, and a process finding a
+generation already published by another worker maps it instead of loading.
+
+Computing a signature lists and stats the backing files, and the
+intersection's signature resolves its three sources in turn, so a
+signature is trusted for SIGNATURE_TTL seconds before the files are
+checked again. invalidate() and every newly loaded generation drop the
+remembered signatures, so explicit refreshes and dependent datasets are
+seen at once.
+"""
+
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Union
+
+import numpy as np
+
+# Seconds a computed dataset signature is reused before the files are checked again
+SIGNATURE_TTL = float(os.getenv("DATASET_SIGNATURE_TTL", "2"))
+# Full loads of a dataset whose files keep changing before it is stored unsigned
+LOAD_ATTEMPTS = 3
+
+
+class DatasetEntry:
+    """A loaded dataset together with the generation it was published at"""
+
+    def __init__(self, name: str, frame, generation: int, signature: Any, load_seconds: float,
+                 extends: Optional[int] = None, base_rows: int = 0, shared: bool = False):
+        self.name = name
+        self.frame = frame
+        self.generation = generation
+        self.signature = signature
+        self.load_seconds = load_seconds
+        self.loaded_at = time.time()
+        # Generation whose rows form the first base_rows rows of this frame
+        self.extends = extends
+        self.base_rows = base_rows
+        # True when the frame is memory-mapped from the shared store
+        self.shared = shared
+
+    def view(self):
+        """Read-only view of the frame, see DatasetRegistry.get"""
+        return self.frame.copy(deep=False)
+
+
+# A registry dataset name, or a DatasetEntry resolved from one
+DatasetRef = Union[str, DatasetEntry]
+
+
+def freeze_frame(df):
+    """Mark the numpy blocks of a DataFrame read-only.
+
+    In-place writes such as ``df.loc[mask, col] = value`` then raise instead of
+    silently changing the shared copy. Adding or replacing whole columns on a
+    view is unaffected.
+    """
+    for block in df._mgr.blocks:
+        if isinstance(block.values, np.ndarray):
+            block.values.flags.writeable = False
+    return df
+
+
+class DatasetRegistry:
+    """Single shared, generation-counted copy of each registered dataset"""
+
+    def __init__(self, signature_ttl: float = SIGNATURE_TTL):
+        self._lock = threading.Lock()
+        self._loaders: Dict[str, Callable] = {}
+        self._signatures: Dict[str, Optional[Callable]] = {}
+        self._extenders: Dict[str, Optional[Callable]] = {}
+        self._shared_keys: Dict[str, Optional[Callable]] = {}
+        self._shared_store = None
+        self._entries: Dict[str, DatasetEntry] = {}
+        # Invalidated entries, kept as the base of an append-only refresh
+        self._previous: Dict[str, DatasetEntry] = {}
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._generation = 0
+        # name -> (monotonic time, signature) of the last signature check
+        self._checked: Dict[str, tuple] = {}
+        self.signature_ttl = signature_ttl
+
+    def register(self, name: str, loader: Callable, signature: Optional[Callable] = None,
+                 extend: Optional[Callable] = None, shared_key: Optional[Callable] = None):
+        """Register a dataset.
+
+        Args:
+            name: Dataset name, e.g. "detail"
+            loader: Zero-argument function returning the full DataFrame
+            signature: Optional zero-argument function describing the backing
+                files; a changed signature triggers a reload on the next get()
+            extend: Optional function (frame, old_signature, new_signature)
+                returning the frame with the rows of newly added files
+                appended, or None when a full reload is needed
+            shared_key: Optional function mapping the signature to the key
+                the dataset is published under in the shared store; the
+                signature itself is used by default, so it has to be the
+                same in every process
+        """
+        with self._lock:
+            self._loaders[name] = loader
+            self._signatures[name] = signature
+            self._extenders[name] = extend
+            self._shared_keys[name] = shared_key
+            self._load_locks.setdefault(name, threading.Lock())
+            self._entries.pop(name, None)
+            self._previous.pop(name, None)
+            self._checked.pop(name, None)
+
+    def set_shared_store(self, store):
+        """Publish datasets to a SharedDatasetStore and map them from it; None disables sharing"""
+        with self._lock:
+            self._shared_store = store
+            self._entries.clear()
+            self._previous.clear()
+            self._checked.clear()
+    
+    def _shared_key(self, name: str, signature):
+        """Key of a dataset generation in the shared store, or None when not shared"""
+        if self._shared_store is None or signature is None:
+            return None
+        key_fn = self._shared_keys.get(name)
+        try:
+            return key_fn(signature) if key_fn is not None else signature
+        except Exception as e:
+            print(f"Failed to compute shared key for dataset {name}: {e}")
+            return None
+    
+    def _next_generation(self) -> int:
+        with self._lock:
+            self._generation += 1
+            return self._generation
+
+    def _current_signature(self, name: str, fresh: bool = False):
+        """Signature of a dataset's backing files, reused for signature_ttl seconds unless fresh"""
+        signature_fn = self._signatures.get(name)
+        if signature_fn is None:
+            return None
+        checked = self._checked.get(name)
+        now = time.monotonic()
+        if not fresh and checked is not None and now - checked[0] < self.signature_ttl:
+            return checked[1]
+        try:
+            signature = signature_fn()
+        except Exception as e:
+            print(f"Failed to compute signature for dataset {name}: {e}")
+            return None
+        self._checked[name] = (now, signature)
+        return signature
+
+    def _load(self, name: str, signature):
+        """
+        Full load of a dataset, with the signature of the files it read.
+
+        The files can change between the signature check, which may be up
+        to signature_ttl old, and the loader listing them; a shard read but
+        missing from the stored signature would later look new and be
+        appended a second time. The signature is therefore checked again
+        after loading, and the load repeated until the two agree.
+
+        Returns:
+            Tuple of (frame, signature); the signature is None when the files
+            kept changing, so the next check reloads the dataset in full
+        """
+        for _ in range(LOAD_ATTEMPTS):
+            frame = self._loaders[name]()
+            loaded = self._current_signature(name, fresh=True)
+            if loaded == signature:
+                return frame, signature
+            signature = loaded
+        print(f"Dataset {name} changed during each of {LOAD_ATTEMPTS} loads; stored without a signature")
+        return frame, None
+
+    def _entry(self, name: str) -> DatasetEntry:
+        """Return the current entry of a dataset, (re)loading it when stale"""
+        if name not in self._loaders:
+            raise KeyError(f"Dataset '{name}' is not registered")
+
+        signature = self._current_signature(name)
+        entry = self._entries.get(name)
+        if entry is not None and (signature is None or entry.signature == signature):
+            return entry
+
+        # One loader per dataset at a time; concurrent callers wait for it
+        with self._load_locks[name]:
+            entry = self._entries.get(name)
+            if entry is not None and (signature is None or entry.signature == signature):
+                return entry
+
+            with self._lock:
+                base = entry or self._previous.get(name)
+
+            start = time.time()
+            shared_key = self._shared_key(name, signature)
+            store = self._shared_store
+            frame = store.read(name, shared_key) if shared_key is not None else None
+            if frame is not None:
+                entry = DatasetEntry(name, freeze_frame(frame), self._next_generation(), signature,
+                                     time.time() - start, shared=True)
+                print(f"Dataset {name} mapped from shared store: {len(frame)} rows, generation {entry.generation}, {entry.load_seconds:.2f} seconds")
+            else:
+                frame = self._extend(name, base, signature)
+                extended = frame is not None
+                if not extended:
+                    frame, signature = self._load(name, signature)
+                    shared_key = self._shared_key(name, signature)
+                shared_frame = store.publish(name, shared_key, frame) if shared_key is not None else None
+                if shared_frame is not None:
+                    frame = shared_frame
+                if extended:
+                    entry = DatasetEntry(name, freeze_frame(frame), self._next_generation(), signature, time.time() - start,
+                                         extends=base.generation, base_rows=len(base.frame), shared=shared_frame is not None)
+                    print(f"Dataset {name} extended: {len(base.frame)} -> {len(frame)} rows, generation {entry.generation}, {entry.load_seconds:.2f} seconds")
+                else:
+                    entry = DatasetEntry(name, freeze_frame(frame), self._next_generation(), signature, time.time() - start,
+                                         shared=shared_frame is not None)
+                    print(f"Dataset {name} loaded: {len(frame)} rows, generation {entry.generation}, {entry.load_seconds:.2f} seconds")
+            with self._lock:
+                self._entries[name] = entry
+                self._previous.pop(name, None)
+                # Signatures of datasets built from this one have changed too
+                self._checked = {name: self._checked[name]} if name in self._checked else {}
+            return entry
+
+    def _extend(self, name: str, base: Optional[DatasetEntry], signature):
+        """Append-only refresh of a dataset, or None when it needs a full reload"""
+        extend_fn = self._extenders.get(name)
+        if extend_fn is None or base is None or signature is None or base.signature is None:
+            return None
+        if signature == base.signature:
+            # Invalidated without any change in the shard set; reload to be safe
+            return None
+        try:
+            return extend_fn(base.frame, base.signature, signature)
+        except Exception as e:
+            print(f"Append-only refresh of dataset {name} failed, reloading: {e}")
+            return None
+
+    def get(self, name: str):
+        """Get a read-only view of a dataset.
+
+        The view shares memory with the registry copy. Callers may add or
+        replace columns on it, but in-place value updates raise; use
+        ``.copy()`` when the frame has to be modified.
+        """
+        return self._entry(name).view()
+
+    def generation(self, name: str) -> int:
+        """Current generation of a dataset, loading it if needed"""
+        return self._entry(name).generation
+
+    def invalidate(self, *names: str) -> int:
+        """Drop the cached copies of the given datasets after their files changed.
+
+        Returns:
+            The new global generation number
+        """
+        generation = self._next_generation()
+        with self._lock:
+            self._checked.clear()
+            for name in names:
+                entry = self._entries.pop(name, None)
+                if entry is not None:
+                    self._previous[name] = entry
+        return generation
+
+    def entry(self, name: str) -> DatasetEntry:
+        """Current entry of a dataset, for caches that extend with the data"""
+        return self._entry(name)
+
+    def resolve(self, dataset: DatasetRef) -> DatasetEntry:
+        """Current entry of a dataset name, or the given DatasetEntry itself.
+
+        A request resolves its dataset once and passes the entry on, so the
+        indexes and caches it uses all belong to the generation its frame
+        was taken from, even when the dataset is reloaded meanwhile.
+        """
+        return dataset if isinstance(dataset, DatasetEntry) else self._entry(dataset)
+    
+    def peek(self, name: str) -> Optional[DatasetEntry]:
+        """Current entry of a dataset if it is loaded and up to date, without loading it"""
+        entry = self._entries.get(name)
+        if entry is None:
+            return None
+        signature = self._current_signature(name)
+        if signature is not None and entry.signature != signature:
+            return None
+        return entry
+
+    def stats(self) -> Dict[str, Any]:
+        """Generation, size and load time of each loaded dataset"""
+        with self._lock:
+            entries = dict(self._entries)
+            generation = self._generation
+        return {
+            "generation": generation,
+            "datasets": {
+                name: {
+                    "generation": entry.generation,
+                    "rows": len(entry.frame),
+                    "memoryBytes": int(entry.frame.memory_usage(deep=False).sum()),
+                    "loadSeconds": round(entry.load_seconds, 3),
+                    "loadedAt": entry.loaded_at,
+                    "extends": entry.extends,
+                    "shared": entry.shared,
+                }
+                for name, entry in entries.items()
+            },
+        }
+
+
+# Shared instance used by data_service and the API
+registry = DatasetRegistry()
@@ -0,0 +1,261 @@
+"""Law-article inverted index of the cases' legal basis
+
+The legalBasis filter used to run ``str.contains`` over the law column of
+every case, and the Streamlit law statistics re-extract 《law》第X条 pairs
+with ``str.extractall`` on every run. Here each case's law column is parsed
+once per dataset generation into (law name, article number) citations, the
+same way lawls2dict does, and abbreviations are resolved the way fix_abb
+does: a 《full name》...简称《short name》 definition in the case's own text
+wins, then the full name the corpus most often defines for it. Names are
+then stored without the 中华人民共和国 prefix of national laws, so
+《中华人民共和国证券法》 and 《证券法》 are one law. The citations are indexed
+by law and by (law, article), so the cases citing 《证券法》第一百九十三条
+are an index hit, whatever numerals or abbreviation each case used.
+"""
+
+import re
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from data_service import TEXT_KEY_COLUMN, get_case_texts, get_pandas
+from dataset_registry import DatasetRef, registry
+from search_index import KeyIndex, index_build_stats
+
+# Column holding the legal basis of a case
+LAW_COLUMN = "law"
+# A law name and the text up to the next law, sentence or clause end
+_CITATION = re.compile(r"《([^《》,，；。]+?)》([^《》；。]*)")
+# Articles, as in lawls2dict
+_ARTICLE = re.compile(r"(第[^《》、和章节款（）\(\)]*?条)")
+# Abbreviation definitions, as in generate_lawdf2
+_ABBREVIATION = re.compile(r"《([^,，；。]*?)》[^；。]*?简称.*?《([^,，；。]*?)》")
+_WHITESPACE = re.compile(r"[\r\n\t\xa0　\s]")
+_CN_DIGITS = {"零": 0, "〇": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_CN_UNITS = {"十": 10, "百": 100, "千": 1000}
+# Prefix the full names of national laws carry
+NATIONAL_PREFIX = "中华人民共和国"
+
+# dataset -> (generation, LawIndex)
+_law_indexes: Dict[str, tuple] = {}
+_law_lock = threading.Lock()
+
+
+def article_number(article: str) -> Optional[int]:
+    """
+    Number of an article such as 第一百零三条 or 第103条.
+
+    Returns:
+        The number, or None when it is not a plain numeral
+    """
+    text = article.strip()
+    if text.startswith("第"):
+        text = text[1:]
+    if text.endswith("条"):
+        text = text[:-1]
+    if not text:
+        return None
+    if text.isdigit():
+        return int(text)
+    total, digit = 0, None
+    for char in text:
+        if char in _CN_DIGITS:
+            digit = _CN_DIGITS[char]
+        elif char in _CN_UNITS:
+            total += (1 if digit is None else digit) * _CN_UNITS[char]
+            digit = None
+        else:
+            return None
+    return total + (digit or 0)
+
+
+def find_abbreviations(text) -> Dict[str, str]:
+    """Abbreviation -> full law name, from the 简称 definitions in a text"""
+    if not isinstance(text, str) or "简称" not in text:
+        return {}
+    return {short: full for full, short in _ABBREVIATION.findall(_WHITESPACE.sub("", text)) if short and full}
+
+
+def parse_citations(text, abbreviations: Optional[Dict[str, str]] = None) -> List[Tuple[str, Optional[int]]]:
+    """
+    Citations of a legal basis text.
+
+    Args:
+        text: Law column value, e.g. 《证券法》第一百八十条、《期货交易管理条例》第六十七条
+        abbreviations: Abbreviation -> full name to resolve law names with
+
+    Returns:
+        List of (law name, article number); the number is None for a law
+        cited without a readable article
+    """
+    if not isinstance(text, str):
+        return []
+    abbreviations = abbreviations or {}
+    citations = []
+    for law, tail in _CITATION.findall(_WHITESPACE.sub("", text)):
+        law = abbreviations.get(law, law)
+        numbers = [article_number(article) for article in _ARTICLE.findall(tail)]
+        numbers = [number for number in numbers if number is not None]
+        if numbers:
+            citations.extend((law, number) for number in numbers)
+        else:
+            citations.append((law, None))
+    return citations
+
+
+def canonical_law(law: str, abbreviations: Optional[Dict[str, str]] = None) -> str:
+    """Indexed name of a law: abbreviation resolved, 中华人民共和国 prefix removed"""
+    law = law.strip().strip("《》")
+    law = (abbreviations or {}).get(law, law)
+    return law[len(NATIONAL_PREFIX):] if law.startswith(NATIONAL_PREFIX) and len(law) > len(NATIONAL_PREFIX) else law
+
+
+def _citation_key(law: str, article: int) -> str:
+    return f"{law}\t{article}"
+
+
+class LawIndex:
+    """Rows citing each law and each (law, article)"""
+
+    def __init__(self, laws, texts=None):
+        """
+        Args:
+            laws: Series of the law column
+            texts: Optional Series of the case texts (内容) aligned with laws,
+                searched for abbreviation definitions
+        """
+        pandas = get_pandas()
+        values = laws.tolist()
+        own = [find_abbreviations(law) for law in values]
+        if texts is not None:
+            for abbreviations, text in zip(own, texts.tolist()):
+                abbreviations.update(find_abbreviations(text))
+        # The full name most often defined for each abbreviation in the corpus
+        counts = Counter((short, full) for abbreviations in own for short, full in abbreviations.items())
+        self.abbreviations = {}
+        for (short, full), _ in counts.most_common():
+            self.abbreviations.setdefault(short, full)
+
+        rows, names, articles = [], [], []
+        for row, (law, abbreviations) in enumerate(zip(values, own)):
+            for name, article in parse_citations(law, {**self.abbreviations, **abbreviations}):
+                rows.append(row)
+                names.append(canonical_law(name))
+                articles.append(article)
+        self.rows = np.array(rows, dtype=np.int64)
+        self.by_law = KeyIndex(pandas.Series(names, dtype=object))
+        keys = [_citation_key(name, article) if article is not None else None for name, article in zip(names, articles)]
+        self.by_citation = KeyIndex(pandas.Series(keys, dtype=object))
+
+    def resolve(self, law: str) -> str:
+        """Indexed name of a law given by its full name or an abbreviation"""
+        return canonical_law(law, self.abbreviations)
+
+    def knows(self, law: str) -> bool:
+        """True when a law name, full or abbreviated, is cited by some case or defined as an abbreviation"""
+        name = law.strip().strip("《》")
+        return name in self.abbreviations or len(self.by_law.lookup([self.resolve(name)])) > 0
+
+    def lookup(self, law: str, article: Optional[int] = None) -> np.ndarray:
+        """
+        Rows citing a law, or one article of it.
+
+        Returns:
+            Sorted row numbers
+        """
+        law = self.resolve(law)
+        if article is None:
+            positions = self.by_law.lookup([law])
+        else:
+            positions = self.by_citation.lookup([_citation_key(law, article)])
+        return np.unique(self.rows[positions])
+
+    def memory_bytes(self) -> int:
+        return int(self.rows.nbytes + self.by_law.memory_bytes() + self.by_citation.memory_bytes())
+
+
+def parse_legal_basis(query: str, index: Optional["LawIndex"] = None) -> Optional[Tuple[str, Optional[int]]]:
+    """
+    Law and article of a legalBasis query.
+
+    Accepts 《证券法》第一百九十三条, 证券法第193条 or a bare law name.
+
+    Args:
+        query: legalBasis query
+        index: Optional LawIndex; a law named without 《》 then has to be
+            one it knows, so free text such as 内幕交易 names no law
+
+    Returns:
+        (law name, article number or None), or None when no law is named
+    """
+    query = _WHITESPACE.sub("", query or "")
+    citations = parse_citations(query)
+    if citations:
+        return citations[0]
+    match = re.match(r"^(.*?)(第[^第]+条)?$", query)
+    law = match.group(1) if match else ""
+    if not law or (index is not None and not index.knows(law)):
+        return None
+    return law, article_number(match.group(2)) if match.group(2) else None
+
+
+def get_law_index(dataset: DatasetRef = "intersection") -> Optional[LawIndex]:
+    """
+    Law index of the current generation of a dataset.
+
+    Returns:
+        LawIndex, or None when the dataset has no law column
+    """
+    entry = registry.resolve(dataset)
+    cached = _law_indexes.get(entry.name)
+    if cached is not None and cached[0] == entry.generation:
+        return cached[1]
+    with _law_lock:
+        cached = _law_indexes.get(entry.name)
+        if cached is not None and cached[0] == entry.generation:
+            return cached[1]
+        frame = entry.frame
+        if LAW_COLUMN not in frame.columns:
+            return None
+        start = time.time()
+        texts = None
+        if "内容" in frame.columns:
+            texts = frame["内容"]
+        elif TEXT_KEY_COLUMN in frame.columns:
+            try:
+                texts = get_case_texts(frame[TEXT_KEY_COLUMN], load=True)
+            except Exception as e:
+                print(f"Case texts unavailable for law abbreviations: {e}")
+        index = LawIndex(frame[LAW_COLUMN], texts)
+        if cached is None or cached[0] < entry.generation:
+            _law_indexes[entry.name] = (entry.generation, index)
+        seconds = time.time() - start
+        index_build_stats[f"{entry.name}:{LAW_COLUMN}:law"] = {
+            "generation": entry.generation,
+            "citations": len(index.rows),
+            "laws": len(index.by_law.keys),
+            "abbreviations": len(index.abbreviations),
+            "memoryBytes": index.memory_bytes(),
+            "seconds": round(seconds, 3),
+        }
+        print(f"Law index {entry.name} built: {len(index.rows)} citations of {len(index.by_law.keys)} laws, {seconds:.2f} seconds")
+        return index
+
+
+def citing_rows(legal_basis: str, dataset: DatasetRef = "intersection") -> Optional[np.ndarray]:
+    """
+    Rows of the cases citing the law (and article) of a legalBasis query.
+
+    Returns:
+        Sorted row numbers, or None when the query names no law (a bare name
+        has to be a known law) or the dataset has no law column; callers then
+        fall back to a substring match
+    """
+    index = get_law_index(dataset)
+    parsed = parse_legal_basis(legal_basis, index) if index is not None else None
+    if parsed is None:
+        return None
+    return index.lookup(*parsed)
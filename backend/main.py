@@ -1,6 +1,6 @@
 from typing import Union, List
 from fastapi import FastAPI, Query, HTTPException, File, UploadFile, Request, BackgroundTasks
-from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -112,6 +112,12 @@ except ImportError:
     def df2people(*args, **kwargs):
         return get_pandas().DataFrame()
 
+# Faster JSON encoding of search responses (optional)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -353,7 +359,8 @@ class CaseDetail(BaseModel):
     org: str
     content: str
     penalty: str = ""
-    amount: float = 0
+    # null in /api/search-enhanced for a case without an amount
+    amount: Optional[float] = 0
     party: str = ""
     violationFacts: str = ""
     penaltyBasis: str = ""
@@ -367,12 +374,83 @@ class SearchResponse(BaseModel):
     total: int
     page: Optional[int] = None
     pageSize: Optional[int] = None
+    # Opaque token of the next page in date order, None on the last page
+    nextCursor: Optional[str] = None
+
+# Source column of each CaseDetail field; the first present column of a
+# tuple is used. /search and /api/search-enhanced read different columns.
+SEARCH_CASE_COLUMNS = {
+    "id": "链接", "title": "名称", "name": "名称", "docNumber": "文号",
+    "date": ("date", "发文日期"), "org": ("org", "机构"), "content": "内容",
+    "penalty": "category", "amount": ("amount", "罚款金额"), "party": "people",
+    "violationFacts": "event", "penaltyBasis": "law", "penaltyDecision": "penalty",
+    "category": "category", "region": "province", "industry": "industry",
+}
+ENHANCED_CASE_COLUMNS = {
+    **SEARCH_CASE_COLUMNS,
+    "date": "发文日期", "org": "机构", "penalty": "处罚类型", "amount": "罚款金额",
+}
+
+def case_records(df, columns: dict, missing_amount=0.0) -> List[dict]:
+    """
+    Build the CaseDetail dicts of a page of cases, one column at a time.
+    
+    Text fields are converted like str() would, "" when the column is
+    missing; amounts are floats.
+    
+    Args:
+        df: Page of cases
+        columns: SEARCH_CASE_COLUMNS or ENHANCED_CASE_COLUMNS
+        missing_amount: Amount of a case without one, None for null
+    
+    Returns:
+        List of dicts with the CaseDetail fields, in field order
+    """
+    fields = {}
+    for field, sources in columns.items():
+        sources = sources if isinstance(sources, tuple) else (sources,)
+        column = next((df[col] for col in sources if col in df.columns), None)
+        if field == "amount":
+            if column is None:
+                fields[field] = [0.0] * len(df)
+            else:
+                amounts = column.astype(float)
+                fields[field] = amounts.astype(object).where(amounts.notna(), missing_amount).tolist()
+        elif column is None:
+            fields[field] = [""] * len(df)
+        else:
+            fields[field] = column.astype(str).tolist()
+    names = list(fields)
+    return [dict(zip(names, values)) for values in zip(*fields.values())]
+
+def search_json_response(records: List[dict], total: int, page: int, pageSize: int,
+                         next_cursor: Optional[str] = None, plan: Optional[str] = None) -> Response:
+    """Encode a SearchResponse directly, skipping per-case model validation
+    
+    The search plan, if given, is sent in the X-Search-Plan header.
+    """
+    payload = {"data": records, "total": total, "page": page, "pageSize": pageSize, "nextCursor": next_cursor}
+    headers = {"X-Search-Plan": plan} if plan else None
+    if orjson is not None:
+        return Response(orjson.dumps(payload), media_type="application/json", headers=headers)
+    return JSONResponse(payload, headers=headers)
 
 tempdir = "../data/penalty/csrc2/temp"
 pencsrc2 = "../data/penalty/csrc2"
 
 # Import web crawling functions
 from web_crawler import get_sumeventdf_backend, update_sumeventdf_backend, get_csrc2analysis, content_length_analysis, download_attachment
+from dataset_registry import DatasetRef, registry
+from data_service import PUBLISH_DATE_COLUMN, count_values, drop_derived_columns, get_publish_dates, with_case_texts
+from search_index import (
+    KeyIndex, amount_histogram, amount_mask, cached_rows, count_date_range, cursor_after, date_range_mask, facet_counts,
+    find_parties, get_amount_index, index_build_stats, key_mask, key_rows, keyword_mask, lookup, normalize_query, page_after_cursor,
+    query_cache, query_fingerprint, party_rows, rank_by_relevance, rows_mask, sort_newest_first
+)
+from search_planner import FILTER_COSTS, FilterStep, QueryPlan, keyword_filter_cost
+from law_index import citing_rows, get_law_index, parse_legal_basis
+from similar_cases import lsa_available, similar_rows
+from near_duplicates import DUPLICATE_DATASET, analyzed_mask, case_cluster, collapse_duplicates, get_duplicate_clusters
 
 
 
@@ -523,10 +601,17 @@ async def detailed_health_check():
 async def get_metrics():
     """Get application metrics"""
     try:
+        stats = metrics.get_stats()
+        stats["datasets"] = registry.stats()
+        from data_service import schema_memory_stats, shard_load_stats
+        stats["shardLoads"] = shard_load_stats
+        stats["datasetSchemas"] = schema_memory_stats
+        stats["searchIndexes"] = index_build_stats
+        stats["searchCache"] = query_cache.stats()
         return APIResponse(
             success=True,
             message="Metrics retrieved successfully",
-            data=metrics.get_stats()
+            data=stats
         )
     except Exception as e:
         logger.error(f"Failed to retrieve metrics: {str(e)}")
@@ -585,6 +670,10 @@ class CaseSearchRequest(BaseModel):
 class PenaltyAnalysisRequest(BaseModel):
     text: str = Field(..., min_length=1, max_length=50000, description="行政处罚决定书文本内容")
 
+class CollapseDuplicatesRequest(BaseModel):
+    ids: List[str] = Field(..., max_length=10000, description="链接 of the cases, in order")
+    skipAnalyzed: bool = Field(default=True, description="Also drop cases whose duplicate is already analyzed")
+
 @app.get("/")
 def read_root():
     return {"message": "DBCSRC API is running", "version": "1.0.0"}
@@ -732,8 +821,8 @@ async def cleanup_jobs():
         )
 
 
-# Cache for summary data to improve performance
-_summary_cache = {"data": None, "timestamp": 0}
+# Cache for summary data to improve performance, tied to the detail dataset generation
+_summary_cache = {"data": None, "timestamp": 0, "generation": None}
 CACHE_DURATION = 300  # 5 minutes
 
 @app.get("/summary-working", response_model=APIResponse)
@@ -749,11 +838,11 @@ def get_summary_working(
         logger.info("Generating working summary with actual data")
         
         # Load CSV data with timeout
-        from data_service import get_csrc2detail
+        from data_service import get_csrc2detail, is_metadata_column
         from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
         
         def load_csv_data():
-            return get_csrc2detail()
+            return get_csrc2detail(columns=is_metadata_column)
         
         df = get_pandas().DataFrame()
         try:
@@ -785,18 +874,18 @@ def get_summary_working(
                     if '发文日期' in df.columns:
                         # Only count organizations with valid dates for consistency
                         df_filtered = df.copy()
-                        df_filtered['发文日期'] = get_pandas().to_datetime(df_filtered['发文日期'], errors='coerce')
+                        df_filtered['发文日期'] = get_publish_dates(df)
                         df_filtered = df_filtered.dropna(subset=['发文日期', '机构'])
                         df_filtered = df_filtered[df_filtered['机构'].str.strip() != '']
                         
                         if not df_filtered.empty:
-                            org_counts = df_filtered['机构'].value_counts()  # Show ALL organizations
+                            org_counts = count_values(df_filtered['机构'])  # Show ALL organizations
                             if limit_orgs:
                                 org_counts = org_counts.head(limit_orgs)
                             by_org = org_counts.to_dict()
                     else:
                         # Fallback to original logic if no date column
-                        org_counts = df['机构'].value_counts()  # Show ALL organizations
+                        org_counts = count_values(df['机构'])  # Show ALL organizations
                         if limit_orgs:
                             org_counts = org_counts.head(limit_orgs)
                         by_org = org_counts.to_dict()
@@ -807,7 +896,7 @@ def get_summary_working(
             if '发文日期' in df.columns:
                 try:
                     df_copy = df[['发文日期']].copy()
-                    df_copy['发文日期'] = get_pandas().to_datetime(df_copy['发文日期'], errors='coerce')
+                    df_copy['发文日期'] = get_publish_dates(df)
                     df_copy = df_copy.dropna()
                     if not df_copy.empty:
                         df_copy['month'] = df_copy['发文日期'].dt.strftime('%Y-%m')
@@ -879,8 +968,8 @@ def get_org_comparison():
         logger.info("Comparing organization data with different filtering methods")
         
         # Get case detail data
-        from data_service import get_csrc2detail
-        df = get_csrc2detail()
+        from data_service import get_csrc2detail, is_metadata_column
+        df = get_csrc2detail(columns=is_metadata_column)
         
         if df.empty:
             return APIResponse(
@@ -900,7 +989,7 @@ def get_org_comparison():
         if '机构' in df.columns:
             org_series = df['机构'].dropna()
             org_series = org_series[org_series.str.strip() != '']
-            org_counts_no_filter = org_series.value_counts()
+            org_counts_no_filter = count_values(org_series)
             total_no_filter = len(org_series)
             
             comparison_data["method_1_no_date_filter"] = {
@@ -913,12 +1002,12 @@ def get_org_comparison():
         # Method 2: With date filtering (table method)
         if '机构' in df.columns and '发文日期' in df.columns:
             df_filtered = df.copy()
-            df_filtered['发文日期'] = get_pandas().to_datetime(df_filtered['发文日期'], errors='coerce')
+            df_filtered['发文日期'] = get_publish_dates(df)
             df_filtered = df_filtered.dropna(subset=['发文日期', '机构'])
             df_filtered = df_filtered[df_filtered['机构'].str.strip() != '']
             
             if not df_filtered.empty:
-                org_counts_filtered = df_filtered['机构'].value_counts()
+                org_counts_filtered = count_values(df_filtered['机构'])
                 total_filtered = len(df_filtered)
                 
                 comparison_data["method_2_with_date_filter"] = {
@@ -971,7 +1060,7 @@ def get_data_coverage():
         
         coverage_info = {
             "total_records": len(df),
-            "columns": list(df.columns),
+            "columns": list(drop_derived_columns(df).columns),
             "organizations": {},
             "time_periods": {}
         }
@@ -980,7 +1069,7 @@ def get_data_coverage():
         if '机构' in df.columns:
             org_series = df['机构'].dropna()
             org_series = org_series[org_series.str.strip() != '']
-            org_counts = org_series.value_counts()
+            org_counts = count_values(org_series)
             coverage_info["organizations"] = {
                 "total_unique": len(org_counts),
                 "top_10": org_counts.head(10).to_dict(),
@@ -990,7 +1079,7 @@ def get_data_coverage():
         # Check time period coverage
         if '发文日期' in df.columns:
             df_copy = df[['发文日期']].copy()
-            df_copy['发文日期'] = get_pandas().to_datetime(df_copy['发文日期'], errors='coerce')
+            df_copy['发文日期'] = get_publish_dates(df)
             df_copy = df_copy.dropna(subset=['发文日期'])
             if not df_copy.empty:
                 df_copy.loc[:, 'month'] = df_copy['发文日期'].dt.to_period('M').astype(str)
@@ -1057,11 +1146,11 @@ def get_org_chart_data():
         # Get case detail data from CSV files
         df = get_pandas().DataFrame()
         try:
-            from data_service import get_csrc2detail
+            from data_service import get_csrc2detail, is_metadata_column
             from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
             
             def load_csv_data():
-                return get_csrc2detail()
+                return get_csrc2detail(columns=is_metadata_column)
             
             with ThreadPoolExecutor(max_workers=1) as executor:
                 future = executor.submit(load_csv_data)
@@ -1087,13 +1176,13 @@ def get_org_chart_data():
             df_copy = df.copy()
             
             # Clean and parse dates
-            df_copy['发文日期'] = get_pandas().to_datetime(df_copy['发文日期'], errors='coerce')
+            df_copy['发文日期'] = get_publish_dates(df)
             df_copy = df_copy.dropna(subset=['发文日期', '机构'])
             df_copy = df_copy[df_copy['机构'].str.strip() != '']
             
             if not df_copy.empty:
                 # Get organization counts
-                org_counts = df_copy['机构'].value_counts()
+                org_counts = count_values(df_copy['机构'])
                 total_cases = len(df_copy)
                 
                 # Limit to top 50 organizations for consistency with table
@@ -1157,11 +1246,11 @@ def get_org_summary():
         # Get case detail data from CSV files
         df = get_pandas().DataFrame()
         try:
-            from data_service import get_csrc2detail
+            from data_service import get_csrc2detail, is_metadata_column
             from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
             
             def load_csv_data():
-                return get_csrc2detail()
+                return get_csrc2detail(columns=is_metadata_column)
             
             with ThreadPoolExecutor(max_workers=1) as executor:
                 future = executor.submit(load_csv_data)
@@ -1187,13 +1276,13 @@ def get_org_summary():
             df_copy = df.copy()
             
             # Clean and parse dates
-            df_copy['发文日期'] = get_pandas().to_datetime(df_copy['发文日期'], errors='coerce')
+            df_copy['发文日期'] = get_publish_dates(df)
             df_copy = df_copy.dropna(subset=['发文日期', '机构'])
             df_copy = df_copy[df_copy['机构'].str.strip() != '']
             
             if not df_copy.empty:
                 # Group by organization and calculate statistics
-                org_groups = df_copy.groupby('机构').agg({
+                org_groups = df_copy.groupby('机构', observed=True).agg({
                     '发文日期': ['count', 'min', 'max']
                 }).reset_index()
                 
@@ -1238,9 +1327,11 @@ def _get_summary_impl(limit_orgs: int = None, limit_months: int = None):
     try:
         import time
         
-        # Check cache first
+        # Check cache first; a new detail generation invalidates it immediately
         current_time = time.time()
+        detail_generation = registry.generation("detail_meta")
         if (_summary_cache["data"] is not None and 
+            _summary_cache["generation"] == detail_generation and
             current_time - _summary_cache["timestamp"] < CACHE_DURATION):
             logger.info("Returning cached summary data")
             return _summary_cache["data"]
@@ -1251,11 +1342,11 @@ def _get_summary_impl(limit_orgs: int = None, limit_months: int = None):
         df = get_pandas().DataFrame()
         try:
             logger.info("Loading CSV data...")
-            from data_service import get_csrc2detail
+            from data_service import get_csrc2detail, is_metadata_column
             from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
             
             def load_csv_data():
-                return get_csrc2detail()
+                return get_csrc2detail(columns=is_metadata_column)
             
             with ThreadPoolExecutor(max_workers=1) as executor:
                 future = executor.submit(load_csv_data)
@@ -1303,12 +1394,12 @@ def _get_summary_impl(limit_orgs: int = None, limit_months: int = None):
                 if '发文日期' in df.columns:
                     # Only count organizations with valid dates for consistency
                     df_filtered = df.copy()
-                    df_filtered['发文日期'] = get_pandas().to_datetime(df_filtered['发文日期'], errors='coerce')
+                    df_filtered['发文日期'] = get_publish_dates(df)
                     df_filtered = df_filtered.dropna(subset=['发文日期', '机构'])
                     df_filtered = df_filtered[df_filtered['机构'].str.strip() != '']
                     
                     if not df_filtered.empty:
-                        org_counts = df_filtered['机构'].value_counts()
+                        org_counts = count_values(df_filtered['机构'])
                         logger.info(f"Found {len(org_counts)} unique organizations (filtered for valid dates)")
                         if limit_orgs:
                             org_counts = org_counts.head(limit_orgs)
@@ -1317,7 +1408,7 @@ def _get_summary_impl(limit_orgs: int = None, limit_months: int = None):
                 else:
                     # Fallback to original logic if no date column
                     if not org_series.empty:
-                        org_counts = org_series.value_counts()
+                        org_counts = count_values(org_series)
                         logger.info(f"Found {len(org_counts)} unique organizations")
                         if limit_orgs:
                             org_counts = org_counts.head(limit_orgs)
@@ -1329,7 +1420,7 @@ def _get_summary_impl(limit_orgs: int = None, limit_months: int = None):
             if '发文日期' in df.columns:
                 try:
                     df_copy = df[['发文日期']].copy()
-                    df_copy['发文日期'] = get_pandas().to_datetime(df_copy['发文日期'], errors='coerce')
+                    df_copy['发文日期'] = get_publish_dates(df)
                     df_copy = df_copy.dropna(subset=['发文日期'])
                     if not df_copy.empty:
                         df_copy.loc[:, 'month'] = df_copy['发文日期'].dt.to_period('M').astype(str)
@@ -1368,6 +1459,7 @@ def _get_summary_impl(limit_orgs: int = None, limit_months: int = None):
         # Cache the response
         _summary_cache["data"] = response
         _summary_cache["timestamp"] = current_time
+        _summary_cache["generation"] = detail_generation
         
         return response
         
@@ -1399,6 +1491,149 @@ def test_simple():
     """Simple test endpoint to verify server responsiveness"""
     return {"status": "ok", "message": "Server is responsive", "timestamp": time.time()}
 
+def search_plan(df, keyword=None, docNumber=None, org=None, party=None, minAmount=None, legalBasis=None,
+                dateFrom=None, dateTo=None, maxAmount=None, partyMatch=None, legalBasisMatch=None,
+                dataset: DatasetRef = "intersection") -> QueryPlan:
+    """Order the search filters by their estimated cost and selectivity
+    
+    Args:
+        df: The whole case intersection
+        dataset: "intersection", or the DatasetEntry df was taken from
+        dateFrom, dateTo: Optional date range, planned like the other filters
+        partyMatch: None to match party as a substring of people, or
+            "exact", "prefix" or "fuzzy" to match individual party names
+        legalBasisMatch: None to match legalBasis as a substring of law, or
+            "citation" to find the cases citing the law (and article) it names
+    
+    Returns:
+        QueryPlan of the given filters
+    """
+    steps = []
+    if keyword:
+        steps.append(FilterStep("keyword", lambda frame: frame[keyword_mask(frame, keyword, dataset=dataset)],
+                                *keyword_filter_cost(keyword, dataset=dataset)))
+    if docNumber:
+        steps.append(FilterStep("docNumber", lambda frame: frame[frame['文号'].str.contains(docNumber, na=False, case=False)],
+                                FILTER_COSTS["scan"]))
+    if org:
+        steps.append(FilterStep("organization", lambda frame: frame[key_mask(frame, '机构', org, dataset)],
+                                FILTER_COSTS["key"], len(lookup(dataset, '机构', [org]))))
+    if party and partyMatch:
+        parties = party_rows(party, partyMatch, dataset=dataset)
+        steps.append(FilterStep("party", lambda frame: frame[rows_mask(frame, parties, dataset)], FILTER_COSTS["key"], len(parties)))
+    elif party:
+        steps.append(FilterStep("party", lambda frame: frame[keyword_mask(frame, party, columns=("people",), dataset=dataset)],
+                                *keyword_filter_cost(party, ("people",), dataset)))
+    if minAmount is not None or maxAmount is not None:
+        # Missing or non-numeric 罚款金额 counts as 0
+        amounts = get_amount_index(dataset)
+        steps.append(FilterStep("amount", lambda frame: frame[amount_mask(frame, minAmount, maxAmount, dataset=dataset)],
+                                FILTER_COSTS["key"] if amounts is not None else FILTER_COSTS["amount"],
+                                amounts.count(minAmount, maxAmount) if amounts is not None else None))
+    citing = citing_rows(legalBasis, dataset) if legalBasis and legalBasisMatch == "citation" else None
+    if citing is not None:
+        steps.append(FilterStep("legalBasis", lambda frame: frame[rows_mask(frame, citing, dataset)], FILTER_COSTS["key"], len(citing)))
+    elif legalBasis:
+        steps.append(FilterStep("legalBasis", lambda frame: frame[frame['law'].str.contains(legalBasis, na=False, case=False)],
+                                FILTER_COSTS["scan"]))
+    if dateFrom or dateTo:
+        steps.append(FilterStep("date", lambda frame: frame[date_range_mask(frame, dateFrom, dateTo, dataset)],
+                                FILTER_COSTS["key"], count_date_range(dateFrom, dateTo, dataset)))
+    return QueryPlan(df, steps)
+
+
+def filter_cases(df, plan: QueryPlan, log=True):
+    """Apply the filters of a search plan, keeping the row order
+    
+    Args:
+        df: Rows of the case intersection, with its original index
+        plan: search_plan() of the search
+        log: Log the row count after each filter; off for cursor pages,
+            which filter chunk by chunk
+    
+    Returns:
+        The matching rows of df
+    """
+    def logged(name, frame):
+        logger.info(f"After {name} filter: {len(frame)} cases")
+    
+    return plan.apply(df, logged if log else None)
+
+
+def matching_cases(df, filters: dict, dateFrom=None, dateTo=None, dataset: DatasetRef = "intersection"):
+    """
+    Cases of the intersection matching the filters and date range, newest first.
+    
+    The matching row positions are cached per query and dataset generation,
+    so following pages of the same search skip the filtering.
+    
+    Args:
+        df: The whole case intersection
+        filters: Keyword arguments of search_plan
+        dataset: "intersection", or the DatasetEntry df was taken from
+    
+    Returns:
+        Tuple of (positions for df.iloc in result order, plan description
+        or "cached")
+    """
+    plans = []
+    
+    def compute():
+        plans.append(search_plan(df, dateFrom=dateFrom, dateTo=dateTo, dataset=dataset, **filters))
+        logger.info(f"Search plan: {plans[0].describe()}")
+        return sort_newest_first(filter_cases(df, plans[0]), dateFrom, dateTo, dataset)
+    
+    query = normalize_query(dateFrom=dateFrom, dateTo=dateTo, **filters)
+    rows = cached_rows(df, query, compute, dataset)
+    return rows, plans[0].describe() if plans else "cached"
+
+
+def paginate_cases(df, filters: dict, page: int, pageSize: int, cursor: Optional[str], dateFrom=None, dateTo=None,
+                   dataset: DatasetRef = "intersection"):
+    """
+    Filter, sort newest first and cut one page of the case intersection.
+    
+    With a cursor the date order is walked from where the previous page
+    ended instead, and the total is the one the cursor carries.
+    
+    Args:
+        df: The whole case intersection
+        filters: Keyword arguments of filter_cases
+        cursor: nextCursor of the previous page, or None for offset paging
+        dataset: "intersection", or the DatasetEntry df was taken from
+    
+    Returns:
+        Tuple of (page rows, total matches, nextCursor or None, search plan
+        description)
+    
+    Raises:
+        HTTPException: 400 when the cursor is invalid for this query
+    """
+    fingerprint = query_fingerprint(dateFrom=dateFrom, dateTo=dateTo, **filters)
+    total = None
+    if cursor:
+        # The cursor walk keeps to the date range itself
+        plan = search_plan(df, dataset=dataset, **filters)
+        description = plan.describe()
+        try:
+            page_df, more, total = page_after_cursor(
+                df, cursor, fingerprint, pageSize, lambda rows: filter_cases(rows, plan, log=False), dateFrom, dateTo, dataset
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        logger.info(f"Cursor page: {len(page_df)} cases")
+    if total is None:
+        matches, description = matching_cases(df, filters, dateFrom, dateTo, dataset)
+        logger.info(f"After date filter, sorted newest first: {len(matches)} cases")
+        total = len(matches)
+        if not cursor:
+            start = (page - 1) * pageSize
+            page_df = df.iloc[matches[start:start + pageSize]]
+            more = start + pageSize < total
+    next_cursor = cursor_after(int(page_df.index[-1]), total, fingerprint, dataset) if more and len(page_df) else None
+    return page_df, total, next_cursor, description
+
+
 @app.get("/search", response_model=SearchResponse)
 @app.get("/api/search", response_model=SearchResponse)
 def search_cases(
@@ -1407,11 +1642,16 @@ def search_cases(
     page: int = Query(1, ge=1, le=1000),
     pageSize: int = Query(10, ge=1, le=100),
     dateFrom: str = Query(None),
-    dateTo: str = Query(None)
+    dateTo: str = Query(None),
+    cursor: str = Query(None, max_length=1000)
 ):
-    """Search cases with filters"""
+    """Search cases with filters
+    
+    Pass the nextCursor of a response as cursor to fetch the following page
+    without the page limit; page is then ignored.
+    """
     try:
-        logger.info(f"Searching cases with filters: keyword={keyword}, org={org}, page={page}, pageSize={pageSize}")
+        logger.info(f"Searching cases with filters: keyword={keyword}, org={org}, page={page}, pageSize={pageSize}, cursor={bool(cursor)}")
         
         # Validate date formats
         if dateFrom:
@@ -1427,8 +1667,9 @@ def search_cases(
                 raise HTTPException(status_code=400, detail="dateTo must be in YYYY-MM-DD format")
         
         try:
-            from data_service import get_csrc2_intersection
-            df = get_csrc2_intersection()
+            from data_service import get_csrc2_intersection_entry
+            intersection = get_csrc2_intersection_entry()
+            df = intersection.view()
         except Exception as db_error:
             logger.error(f"Database access error: {db_error}")
             return SearchResponse(data=[], total=0, page=page, pageSize=pageSize)
@@ -1440,83 +1681,16 @@ def search_cases(
         original_count = len(df)
         logger.info(f"Starting search with {original_count} total cases")
         
-        # Apply filters
-        if keyword:
-            mask = df['名称'].str.contains(keyword, na=False, case=False) | df['内容'].str.contains(keyword, na=False, case=False)
-            df = df[mask]
-            logger.info(f"After keyword filter: {len(df)} cases")
-        
-        if org:
-            df = df[df['机构'] == org]
-            logger.info(f"After organization filter: {len(df)} cases")
-        
-        if dateFrom:
-            try:
-                df = df[get_pandas().to_datetime(df['发文日期'], errors='coerce') >= get_pandas().to_datetime(dateFrom)]
-                logger.info(f"After dateFrom filter: {len(df)} cases")
-            except Exception as date_error:
-                logger.warning(f"Date filtering error for dateFrom: {date_error}")
-        
-        if dateTo:
-            try:
-                df = df[get_pandas().to_datetime(df['发文日期'], errors='coerce') <= get_pandas().to_datetime(dateTo)]
-                logger.info(f"After dateTo filter: {len(df)} cases")
-            except Exception as date_error:
-                logger.warning(f"Date filtering error for dateTo: {date_error}")
+        # Filters, date range and newest-first order (undated cases last), then one page
+        paginated_df, total, next_cursor, plan = paginate_cases(
+            df, {"keyword": keyword, "org": org}, page, pageSize, cursor, dateFrom, dateTo, intersection
+        )
+        paginated_df = with_case_texts(paginated_df)
         
-        # Sort by date in descending order (newest first)
-        try:
-            # Convert date column to datetime for proper sorting
-            df['发文日期_datetime'] = get_pandas().to_datetime(df['发文日期'], errors='coerce')
-            # Sort by date descending, with NaT (invalid dates) at the end
-            df = df.sort_values('发文日期_datetime', ascending=False, na_position='last')
-            # Drop the temporary datetime column
-            df = df.drop('发文日期_datetime', axis=1)
-            logger.info(f"Data sorted by date in descending order")
-        except Exception as sort_error:
-            logger.warning(f"Date sorting error: {sort_error}, proceeding without sorting")
-        
-        total = len(df)
-        
-        # Pagination
-        start = (page - 1) * pageSize
-        end = start + pageSize
-        paginated_df = df.iloc[start:end]
-        
-        # Convert to list of dicts
-        cases = []
-        for _, row in paginated_df.iterrows():
-            # Extract name and docNumber from the combined field
-            name_field = str(row.get('名称', ''))
-            doc_field = str(row.get('文号', ''))
-            
-            case_detail = CaseDetail(
-                id=str(row.get('链接', '')),
-                title=name_field,
-                name=name_field,
-                docNumber=doc_field,
-                date=str(row.get('date', row.get('发文日期', ''))),
-                org=str(row.get('org', row.get('机构', ''))),
-                content=str(row.get('内容', '')),
-                penalty=str(row.get('category', '')),  # 案件类型从category获取
-                amount=float(row.get('amount', row.get('罚款金额', 0))) if get_pandas().notna(row.get('amount', row.get('罚款金额'))) else 0,
-                party=str(row.get('people', '')),
-                violationFacts=str(row.get('event', '')),
-                penaltyBasis=str(row.get('law', '')),
-                penaltyDecision=str(row.get('penalty', '')),  # 处罚决定从penalty获取
-                category=str(row.get('category', '')),
-                region=str(row.get('province', '')),
-                industry=str(row.get('industry', ''))
-            )
-            cases.append(case_detail)
+        cases = case_records(paginated_df, SEARCH_CASE_COLUMNS)
         
         logger.info(f"Search completed: returning {len(cases)} cases out of {total} total matches")
-        return SearchResponse(
-            data=cases,
-            total=total,
-            page=page,
-            pageSize=pageSize
-        )
+        return search_json_response(cases, total, page, pageSize, next_cursor, plan)
         
     except HTTPException:
         raise
@@ -1533,14 +1707,34 @@ def search_cases_enhanced(
     dateFrom: str = Query(None),
     dateTo: str = Query(None),
     party: str = Query(None, max_length=100),
+    partyMatch: str = Query("contains", pattern="^(contains|exact|prefix|fuzzy)$"),
     minAmount: float = Query(None, ge=0),
+    maxAmount: float = Query(None, ge=0),
     legalBasis: str = Query(None, max_length=200),
+    legalBasisMatch: str = Query("contains", pattern="^(contains|citation)$"),
     page: int = Query(1, ge=1, le=1000),
-    pageSize: int = Query(10, ge=1, le=100)
+    pageSize: int = Query(10, ge=1, le=100),
+    sort: str = Query("date", pattern="^(date|relevance)$"),
+    cursor: str = Query(None, max_length=1000)
 ):
-    """Enhanced search cases with additional filters"""
+    """Enhanced search cases with additional filters
+    
+    minAmount and maxAmount bound 罚款金额 inclusively; cases without an
+    amount count as 0.
+    partyMatch=contains matches party anywhere in the people text; exact,
+    prefix and fuzzy (one edit) match the individual party names instead.
+    legalBasisMatch=citation finds the cases citing the law, and article if
+    given, named by legalBasis (e.g. 《证券法》第一百九十三条), abbreviations
+    and numerals resolved. A legalBasis naming no law (no 《》 citation and
+    no law name cited by any case, e.g. 内幕交易) falls back to contains.
+    sort=relevance orders keyword matches by their BM25 score over 名称 and
+    内容 instead of by publish date; without a keyword it has no effect.
+    In date order, pass the nextCursor of a response as cursor to fetch the
+    following page without the page limit; page is then ignored.
+    """
     try:
-        logger.info(f"Enhanced search with filters: keyword={keyword}, docNumber={docNumber}, org={org}, party={party}, minAmount={minAmount}, legalBasis={legalBasis}")
+        logger.info(f"Enhanced search with filters: keyword={keyword}, docNumber={docNumber}, org={org}, party={party}, minAmount={minAmount}, maxAmount={maxAmount}, legalBasis={legalBasis}, sort={sort}")
+        check_amount_range(minAmount, maxAmount)
         
         # Validate date formats
         if dateFrom:
@@ -1556,8 +1750,9 @@ def search_cases_enhanced(
                 raise HTTPException(status_code=400, detail="dateTo must be in YYYY-MM-DD format")
         
         try:
-            from data_service import get_csrc2_intersection
-            df = get_csrc2_intersection()
+            from data_service import get_csrc2_intersection_entry
+            intersection = get_csrc2_intersection_entry()
+            df = intersection.view()
         except Exception as db_error:
             logger.error(f"Database access error: {db_error}")
             return SearchResponse(data=[], total=0, page=page, pageSize=pageSize)
@@ -1575,110 +1770,369 @@ def search_cases_enhanced(
             logger.info(f"First row province: {first_row.get('province', 'NOT_FOUND')}")
             logger.info(f"First row industry: {first_row.get('industry', 'NOT_FOUND')}")
         
-        # Apply filters
-        if keyword:
-            mask = df['名称'].str.contains(keyword, na=False, case=False) | df['内容'].str.contains(keyword, na=False, case=False)
-            df = df[mask]
-            logger.info(f"After keyword filter: {len(df)} cases")
+        filters = {"keyword": keyword, "docNumber": docNumber, "org": org, "party": party,
+                   "partyMatch": partyMatch if party and partyMatch != "contains" else None,
+                   "minAmount": minAmount, "maxAmount": maxAmount, "legalBasis": legalBasis,
+                   "legalBasisMatch": legalBasisMatch if legalBasis and legalBasisMatch != "contains" else None}
+        if sort == "relevance" and keyword:
+            if cursor:
+                raise HTTPException(status_code=400, detail="cursor is only supported with sort=date")
+            matches, plan = matching_cases(df, filters, dateFrom, dateTo, intersection)
+            df = df.iloc[matches]
+            total = len(df)
+            # Only the rows up to the end of the page are ranked; ties stay newest first
+            start = (page - 1) * pageSize
+            end = start + pageSize
+            paginated_df = df.iloc[rank_by_relevance(df, keyword, end, intersection)[start:end]]
+            next_cursor = None
+        else:
+            # Filters, date range and newest-first order (undated cases last), then one page
+            paginated_df, total, next_cursor, plan = paginate_cases(df, filters, page, pageSize, cursor, dateFrom, dateTo,
+                                                                    intersection)
+        paginated_df = with_case_texts(paginated_df)
         
-        if docNumber:
-            df = df[df['文号'].str.contains(docNumber, na=False, case=False)]
-            logger.info(f"After docNumber filter: {len(df)} cases")
+        # Cases without an amount keep a null amount here
+        cases = case_records(paginated_df, ENHANCED_CASE_COLUMNS, missing_amount=None)
         
-        if org:
-            df = df[df['机构'] == org]
-            logger.info(f"After organization filter: {len(df)} cases")
-        
-        if party:
-            df = df[df['people'].str.contains(party, na=False, case=False)]
-            logger.info(f"After party filter: {len(df)} cases")
-        
-        if minAmount is not None:
-            # Ensure 罚款金额 is numeric and handle NaN values
-            df['罚款金额_numeric'] = get_pandas().to_numeric(df['罚款金额'], errors='coerce').fillna(0)
-            df = df[df['罚款金额_numeric'] >= minAmount]
-            # Drop the temporary column
-            df = df.drop('罚款金额_numeric', axis=1)
-            logger.info(f"After minAmount filter: {len(df)} cases")
-        
-        if legalBasis:
-            df = df[df['law'].str.contains(legalBasis, na=False, case=False)]
-            logger.info(f"After legalBasis filter: {len(df)} cases")
+        logger.info(f"Enhanced search completed: returning {len(cases)} cases out of {total} total matches")
+        return search_json_response(cases, total, page, pageSize, next_cursor, plan)
         
-        if dateFrom:
-            try:
-                df = df[get_pandas().to_datetime(df['发文日期'], errors='coerce') >= get_pandas().to_datetime(dateFrom)]
-                logger.info(f"After dateFrom filter: {len(df)} cases")
-            except Exception as date_error:
-                logger.warning(f"Date filtering error for dateFrom: {date_error}")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Enhanced search error: {str(e)}", exc_info=True)
+        return SearchResponse(data=[], total=0, page=page, pageSize=pageSize)
+
+
+# Facets of /api/search/facets and the intersection column each counts
+SEARCH_FACET_COLUMNS = {
+    "org": "机构",
+    "province": "province",
+    "industry": "industry",
+    "category": "category",
+    "year": PUBLISH_DATE_COLUMN,
+}
+# Lower edges of the 罚款金额 buckets of /api/search/facets, in yuan
+AMOUNT_HISTOGRAM_EDGES = [0, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000]
+
+def check_amount_range(minAmount: Optional[float], maxAmount: Optional[float]):
+    """Reject an amount range whose lower bound exceeds the upper one"""
+    if minAmount is not None and maxAmount is not None and minAmount > maxAmount:
+        raise HTTPException(status_code=400, detail="minAmount must not exceed maxAmount")
+
+@app.get("/api/search/facets", response_model=APIResponse)
+def search_facets(
+    keyword: str = Query(None, max_length=200),
+    docNumber: str = Query(None, max_length=100),
+    org: str = Query(None, max_length=100),
+    dateFrom: str = Query(None),
+    dateTo: str = Query(None),
+    party: str = Query(None, max_length=100),
+    partyMatch: str = Query("contains", pattern="^(contains|exact|prefix|fuzzy)$"),
+    minAmount: float = Query(None, ge=0),
+    maxAmount: float = Query(None, ge=0),
+    legalBasis: str = Query(None, max_length=200),
+    legalBasisMatch: str = Query("contains", pattern="^(contains|citation)$"),
+    top: int = Query(10, ge=1, le=100),
+    facets: str = Query(None, max_length=200)
+):
+    """Top values of org, province, industry, category and year among the matches of a search
+    
+    Takes the filters of /api/search-enhanced and counts the same matching
+    cases, so right after a search the matches come from the query result
+    cache. facets is an optional comma-separated subset of the facet names.
+    Blank values are not counted. The response also holds a histogram of
+    罚款金额 over AMOUNT_HISTOGRAM_EDGES.
+    """
+    try:
+        check_amount_range(minAmount, maxAmount)
+        for name, value in (("dateFrom", dateFrom), ("dateTo", dateTo)):
+            if value:
+                try:
+                    datetime.strptime(value, '%Y-%m-%d')
+                except ValueError:
+                    raise HTTPException(status_code=400, detail=f"{name} must be in YYYY-MM-DD format")
+        
+        names = [name.strip() for name in facets.split(",") if name.strip()] if facets else list(SEARCH_FACET_COLUMNS)
+        unknown = [name for name in names if name not in SEARCH_FACET_COLUMNS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown facets: {', '.join(unknown)}")
+        
+        from data_service import get_csrc2_intersection_entry
+        intersection = get_csrc2_intersection_entry()
+        df = intersection.view()
+        filters = {"keyword": keyword, "docNumber": docNumber, "org": org, "party": party,
+                   "partyMatch": partyMatch if party and partyMatch != "contains" else None,
+                   "minAmount": minAmount, "maxAmount": maxAmount, "legalBasis": legalBasis,
+                   "legalBasisMatch": legalBasisMatch if legalBasis and legalBasisMatch != "contains" else None}
+        matches, plan = matching_cases(df, filters, dateFrom, dateTo, intersection)
+        rows = df.index.to_numpy()[matches]
+        counts = facet_counts(rows, {name: SEARCH_FACET_COLUMNS[name] for name in names}, top, intersection)
+        amounts = amount_histogram(rows, AMOUNT_HISTOGRAM_EDGES, dataset=intersection)
+        logger.info(f"Facets of {len(matches)} matching cases computed, plan: {plan}")
         
-        if dateTo:
-            try:
-                df = df[get_pandas().to_datetime(df['发文日期'], errors='coerce') <= get_pandas().to_datetime(dateTo)]
-                logger.info(f"After dateTo filter: {len(df)} cases")
-            except Exception as date_error:
-                logger.warning(f"Date filtering error for dateTo: {date_error}")
+        return APIResponse(
+            success=True,
+            message=f"Facet counts of {len(matches)} matching cases",
+            data={"total": len(matches), "facets": counts, "amounts": amounts},
+            count=len(matches)
+        )
         
-        # Sort by date in descending order (newest first)
-        try:
-            # Convert date column to datetime for proper sorting
-            df['发文日期_datetime'] = get_pandas().to_datetime(df['发文日期'], errors='coerce')
-            # Sort by date descending, with NaT (invalid dates) at the end
-            df = df.sort_values('发文日期_datetime', ascending=False, na_position='last')
-            # Drop the temporary datetime column
-            df = df.drop('发文日期_datetime', axis=1)
-            logger.info(f"Data sorted by date in descending order")
-        except Exception as sort_error:
-            logger.warning(f"Date sorting error: {sort_error}, proceeding without sorting")
-        
-        total = len(df)
-        
-        # Pagination
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Search facets error: {str(e)}", exc_info=True)
+        return APIResponse(
+            success=False,
+            message="Failed to compute search facets",
+            error=str(e)
+        )
+
+
+@app.get("/api/laws/cases", response_model=APIResponse)
+def get_law_citing_cases(citation: str = Query(..., min_length=1, max_length=200)):
+    """Ids of the cases citing a law, or one article of it
+    
+    citation is e.g. 《证券法》第一百九十三条, 证券法第193条 or a bare law
+    name; abbreviations are resolved to the full law name.
+    """
+    try:
+        parsed = parse_legal_basis(citation)
+        if parsed is None:
+            raise HTTPException(status_code=400, detail="citation must name a law")
+        from data_service import get_csrc2_intersection_entry
+        intersection = get_csrc2_intersection_entry()
+        index = get_law_index(intersection)
+        if index is None:
+            raise HTTPException(status_code=404, detail="No legal basis data found")
+        
+        df = intersection.view()
+        rows = index.lookup(*parsed)
+        law, article = index.resolve(parsed[0]), parsed[1]
+        case_ids = df["链接"].to_numpy()[rows].tolist() if "链接" in df.columns else []
+        
+        return APIResponse(
+            success=True,
+            message=f"Found {len(rows)} cases citing {law}" + (f" article {article}" if article is not None else ""),
+            data={"law": law, "article": article, "caseIds": case_ids},
+            count=len(rows)
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Law citation lookup error: {str(e)}", exc_info=True)
+        return APIResponse(
+            success=False,
+            message="Failed to look up cases citing the law",
+            error=str(e)
+        )
+
+
+@app.get("/api/parties", response_model=APIResponse)
+def search_parties(
+    name: str = Query(..., min_length=1, max_length=100),
+    mode: str = Query("prefix", pattern="^(exact|prefix|fuzzy)$"),
+    maxDistance: int = Query(1, ge=1, le=2),
+    limit: int = Query(20, ge=1, le=100)
+):
+    """Find parties by exact name, prefix or edit distance, with the ids of their cases
+    
+    Names are the individual parties listed in the people field of the case
+    intersection, compared case-insensitively. Prefix matches naming the
+    most cases come first, fuzzy matches closest first.
+    """
+    try:
+        from data_service import get_csrc2_intersection_entry
+        intersection = get_csrc2_intersection_entry()
+        df = intersection.view()
+        links = df["链接"].to_numpy() if "链接" in df.columns else None
+        parties = []
+        for party, rows in find_parties(name, mode, maxDistance, limit, intersection):
+            parties.append({
+                "name": party,
+                "caseCount": len(rows),
+                "caseIds": links[rows].tolist() if links is not None else []
+            })
+        
+        return APIResponse(
+            success=True,
+            message=f"Found {len(parties)} parties matching {name}",
+            data=parties,
+            count=len(parties)
+        )
+        
+    except Exception as e:
+        logger.error(f"Party search error: {str(e)}", exc_info=True)
+        return APIResponse(
+            success=False,
+            message="Failed to search parties",
+            error=str(e)
+        )
+
+
+@app.get("/api/cases/{case_id:path}/similar", response_model=APIResponse)
+def get_similar_cases(
+    case_id: str,
+    topK: int = Query(10, ge=1, le=100),
+    method: str = Query("tfidf", pattern="^(tfidf|lsa)$")
+):
+    """Cases most similar to one case, by cosine of their texts
+    
+    case_id is the case's 链接 (the id of the search results). tfidf ranks
+    by character bigram TF-IDF, lsa by truncated-SVD embeddings of it and
+    needs scikit-learn. Everything is computed locally.
+    """
+    try:
+        if method == "lsa" and not lsa_available():
+            raise HTTPException(status_code=400, detail="method=lsa requires scikit-learn")
+        from data_service import get_csrc2_intersection_entry
+        intersection = get_csrc2_intersection_entry()
+        df = intersection.view()
+        rows = lookup(intersection, "链接", [case_id])
+        if not len(rows):
+            raise HTTPException(status_code=404, detail=f"Case not found: {case_id}")
+        
+        result = similar_rows(int(rows[-1]), topK, method, intersection, exclude=rows)
+        if result is None:
+            raise HTTPException(status_code=404, detail="No case texts found")
+        similar, scores = result
+        cases = case_records(df.iloc[similar], {
+            "id": "链接", "title": "名称", "docNumber": "文号", "date": "发文日期", "org": "机构"
+        })
+        for case, score in zip(cases, scores.tolist()):
+            case["similarity"] = round(score, 4)
+        
+        return APIResponse(
+            success=True,
+            message=f"Found {len(cases)} cases similar to {case_id}",
+            data={"caseId": case_id, "method": method, "cases": cases},
+            count=len(cases)
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Similar cases error: {str(e)}", exc_info=True)
+        return APIResponse(
+            success=False,
+            message="Failed to find similar cases",
+            error=str(e)
+        )
+
+
+DUPLICATE_CASE_COLUMNS = {"id": "链接", "title": "名称", "docNumber": "文号", "date": "发文日期", "org": "机构"}
+
+def duplicate_members(frame, rows, similarity) -> List[dict]:
+    """Case records of the rows of a duplicate cluster, with their similarity and analysis status"""
+    members = case_records(frame.iloc[rows], DUPLICATE_CASE_COLUMNS)
+    analyzed = analyzed_mask([member["id"] for member in members])
+    for member, score, done in zip(members, similarity, analyzed.tolist()):
+        member["similarity"] = round(float(score), 4)
+        member["analyzed"] = done
+    return members
+
+
+@app.get("/api/duplicates", response_model=APIResponse)
+def list_duplicate_clusters(
+    page: int = Query(1, ge=1, le=1000),
+    pageSize: int = Query(20, ge=1, le=100)
+):
+    """Clusters of near-duplicate cases, largest first
+    
+    Each cluster lists its cases, the first published one first, with their
+    estimated similarity to it and whether they already have analysis results.
+    """
+    try:
+        dataset = registry.entry(DUPLICATE_DATASET)
+        clusters = get_duplicate_clusters(dataset)
+        if clusters is None:
+            raise HTTPException(status_code=404, detail="No case data found")
+        frame = dataset.view()
+        sizes = clusters.sizes().tolist()
+        order = sorted(range(len(sizes)), key=lambda cluster: -sizes[cluster])
         start = (page - 1) * pageSize
-        end = start + pageSize
-        paginated_df = df.iloc[start:end]
-        
-        # Convert to list of dicts
-        cases = []
-        for _, row in paginated_df.iterrows():
-            # Extract name and docNumber from the combined field
-            name_field = str(row.get('名称', ''))
-            doc_field = str(row.get('文号', ''))
-            
-            case_detail = CaseDetail(
-                id=str(row.get('链接', '')),
-                title=name_field,
-                name=name_field,
-                docNumber=doc_field,
-                date=str(row.get('发文日期', '')),
-                org=row.get('机构', ''),
-                content=row.get('内容', ''),
-                penalty=row.get('处罚类型', ''),
-                amount=row.get('罚款金额', 0),
-                party=row.get('people', ''),
-                violationFacts=row.get('event', ''),
-                penaltyBasis=row.get('law', ''),
-                penaltyDecision=row.get('penalty', ''),
-                category=row.get('category', ''),
-                region=row.get('province', ''),
-                industry=row.get('industry', '')
-            )
-            logger.info(f"Case data: category={case_detail.category}, region={case_detail.region}, industry={case_detail.industry}")
-            cases.append(case_detail)
+        result = []
+        for cluster in order[start:start + pageSize]:
+            lo, hi = clusters.offsets[cluster], clusters.offsets[cluster + 1]
+            members = duplicate_members(frame, clusters.rows[lo:hi], clusters.similarity[lo:hi])
+            result.append({"clusterId": cluster, "size": len(members), "cases": members})
         
-        logger.info(f"Enhanced search completed: returning {len(cases)} cases out of {total} total matches")
-        return SearchResponse(
-            data=cases,
-            total=total,
-            page=page,
-            pageSize=pageSize
+        return APIResponse(
+            success=True,
+            message=f"Found {len(clusters)} duplicate clusters covering {len(clusters.rows)} cases",
+            data={"total": len(clusters), "duplicateCases": len(clusters.rows), "clusters": result},
+            count=len(result)
         )
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Enhanced search error: {str(e)}", exc_info=True)
-        return SearchResponse(data=[], total=0, page=page, pageSize=pageSize)
+        logger.error(f"Duplicate cluster listing error: {str(e)}", exc_info=True)
+        return APIResponse(
+            success=False,
+            message="Failed to list duplicate clusters",
+            error=str(e)
+        )
+
+
+@app.get("/api/cases/{case_id:path}/duplicates", response_model=APIResponse)
+def get_case_duplicates(case_id: str):
+    """Near duplicates of one case, the case itself included; empty when it has none"""
+    try:
+        dataset = registry.entry(DUPLICATE_DATASET)
+        clusters = get_duplicate_clusters(dataset)
+        if clusters is None:
+            raise HTTPException(status_code=404, detail="No case data found")
+        rows = case_cluster(case_id, dataset)
+        members = []
+        if rows is not None:
+            lo = clusters.offsets[clusters.cluster_of[rows[0]]]
+            members = duplicate_members(dataset.view(), rows, clusters.similarity[lo:lo + len(rows)])
+        
+        return APIResponse(
+            success=True,
+            message=f"Found {max(len(members) - 1, 0)} duplicates of {case_id}",
+            data={"caseId": case_id, "cases": members},
+            count=len(members)
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Case duplicates error: {str(e)}", exc_info=True)
+        return APIResponse(
+            success=False,
+            message="Failed to find duplicates of the case",
+            error=str(e)
+        )
+
+
+@app.post("/api/duplicates/collapse", response_model=APIResponse)
+def collapse_duplicate_cases(request: CollapseDuplicatesRequest):
+    """Keep one case per duplicate cluster of a list of cases
+    
+    Later cases of a cluster already in the list are dropped, and with
+    skipAnalyzed so are cases whose duplicate already has analysis results.
+    Use it to trim a batch before sending it to the LLM.
+    """
+    try:
+        kept, skipped = collapse_duplicates(request.ids, request.skipAnalyzed)
+        
+        return APIResponse(
+            success=True,
+            message=f"Kept {len(kept)} of {len(request.ids)} cases, {len(skipped)} duplicates dropped",
+            data={"ids": kept, "skipped": skipped},
+            count=len(kept)
+        )
+        
+    except Exception as e:
+        logger.error(f"Duplicate collapse error: {str(e)}", exc_info=True)
+        return APIResponse(
+            success=False,
+            message="Failed to collapse duplicate cases",
+            error=str(e)
+        )
 
 
 @app.post("/update", response_model=APIResponse)
@@ -2115,7 +2569,7 @@ async def penalty_analysis(request: PenaltyAnalysisRequest):
             error=str(e)
         )
 
-async def process_batch_penalty_analysis_background(job_id: str, file_content: bytes, filename: str, idcol: str, contentcol: str, max_workers: int = None):
+async def process_batch_penalty_analysis_background(job_id: str, file_content: bytes, filename: str, idcol: str, contentcol: str, max_workers: int = None, skip_duplicates: bool = False):
     """Background task for batch penalty analysis with parallel processing support"""
     try:
         # Update job status to running
@@ -2127,6 +2581,16 @@ async def process_batch_penalty_analysis_background(job_id: str, file_content: b
         file_obj = io.BytesIO(file_content)
         df = get_pandas().read_csv(file_obj, encoding='utf-8-sig')
         
+        # Drop near duplicates of cases already analyzed or earlier in the file
+        skipped = []
+        if skip_duplicates and idcol in df.columns:
+            ids = df[idcol].astype(str).tolist()
+            kept, skipped = collapse_duplicates(ids)
+            if skipped:
+                dropped = {item["id"] for item in skipped}
+                df = df[[case_id not in dropped for case_id in ids]]
+                logger.info(f"Skipping {len(skipped)} near-duplicate rows in job {job_id}")
+        
         # Update total records
         job_storage[job_id].total_records = len(df)
         logger.info(f"Processing {len(df)} rows for penalty analysis in job {job_id} using parallel processing")
@@ -2139,7 +2603,7 @@ async def process_batch_penalty_analysis_background(job_id: str, file_content: b
         job_storage[job_id].completed_at = datetime.now()
         job_storage[job_id].progress = 100
         job_storage[job_id].processed_records = len(result_df)
-        job_storage[job_id].result = {"data": result_df.to_dict('records')}
+        job_storage[job_id].result = {"data": result_df.to_dict('records'), "skippedDuplicates": skipped}
         
         logger.info(f"Batch penalty analysis completed successfully for job {job_id} with {len(result_df)} records")
         
@@ -2156,7 +2620,8 @@ async def batch_penalty_analysis(
     file: UploadFile = File(...),
     idcol: str = Query(...),
     contentcol: str = Query(...),
-    max_workers: int = Query(None, description="Maximum number of parallel workers for processing (default: auto-detect)")
+    max_workers: int = Query(None, description="Maximum number of parallel workers for processing (default: auto-detect)"),
+    skipDuplicates: bool = Query(False, description="Skip near duplicates of analyzed cases and of earlier rows")
 ):
     """Start batch penalty analysis as background job"""
     try:
@@ -2183,7 +2648,8 @@ async def batch_penalty_analysis(
             file.filename,
             idcol,
             contentcol,
-            max_workers
+            max_workers,
+            skipDuplicates
         )
         
         logger.info(f"Batch penalty analysis job {job_id} started for file: {file.filename}")
@@ -2400,6 +2866,42 @@ async def refresh_data():
             count=0
         )
 
+@app.post("/compact-shards", response_model=APIResponse)
+@app.post("/api/compact-shards", response_model=APIResponse)
+def compact_shards_endpoint(
+    family: Optional[List[str]] = Query(None, description="Shard families to compact (detail, analysis, label, cat, split); all when omitted"),
+    dry_run: bool = Query(False, description="Only report what would be merged")
+):
+    """Merge each CSV shard family into one deduplicated, sorted, compressed file"""
+    try:
+        from shard_compaction import compact_shards
+        
+        logger.info(f"Starting shard compaction: families={family or 'all'}, dry_run={dry_run}")
+        report = compact_shards(family, dry_run=dry_run)
+        compacted = [name for name, entry in report["families"].items() if entry.get("compacted")]
+        if compacted:
+            # Signatures changed anyway; drop the old copies right away
+            registry.invalidate(*compacted)
+        
+        logger.info(f"Shard compaction finished: {report['bytesSaved']} bytes saved, {report['duplicatesDropped']} duplicates dropped")
+        return APIResponse(
+            success=True,
+            message=f"Compacted {len(compacted)} shard families" if not dry_run else "Compaction dry run completed",
+            count=len(compacted),
+            data=report
+        )
+        
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Shard compaction failed: {str(e)}", exc_info=True)
+        return APIResponse(
+            success=False,
+            message="Failed to compact shards",
+            error=str(e),
+            count=0
+        )
+
 @app.post("/update-analysis-data", response_model=APIResponse)
 async def update_analysis_data():
     """Update analysis data by processing new case data and creating timestamped files"""
@@ -2441,45 +2943,26 @@ async def get_download_data():
     try:
         logger.info("Getting download data statistics")
         
-        import glob
-        import os
-        
-        # Define data directory path
-        data_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'penalty', 'csrc2')
-        
-        # Helper function to get CSV file count
-        def get_csv_stats(pattern, unique_id_column):
-            files = glob.glob(os.path.join(data_dir, pattern))
-            if files:
-                dflist = []
-                for filepath in files:
-                    try:
-                        df = get_pandas().read_csv(filepath, encoding='utf-8-sig')
-                        dflist.append(df)
-                    except Exception as e:
-                        # Skip files that can't be read
-                        pass
-                
-                if dflist:
-                    # Combine all dataframes like get_csvdf does
-                    combined_df = get_pandas().concat(dflist)
-                    combined_df.reset_index(drop=True, inplace=True)
-                    count = len(combined_df)
-                    unique_count = combined_df[unique_id_column].nunique() if unique_id_column in combined_df.columns else count
-                    return count, unique_count
-            return 0, 0
+        # Helper function to get row and unique counts from the shared datasets
+        def get_csv_stats(dataset, unique_id_column):
+            df = registry.get(dataset)
+            if df.empty:
+                return 0, 0
+            count = len(df)
+            unique_count = df[unique_id_column].nunique() if unique_id_column in df.columns else count
+            return count, unique_count
         
         # Get case detail data stats (uses "链接" as unique ID)
-        case_detail_count, case_detail_unique = get_csv_stats("csrcdtlall*.csv", "链接")
+        case_detail_count, case_detail_unique = get_csv_stats("detail", "链接")
         
         # Get analysis data stats (uses "链接" as unique ID)
-        analysis_count, analysis_unique = get_csv_stats("csrc2analysis*.csv", "链接")
+        analysis_count, analysis_unique = get_csv_stats("analysis", "链接")
         
         # Get category data stats (uses "id" as unique ID)
-        category_count, category_unique = get_csv_stats("csrccat*.csv", "id")
+        category_count, category_unique = get_csv_stats("cat", "id")
         
         # Get split data stats (uses "id" as unique ID)
-        split_count, split_unique = get_csv_stats("csrcsplit*.csv", "id")
+        split_count, split_unique = get_csv_stats("split", "id")
         
         data = {
             "caseDetail": {
@@ -2521,6 +3004,64 @@ async def get_download_data():
 
 from fastapi.responses import StreamingResponse
 
+# Rows encoded per chunk of a streamed CSV export
+CSV_EXPORT_CHUNK_ROWS = 5000
+
+def csv_chunks(df, prepare=None, chunk_rows: int = CSV_EXPORT_CHUNK_ROWS):
+    """
+    Encode a DataFrame as UTF-8 CSV chunk by chunk, for a StreamingResponse.
+    
+    The BOM is sent once, then the header with the first chunk. Only one
+    chunk is rendered at a time, so an export runs in memory bounded by
+    chunk_rows and the download starts with the first chunk.
+    
+    Args:
+        df: Rows to export
+        prepare: Optional function applied to each chunk before encoding,
+            e.g. to fetch its 内容 or select and rename its columns
+        chunk_rows: Rows per chunk
+    
+    Yields:
+        bytes
+    """
+    yield "\ufeff".encode("utf-8")
+    # An empty frame still gets its header
+    for start in range(0, max(len(df), 1), chunk_rows):
+        chunk = df.iloc[start:start + chunk_rows]
+        if prepare is not None:
+            chunk = prepare(chunk)
+        yield chunk.to_csv(index=False, header=start == 0).encode("utf-8")
+
+# Last line of a CSV export that failed after its first chunk was sent
+CSV_EXPORT_ABORTED = "\n#EXPORT ABORTED: the download is incomplete\n"
+
+def _stream_csv(first: bytes, chunks, filename: str):
+    """Yield the already rendered first chunk, then the rest of an export"""
+    yield first
+    try:
+        yield from chunks
+    except Exception as e:
+        # The 200 is already sent, so mark the file as truncated instead
+        logger.error(f"CSV export {filename} aborted: {str(e)}", exc_info=True)
+        yield CSV_EXPORT_ABORTED.encode("utf-8")
+
+def csv_response(df, filename: str, prepare=None, chunk_rows: int = CSV_EXPORT_CHUNK_ROWS) -> StreamingResponse:
+    """
+    StreamingResponse of a DataFrame as a CSV attachment, see csv_chunks.
+    
+    The BOM and the first chunk are rendered before the response is built,
+    so an error in prepare is raised to the endpoint while it can still
+    answer with an error status. A later error ends the file with
+    CSV_EXPORT_ABORTED.
+    """
+    chunks = csv_chunks(df, prepare, chunk_rows)
+    first = next(chunks) + next(chunks)
+    return StreamingResponse(
+        _stream_csv(first, chunks, filename),
+        media_type="text/csv",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
 @app.get("/download/case-detail")
 async def download_case_detail():
     """Download case detail CSV file"""
@@ -2529,21 +3070,12 @@ async def download_case_detail():
         
         from data_service import get_csrc2detail
         
-        df = get_csrc2detail()
-        
-        # Convert to CSV
-        csv_buffer = io.StringIO()
-        df.to_csv(csv_buffer, index=False, encoding='utf-8-sig')
-        csv_content = csv_buffer.getvalue()
+        df = drop_derived_columns(get_csrc2detail())
         
-        # Create response
-        response = StreamingResponse(
-            io.BytesIO(csv_content.encode('utf-8-sig')),
-            media_type="text/csv",
-            headers={"Content-Disposition": f"attachment; filename=case_detail_{datetime.now().strftime('%Y%m%d')}.csv"}
-        )
+        # Stream the CSV in chunks
+        response = csv_response(df, f"case_detail_{datetime.now().strftime('%Y%m%d')}.csv")
         
-        logger.info("Case detail CSV download completed")
+        logger.info(f"Case detail CSV download streaming {len(df)} records")
         return response
         
     except Exception as e:
@@ -2558,21 +3090,12 @@ async def download_analysis_data():
         
         from data_service import get_csrc2analysis
         
-        df = get_csrc2analysis()
+        df = drop_derived_columns(get_csrc2analysis())
         
-        # Convert to CSV
-        csv_buffer = io.StringIO()
-        df.to_csv(csv_buffer, index=False, encoding='utf-8-sig')
-        csv_content = csv_buffer.getvalue()
+        # Stream the CSV in chunks
+        response = csv_response(df, f"analysis_data_{datetime.now().strftime('%Y%m%d')}.csv")
         
-        # Create response
-        response = StreamingResponse(
-            io.BytesIO(csv_content.encode('utf-8-sig')),
-            media_type="text/csv",
-            headers={"Content-Disposition": f"attachment; filename=analysis_data_{datetime.now().strftime('%Y%m%d')}.csv"}
-        )
-        
-        logger.info("Analysis data CSV download completed")
+        logger.info(f"Analysis data CSV download streaming {len(df)} records")
         return response
         
     except Exception as e:
@@ -2589,19 +3112,10 @@ async def download_category_data():
         
         df = get_csrc2cat()
         
-        # Convert to CSV
-        csv_buffer = io.StringIO()
-        df.to_csv(csv_buffer, index=False, encoding='utf-8-sig')
-        csv_content = csv_buffer.getvalue()
-        
-        # Create response
-        response = StreamingResponse(
-            io.BytesIO(csv_content.encode('utf-8-sig')),
-            media_type="text/csv",
-            headers={"Content-Disposition": f"attachment; filename=category_data_{datetime.now().strftime('%Y%m%d')}.csv"}
-        )
+        # Stream the CSV in chunks
+        response = csv_response(df, f"category_data_{datetime.now().strftime('%Y%m%d')}.csv")
         
-        logger.info("Category data CSV download completed")
+        logger.info(f"Category data CSV download streaming {len(df)} records")
         return response
         
     except Exception as e:
@@ -2618,25 +3132,57 @@ async def download_split_data():
         
         df = get_csrc2split()
         
-        # Convert to CSV
-        csv_buffer = io.StringIO()
-        df.to_csv(csv_buffer, index=False, encoding='utf-8-sig')
-        csv_content = csv_buffer.getvalue()
+        # Stream the CSV in chunks
+        response = csv_response(df, f"split_data_{datetime.now().strftime('%Y%m%d')}.csv")
         
-        # Create response
-        response = StreamingResponse(
-            io.BytesIO(csv_content.encode('utf-8-sig')),
-            media_type="text/csv",
-            headers={"Content-Disposition": f"attachment; filename=split_data_{datetime.now().strftime('%Y%m%d')}.csv"}
-        )
-        
-        logger.info("Split data CSV download completed")
+        logger.info(f"Split data CSV download streaming {len(df)} records")
         return response
         
     except Exception as e:
         logger.error(f"Split data CSV download failed: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+# Select relevant columns for export (including detailed case information)
+SEARCH_EXPORT_COLUMNS = [
+    '名称', '文号', '发文日期', '机构', '罚款金额', '内容',  # Basic info
+    'people', 'category', 'province', 'industry',  # Classification info
+    'event', 'law', 'penalty', 'org', 'date',  # Detailed case info
+    'wenhao', '序列号', '链接'  # Additional identifiers
+]
+
+# Rename columns to Chinese for better readability
+SEARCH_EXPORT_COLUMN_NAMES = {
+    '名称': '发文名称',
+    '文号': '文号',
+    '发文日期': '发文日期',
+    '机构': '发文地区',
+    '罚款金额': '罚款金额',
+    '内容': '案例详情',
+    'people': '当事人',
+    'category': '案件类型',
+    'province': '地区',
+    'industry': '行业',
+    'event': '违法事实',
+    'law': '法律依据',
+    'penalty': '处罚决定',
+    'org': '处罚机构',
+    'date': '处罚日期',
+    'wenhao': '文件编号',
+    '序列号': '序列号',
+    '链接': '案例链接'
+}
+
+def search_export_chunk(chunk):
+    """Prepare a chunk of search results for the CSV export
+    
+    Texts are fetched per chunk, so the whole result never holds its 内容.
+    """
+    chunk = with_case_texts(chunk, load=True)
+    available_columns = [col for col in SEARCH_EXPORT_COLUMNS if col in chunk.columns]
+    if available_columns:
+        chunk = chunk[available_columns]
+    return chunk.rename(columns=SEARCH_EXPORT_COLUMN_NAMES)
+
 @app.get("/api/download/search-results")
 async def download_search_results(
     keyword: str = Query(None, max_length=200),
@@ -2646,11 +3192,15 @@ async def download_search_results(
     dateTo: str = Query(None),
     party: str = Query(None, max_length=100),
     minAmount: float = Query(None, ge=0),
-    legalBasis: str = Query(None, max_length=200)
+    legalBasis: str = Query(None, max_length=200),
+    maxAmount: float = Query(None, ge=0),
+    partyMatch: str = Query("contains", pattern="^(contains|exact|prefix|fuzzy)$"),
+    legalBasisMatch: str = Query("contains", pattern="^(contains|citation)$")
 ):
     """Download search results as CSV file"""
     try:
         logger.info(f"Starting search results download with filters: keyword={keyword}, docNumber={docNumber}, org={org}")
+        check_amount_range(minAmount, maxAmount)
         
         # Validate date formats
         if dateFrom:
@@ -2666,8 +3216,9 @@ async def download_search_results(
                 raise HTTPException(status_code=400, detail="dateTo must be in YYYY-MM-DD format")
         
         try:
-            from data_service import get_csrc2_intersection
-            df = get_csrc2_intersection()
+            from data_service import get_csrc2_intersection_entry
+            intersection = get_csrc2_intersection_entry()
+            df = intersection.view()
         except Exception as db_error:
             logger.error(f"Database access error: {db_error}")
             raise HTTPException(status_code=500, detail="Database access failed")
@@ -2678,95 +3229,45 @@ async def download_search_results(
         
         # Apply the same filters as in search_cases_enhanced
         if keyword:
-            mask = df['名称'].str.contains(keyword, na=False, case=False) | df['内容'].str.contains(keyword, na=False, case=False)
+            mask = keyword_mask(df, keyword, dataset=intersection)
             df = df[mask]
         
         if docNumber:
             df = df[df['文号'].str.contains(docNumber, na=False, case=False)]
         
         if org:
-            df = df[df['机构'] == org]
+            df = df[key_mask(df, '机构', org, intersection)]
         
-        if party:
-            df = df[df['people'].str.contains(party, na=False, case=False)]
+        if party and partyMatch != "contains":
+            df = df[rows_mask(df, party_rows(party, partyMatch, dataset=intersection), intersection)]
+        elif party:
+            df = df[keyword_mask(df, party, columns=("people",), dataset=intersection)]
         
-        if minAmount is not None:
-            df = df[get_pandas().to_numeric(df['罚款金额'], errors='coerce') >= minAmount]
+        if minAmount is not None or maxAmount is not None:
+            # Unlike the search, cases without an amount are left out here
+            df = df[amount_mask(df, minAmount, maxAmount, missing_as_zero=False, dataset=intersection)]
         
-        if legalBasis:
+        citing = citing_rows(legalBasis, intersection) if legalBasis and legalBasisMatch == "citation" else None
+        if citing is not None:
+            df = df[rows_mask(df, citing, intersection)]
+        elif legalBasis:
             df = df[df['law'].str.contains(legalBasis, na=False, case=False)]
         
-        if dateFrom:
-            try:
-                df = df[get_pandas().to_datetime(df['发文日期'], errors='coerce') >= get_pandas().to_datetime(dateFrom)]
-            except Exception as date_error:
-                logger.warning(f"Date filtering error for dateFrom: {date_error}")
-        
-        if dateTo:
-            try:
-                df = df[get_pandas().to_datetime(df['发文日期'], errors='coerce') <= get_pandas().to_datetime(dateTo)]
-            except Exception as date_error:
-                logger.warning(f"Date filtering error for dateTo: {date_error}")
+        if dateFrom or dateTo:
+            df = df[date_range_mask(df, dateFrom, dateTo, intersection)]
         
         if df.empty:
             logger.warning("No data found after applying filters")
             raise HTTPException(status_code=404, detail="No data found matching the search criteria")
         
-        # Select relevant columns for export (including detailed case information)
-        export_columns = [
-            '名称', '文号', '发文日期', '机构', '罚款金额', '内容',  # Basic info
-            'people', 'category', 'province', 'industry',  # Classification info
-            'event', 'law', 'penalty', 'org', 'date',  # Detailed case info
-            'wenhao', '序列号', '链接'  # Additional identifiers
-        ]
-        available_columns = [col for col in export_columns if col in df.columns]
-        
-        if available_columns:
-            df_export = df[available_columns].copy()
-        else:
-            df_export = df.copy()
-        
-        # Rename columns to Chinese for better readability
-        column_mapping = {
-            '名称': '发文名称',
-            '文号': '文号',
-            '发文日期': '发文日期',
-            '机构': '发文地区',
-            '罚款金额': '罚款金额',
-            '内容': '案例详情',
-            'people': '当事人',
-            'category': '案件类型',
-            'province': '地区',
-            'industry': '行业',
-            'event': '违法事实',
-            'law': '法律依据',
-            'penalty': '处罚决定',
-            'org': '处罚机构',
-            'date': '处罚日期',
-            'wenhao': '文件编号',
-            '序列号': '序列号',
-            '链接': '案例链接'
-        }
-        
-        df_export = df_export.rename(columns=column_mapping)
-        
-        # Convert to CSV
-        csv_buffer = io.StringIO()
-        df_export.to_csv(csv_buffer, index=False, encoding='utf-8-sig')
-        csv_content = csv_buffer.getvalue()
-        
         # Generate filename with timestamp
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f"search_results_{timestamp}.csv"
         
-        # Create response
-        response = StreamingResponse(
-            io.BytesIO(csv_content.encode('utf-8-sig')),
-            media_type="text/csv",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
-        )
+        # Stream the CSV in chunks
+        response = csv_response(df, filename, search_export_chunk)
         
-        logger.info(f"Search results download completed: {len(df_export)} records exported")
+        logger.info(f"Search results download streaming {len(df)} records")
         return response
         
     except HTTPException:
@@ -2780,9 +3281,28 @@ async def download_search_results(
 upload_data_cache = {
     "data": None,
     "timestamp": 0,
+    "generations": None,  # Dataset generations the cached data was built from
     "expiry": 300  # Cache expiry in seconds (5 minutes)
 }
 
+UPLOAD_DATASETS = ("detail", "analysis", "cat", "split")
+
+# Fields of the three-table intersection that are uploaded online (following frontend logic)
+UPLOAD_ANALYSIS_FIELDS = ["名称", "文号", "发文日期", "序列号", "链接", "内容", "机构"]
+UPLOAD_CAT_FIELDS = ["amount", "category", "province", "industry"]
+UPLOAD_SPLIT_FIELDS = ["wenhao", "people", "event", "law", "penalty", "org", "date"]
+
+def select_upload_fields(df: "pd.DataFrame") -> "pd.DataFrame":
+    """Keep the csrc2analysis, csrc2cat and csrc2split upload fields present in df"""
+    df = with_case_texts(df, load=True)
+    selected_columns = [
+        field for field in UPLOAD_ANALYSIS_FIELDS + UPLOAD_CAT_FIELDS + UPLOAD_SPLIT_FIELDS
+        if field in df.columns
+    ]
+    if selected_columns:
+        df = df[selected_columns]
+    return df
+
 @app.get("/upload-data", response_model=APIResponse)
 @app.get("/api/upload-data", response_model=APIResponse)
 async def get_upload_data():
@@ -2790,13 +3310,16 @@ async def get_upload_data():
     try:
         logger.info("Getting upload data")
         
-        # Check if we have valid cached data
+        # Check if we have valid cached data for the current dataset generations
         current_time = time.time()
-        if upload_data_cache["data"] and (current_time - upload_data_cache["timestamp"] < upload_data_cache["expiry"]):
+        generations = tuple(registry.generation(name) for name in UPLOAD_DATASETS)
+        if (upload_data_cache["data"] and
+            upload_data_cache["generations"] == generations and
+            current_time - upload_data_cache["timestamp"] < upload_data_cache["expiry"]):
             logger.info("Returning cached upload data")
             return upload_data_cache["data"]
             
-        from data_service import get_csrc2detail, get_csrc2analysis, get_csrc2label, get_csrc2cat, get_csrc2split
+        from data_service import get_csrc2detail, get_csrc2analysis, get_csrc2label, get_csrc2cat, get_csrc2split, get_csrc2_intersection
         
         # Get case detail data with timeout handling
         logger.info("Loading case detail data")
@@ -2824,72 +3347,22 @@ async def get_upload_data():
         
         # First, get the three-table intersection regardless of online data
         try:
-            if not analysis_df.empty and not category_df.empty and not split_df.empty:
-                logger.info(f"Starting three-table intersection: analysis({len(analysis_df)}), category({len(category_df)}), split({len(split_df)})")
-                
-                # Step 1: Inner join analysis with category data
-                intersection_df = get_pandas().merge(
-                    analysis_df,
-                    category_df,
-                    left_on="链接",
-                    right_on="id",
-                    how="inner"
-                )
-                logger.info(f"After analysis+category merge: {len(intersection_df)} records")
+            intersection_df = get_csrc2_intersection()
+            if not intersection_df.empty:
+                logger.info(f"Three-table intersection: {len(intersection_df)} records")
                 
-                # Step 2: Inner join with split data
-                if not intersection_df.empty:
-                    # Remove 'org' column if exists to use the one from split data
-                    if 'org' in intersection_df.columns:
-                        intersection_df = intersection_df.drop(columns=['org'])
-                    
-                    intersection_df = get_pandas().merge(
-                        intersection_df,
-                        split_df,
-                        left_on="链接",
-                        right_on="id",
-                        how="inner",
-                        suffixes=('', '_split')
-                    )
-                    logger.info(f"After three-table intersection: {len(intersection_df)} records")
-                    
-                    # Now exclude online cases from the intersection
-                    if not online_df.empty and '链接' in online_df.columns:
-                        online_case_ids = set(online_df['链接'].tolist())
-                        diff_df = intersection_df[~intersection_df['链接'].isin(online_case_ids)].copy()
-                        logger.info(f"After excluding online cases: {len(diff_df)} records")
-                    else:
-                        diff_df = intersection_df.copy()
-                        logger.info(f"No online data to exclude, keeping all intersection: {len(diff_df)} records")
-                    
-                    # Select specific columns as in frontend
-                    selected_columns = []
-                    
-                    # csrc2analysis fields (including 序列号)
-                    analysis_fields = ["名称", "文号", "发文日期", "序列号", "链接", "内容", "机构"]
-                    for field in analysis_fields:
-                        if field in diff_df.columns:
-                            selected_columns.append(field)
-                    
-                    # csrc2cat fields
-                    cat_fields = ["amount", "category", "province", "industry"]
-                    for field in cat_fields:
-                        if field in diff_df.columns:
-                            selected_columns.append(field)
-                    
-                    # csrc2split fields
-                    split_fields = ["wenhao", "people", "event", "law", "penalty", "org", "date"]
-                    for field in split_fields:
-                        if field in diff_df.columns:
-                            selected_columns.append(field)
-                    
-                    # Keep only selected columns
-                    if selected_columns:
-                        diff_df = diff_df[selected_columns]
-                        logger.info(f"Final diff data with selected columns: {len(diff_df)} records")
+                # Now exclude online cases from the intersection
+                if not online_df.empty and '链接' in online_df.columns:
+                    online_case_ids = set(online_df['链接'].tolist())
+                    diff_df = intersection_df[~intersection_df['链接'].isin(online_case_ids)].copy()
+                    logger.info(f"After excluding online cases: {len(diff_df)} records")
                 else:
-                    logger.warning("No data after analysis+category merge")
-                    diff_df = get_pandas().DataFrame()
+                    diff_df = intersection_df.copy()
+                    logger.info(f"No online data to exclude, keeping all intersection: {len(diff_df)} records")
+                
+                # Select specific columns as in frontend
+                diff_df = select_upload_fields(diff_df)
+                logger.info(f"Final diff data with selected columns: {len(diff_df)} records")
             else:
                 logger.warning("Missing required datasets for three-table intersection")
                 logger.info(f"Data availability: analysis={not analysis_df.empty}, category={not category_df.empty}, split={not split_df.empty}")
@@ -2925,7 +3398,7 @@ async def get_upload_data():
                 unique_count = df['id'].nunique()
             
             # Return limited records
-            limited_df = df.head(max_records)
+            limited_df = drop_derived_columns(df.head(max_records))
             
             return {
                 "data": limited_df.to_dict('records'),
@@ -2956,6 +3429,7 @@ async def get_upload_data():
         # Cache the response
         upload_data_cache["data"] = response
         upload_data_cache["timestamp"] = time.time()
+        upload_data_cache["generations"] = generations
         
         return response
         
@@ -2984,7 +3458,7 @@ async def upload_cases(request: UploadCasesRequest):
         logger.info(f"Starting upload for {len(request.case_ids)} cases")
         
         # Get three-table intersection data (following frontend logic)
-        from data_service import get_csrc2analysis, get_csrc2cat, get_csrc2split
+        from data_service import get_csrc2analysis, get_csrc2cat, get_csrc2split, get_csrc2_intersection_entry
         
         # Get analysis data
         analysis_df = get_csrc2analysis()
@@ -3013,35 +3487,9 @@ async def upload_cases(request: UploadCasesRequest):
                 count=0
             )
         
-        # Create three-table intersection (inner join)
-        # Step 1: Merge analysis with category data
-        merged_data = get_pandas().merge(
-            analysis_df,
-            cat_df,
-            left_on="链接",
-            right_on="id",
-            how="inner"
-        )
-        
-        if merged_data.empty:
-            return APIResponse(
-                success=False,
-                message="No intersection between analysis and category data",
-                count=0
-            )
-        
-        # Step 2: Merge with split data
-        if 'org' in merged_data.columns:
-            merged_data = merged_data.drop(columns=['org'])
-        
-        final_data = get_pandas().merge(
-            merged_data,
-            split_df,
-            left_on="链接",
-            right_on="id",
-            how="inner",
-            suffixes=('', '_split')
-        )
+        # Shared three-table intersection (inner join)
+        intersection = get_csrc2_intersection_entry()
+        final_data = intersection.view()
         
         if final_data.empty:
             return APIResponse(
@@ -3051,7 +3499,7 @@ async def upload_cases(request: UploadCasesRequest):
             )
         
         # Filter cases to upload from the three-table intersection
-        cases_to_upload = final_data[final_data['链接'].isin(request.case_ids)]
+        cases_to_upload = final_data.iloc[key_rows(final_data, '链接', request.case_ids, intersection)]
         
         if cases_to_upload.empty:
             return APIResponse(
@@ -3061,29 +3509,7 @@ async def upload_cases(request: UploadCasesRequest):
             )
         
         # Select only the required fields (following frontend logic)
-        selected_columns = []
-        
-        # csrc2analysis fields
-        analysis_fields = ["名称", "文号", "发文日期", "序列号", "链接", "内容", "机构"]
-        for field in analysis_fields:
-            if field in cases_to_upload.columns:
-                selected_columns.append(field)
-        
-        # csrc2cat fields
-        cat_fields = ["amount", "category", "province", "industry"]
-        for field in cat_fields:
-            if field in cases_to_upload.columns:
-                selected_columns.append(field)
-        
-        # csrc2split fields
-        split_fields = ["wenhao", "people", "event", "law", "penalty", "org", "date"]
-        for field in split_fields:
-            if field in cases_to_upload.columns:
-                selected_columns.append(field)
-        
-        # Keep only selected columns
-        if selected_columns:
-            cases_to_upload = cases_to_upload[selected_columns]
+        cases_to_upload = select_upload_fields(cases_to_upload)
         
         logger.info(f"Uploading {len(cases_to_upload)} cases with three-table intersection data")
         
@@ -3299,23 +3725,9 @@ async def download_online_data():
         
         logger.info(f"Retrieved {len(online_df)} records for download")
         
-        # Convert to CSV
-        try:
-            csv_buffer = io.StringIO()
-            online_df.to_csv(csv_buffer, index=False, encoding='utf-8-sig')
-            csv_content = csv_buffer.getvalue()
-            logger.info(f"CSV conversion successful, size: {len(csv_content)} bytes")
-        except Exception as csv_error:
-            logger.error(f"CSV conversion failed: {str(csv_error)}", exc_info=True)
-            raise HTTPException(status_code=500, detail=f"CSV conversion failed: {str(csv_error)}")
-        
-        # Create response
+        # Stream the CSV in chunks
         try:
-            response = StreamingResponse(
-                io.BytesIO(csv_content.encode('utf-8-sig')),
-                media_type="text/csv",
-                headers={"Content-Disposition": f"attachment; filename=online_data_{datetime.now().strftime('%Y%m%d')}.csv"}
-            )
+            response = csv_response(online_df, f"online_data_{datetime.now().strftime('%Y%m%d')}.csv")
             logger.info("Online data CSV download response created successfully")
             return response
         except Exception as resp_error:
@@ -3336,85 +3748,33 @@ async def download_diff_data():
     try:
         logger.info("Starting diff data CSV download")
         
-        from data_service import get_csrc2analysis, get_csrc2cat, get_csrc2split
+        from data_service import get_csrc2_intersection
         
-        # Get analysis data
-        analysis_df = get_csrc2analysis()
-        
-        # Get category data
-        category_df = get_csrc2cat()
-        
-        # Get split data
-        split_df = get_csrc2split()
+        # Shared three-table intersection of analysis, category and split data
+        intersection_df = get_csrc2_intersection()
         
         # Get online data
         online_df = get_online_data()
         
         # Calculate diff data using same logic as upload-data endpoint
-        if not analysis_df.empty:
-            # Exclude online cases from analysis data
+        if not intersection_df.empty:
+            # Exclude online cases from the intersection
             if not online_df.empty and '链接' in online_df.columns:
                 online_case_ids = set(online_df['链接'].tolist())
-                diff_analysis = analysis_df[~analysis_df['链接'].isin(online_case_ids)].copy()
+                diff_df = intersection_df[~intersection_df['链接'].isin(online_case_ids)]
             else:
-                diff_analysis = analysis_df.copy()
+                diff_df = intersection_df
             
-            # Merge with category and split data (inner join for intersection)
-            if not category_df.empty and not split_df.empty and not diff_analysis.empty:
-                # Step 1: Inner join with category data
-                diff_df = get_pandas().merge(
-                    diff_analysis,
-                    category_df,
-                    left_on="链接",
-                    right_on="id",
-                    how="inner"
-                )
-                
-                # Step 2: Inner join with split data
-                if not diff_df.empty:
-                    # Remove 'org' column if exists
-                    if 'org' in diff_df.columns:
-                        diff_df = diff_df.drop(columns=['org'])
-                    
-                    diff_df = get_pandas().merge(
-                        diff_df,
-                        split_df,
-                        left_on="链接",
-                        right_on="id",
-                        how="inner",
-                        suffixes=('', '_split')
-                    )
-                
-                # Select specific columns
-                selected_columns = []
-                analysis_fields = ["名称", "文号", "发文日期", "序列号", "链接", "内容", "机构"]
-                cat_fields = ["amount", "category", "province", "industry"]
-                split_fields = ["wenhao", "people", "event", "law", "penalty", "org", "date"]
-                
-                for field in analysis_fields + cat_fields + split_fields:
-                    if field in diff_df.columns:
-                        selected_columns.append(field)
-                
-                if selected_columns:
-                    diff_df = diff_df[selected_columns]
-            else:
-                diff_df = get_pandas().DataFrame()
+            # Select specific columns per chunk, fetching 内容 only for that chunk
+            prepare = select_upload_fields
         else:
             diff_df = get_pandas().DataFrame()
+            prepare = None
         
-        # Convert to CSV
-        csv_buffer = io.StringIO()
-        diff_df.to_csv(csv_buffer, index=False, encoding='utf-8-sig')
-        csv_content = csv_buffer.getvalue()
+        # Stream the CSV in chunks
+        response = csv_response(diff_df, f"diff_data_{datetime.now().strftime('%Y%m%d')}.csv", prepare)
         
-        # Create response
-        response = StreamingResponse(
-            io.BytesIO(csv_content.encode('utf-8-sig')),
-            media_type="text/csv",
-            headers={"Content-Disposition": f"attachment; filename=diff_data_{datetime.now().strftime('%Y%m%d')}.csv"}
-        )
-        
-        logger.info("Diff data CSV download completed")
+        logger.info(f"Diff data CSV download streaming {len(diff_df)} records")
         return response
         
     except Exception as e:
@@ -3485,6 +3845,7 @@ async def save_penalty_analysis_results(request: Request):
         
         cat_df.to_csv(cat_filepath, index=False, encoding='utf-8-sig')
         split_df.to_csv(split_filepath, index=False, encoding='utf-8-sig')
+        registry.invalidate("cat", "split")
         
         logger.info(f"Successfully saved penalty analysis results to {cat_filename} and {split_filename}")
         
@@ -3628,6 +3989,7 @@ async def upload_analysis_results(file: UploadFile = File(...)):
         
         cat_df.to_csv(cat_filepath, index=False, encoding='utf-8-sig')
         split_df.to_csv(split_filepath, index=False, encoding='utf-8-sig')
+        registry.invalidate("cat", "split")
         
         logger.info(f"Successfully saved uploaded analysis results to {cat_filename} and {split_filename}")
         
@@ -3983,11 +4345,13 @@ async def match_files_by_title(request: dict):
             try:
                 # Get csrclenanalysis data
                 from data_service import get_csrclenanalysis
-                analysis_df = get_csrclenanalysis()
+                analysis_df = get_csrclenanalysis().copy()
                 
                 if analysis_df is not None and not analysis_df.empty:
                     # Update the DataFrame with matched file information
                     updated_rows = 0
+                    url_columns = ['链接', 'url', 'link']
+                    url_indexes = [KeyIndex(analysis_df[url_col]) for url_col in url_columns if url_col in analysis_df.columns]
                     for match in matches:
                         if match['matched_file']:
                             case_url = match['url']
@@ -3995,15 +4359,13 @@ async def match_files_by_title(request: dict):
                             matched_text = match['matched_file']['text_content'] or ''
                             
                             # Find the row to update by URL
-                            url_columns = ['链接', 'url', 'link']
                             mask = None
-                            for url_col in url_columns:
-                                if url_col in analysis_df.columns:
-                                    mask = analysis_df[url_col] == case_url
-                                    if mask.any():
-                                        break
+                            for url_index in url_indexes:
+                                mask = analysis_df.index[url_index.lookup([case_url])]
+                                if len(mask):
+                                    break
                             
-                            if mask is not None and mask.any():
+                            if mask is not None and len(mask):
                                 # Update filename
                                 if 'filename' in analysis_df.columns:
                                     analysis_df.loc[mask, 'filename'] = matched_filename
@@ -4025,6 +4387,7 @@ async def match_files_by_title(request: dict):
                     if updated_rows > 0:
                         csv_path = os.path.join(tempdir, "csrclenanalysis.csv")
                         analysis_df.to_csv(csv_path, index=False, encoding='utf-8')
+                        registry.invalidate("lenanalysis")
                         logger.info(f"Updated {updated_rows} rows in csrclenanalysis.csv with matched file information")
                 
             except Exception as update_error:
@@ -4067,10 +4430,12 @@ async def update_content_files_after_extraction(extraction_results: list):
         # Only update csrclenanalysis if the file already exists
         if os.path.exists(len_file_path):
             # Update csrclenanalysis with new content lengths and content
-            len_df = get_csrclenanalysis()
+            # (on a private copy, the registry copy is read-only)
+            len_df = get_csrclenanalysis().copy()
             
             if not len_df.empty:
                 updated_len = False
+                url_index = KeyIndex(len_df['链接'] if '链接' in len_df.columns else len_df['url'])
                 for result in extraction_results:
                     url = result.get('url', '')
                     extracted_text = result.get('text', '')
@@ -4079,8 +4444,8 @@ async def update_content_files_after_extraction(extraction_results: list):
                     
                     if url:
                         # Find matching rows by URL
-                        mask = len_df['链接'] == url if '链接' in len_df.columns else len_df['url'] == url
-                        if mask.any():
+                        mask = len_df.index[url_index.lookup([url])]
+                        if len(mask):
                             # Update the length information
                             if 'len' in len_df.columns:
                                 len_df.loc[mask, 'len'] = text_length
@@ -4102,6 +4467,7 @@ async def update_content_files_after_extraction(extraction_results: list):
                 # Save updated csrclenanalysis only if there were updates
                 if updated_len:
                     savetemp(len_df, "csrclenanalysis")
+                    registry.invalidate("lenanalysis")
                     logger.info("Updated existing csrclenanalysis file")
                 else:
                     logger.info("No matching URLs found in csrclenanalysis for update")
@@ -4130,8 +4496,8 @@ async def extract_text(request: dict):
         logger.info(f"Starting text extraction for {len(attachment_ids)} attachments")
         
         # Get csrclenanalysis data to find attachment information
-        from data_service import get_csrclenanalysis
-        analysis_df = get_csrclenanalysis()
+        lenanalysis = registry.entry("lenanalysis")
+        analysis_df = lenanalysis.view()
         
         # Ensure analysis_df is a DataFrame to prevent errors
         if analysis_df is None:
@@ -4169,7 +4535,7 @@ async def extract_text(request: dict):
                 attachment_data = get_pandas().DataFrame()
                 for url_col in ['url', '链接', 'link']:
                     if url_col in analysis_df.columns:
-                        attachment_data = analysis_df[analysis_df[url_col] == attachment_id]
+                        attachment_data = analysis_df.iloc[key_rows(analysis_df, url_col, [attachment_id], lenanalysis)]
                         if not attachment_data.empty:
                             break
                 
@@ -4524,12 +4890,14 @@ async def update_attachment_text(request: dict):
         logger.info(f"Starting text update for {len(attachment_ids)} attachments")
         
         # Import required modules
-        from web_crawler import get_csrc2analysis, get_csrclenanalysis, savedf_backend, get_now
+        from web_crawler import savedf_backend, get_now
         import pandas as pd
         import os
         
-        # Get csrc2analysis data
-        analysis_df = get_csrc2analysis()
+        # Get csrc2analysis data; the entries keep row lookups on the
+        # generation these frames were read from
+        analysis = registry.entry("analysis")
+        analysis_df = analysis.view()
         if analysis_df.empty:
             return APIResponse(
                 success=False,
@@ -4537,7 +4905,8 @@ async def update_attachment_text(request: dict):
             )
         
         # Get csrclenanalysis data to find attachment information
-        len_df = get_csrclenanalysis()
+        len_entry = registry.entry("lenanalysis")
+        len_df = len_entry.view()
         if len_df.empty:
             return APIResponse(
                 success=False,
@@ -4557,9 +4926,9 @@ async def update_attachment_text(request: dict):
                 # Try to find by URL first
                 attachment_data = get_pandas().DataFrame()
                 if '链接' in len_df.columns:
-                    attachment_data = len_df[len_df['链接'] == attachment_id]
+                    attachment_data = len_df.iloc[key_rows(len_df, '链接', [attachment_id], len_entry)]
                 elif 'url' in len_df.columns:
-                    attachment_data = len_df[len_df['url'] == attachment_id]
+                    attachment_data = len_df.iloc[key_rows(len_df, 'url', [attachment_id], len_entry)]
                 
                 if attachment_data.empty:
                     # Try to find by index if not found by URL
@@ -4597,9 +4966,9 @@ async def update_attachment_text(request: dict):
                     
                     # Find matching record in csrc2analysis by URL
                     if '链接' in analysis_df.columns:
-                        mask = analysis_df['链接'] == attachment_url
+                        mask = key_mask(analysis_df, '链接', attachment_url, analysis)
                     elif 'url' in analysis_df.columns:
-                        mask = analysis_df['url'] == attachment_url
+                        mask = key_mask(analysis_df, 'url', attachment_url, analysis)
                     else:
                         logger.warning("No URL column found in csrc2analysis data")
                         continue
@@ -4655,17 +5024,10 @@ async def update_attachment_text(request: dict):
                 if 'source_filename' in analysis_df.columns:
                     # Find which files contain the updated records
                     files_to_update = set()
-                    for url in records_to_update.keys():
-                        if '链接' in analysis_df.columns:
-                            matching_records = analysis_df[analysis_df['链接'] == url]
-                        elif 'url' in analysis_df.columns:
-                            matching_records = analysis_df[analysis_df['url'] == url]
-                        else:
-                            continue
-                        
-                        if not matching_records.empty:
-                            source_files = matching_records['source_filename'].dropna().unique()
-                            files_to_update.update(source_files)
+                    url_column = '链接' if '链接' in analysis_df.columns else ('url' if 'url' in analysis_df.columns else None)
+                    if url_column:
+                        matching_records = analysis_df.iloc[key_rows(analysis_df, url_column, records_to_update.keys(), analysis)]
+                        files_to_update.update(matching_records['source_filename'].dropna().unique())
                     
                     backup_count = 0  # Track total number of backups created
                     
@@ -4694,18 +5056,21 @@ async def update_attachment_text(request: dict):
                         
                         # Collect records that will be updated for backup
                         file_updated = False
+                        if '链接' in original_file_data.columns:
+                            url_index = KeyIndex(original_file_data['链接'])
+                        elif 'url' in original_file_data.columns:
+                            url_index = KeyIndex(original_file_data['url'])
+                        else:
+                            url_index = None
                         for url, update_info in records_to_update.items():
                             # Find matching records in this file
-                            if '链接' in original_file_data.columns:
-                                mask = original_file_data['链接'] == url
-                            elif 'url' in original_file_data.columns:
-                                mask = original_file_data['url'] == url
-                            else:
+                            if url_index is None:
                                 continue
+                            mask = original_file_data.index[url_index.lookup([url])]
                             
-                            if mask.any():
+                            if len(mask):
                                 # Get the original record(s) before update for backup
-                                original_records = original_file_data[mask].copy()
+                                original_records = original_file_data.loc[mask].copy()
                                 # Add source file info to backup records
                                 original_records['backup_source_file'] = source_filename
                                 original_records['backup_timestamp'] = get_now()
@@ -4729,6 +5094,7 @@ async def update_attachment_text(request: dict):
                         # Save the updated file data only if changes were made
                         if file_updated:
                             original_file_data.to_csv(original_file_path, index=False, encoding='utf-8-sig')
+                            registry.invalidate("analysis")
                             logger.info(f"Saved updated data to {source_filename}")
                     
                     # Create a single backup file with all updated records
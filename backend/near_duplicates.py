@@ -0,0 +1,333 @@
+"""Near-duplicate case detection with MinHash-LSH
+
+The same decision is often published under several 链接: through different
+org channels, or as both a HTML page and an attachment. Those copies
+inflate counts and are sent to the LLM once each. Here every case of the
+analysis data gets a MinHash signature of the character shingles of its
+内容, with whitespace and punctuation removed, and cases whose signatures
+collide in any LSH band and agree on at least DUPLICATE_SIMILARITY of
+their bins are clustered together.
+
+Signatures use one-permutation hashing: each shingle is hashed once and
+the hash picks the bin it competes for, so a signature costs one pass over
+the text instead of one per permutation. Empty bins are left out of the
+Jaccard estimate.
+
+Signatures are computed once per case: when the registry extended the
+analysis data append-only, only the new cases (and older cases sharing a
+链接 with them) are hashed. The clusters are re-derived from all
+signatures per generation, which is linear in the number of cases.
+"""
+
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from data_service import TEXT_KEY_COLUMN, get_case_texts, get_pandas
+from dataset_registry import DatasetRef, registry
+from search_index import INDEX_BATCH_ROWS, get_key_index, index_build_stats
+
+# Metadata of the cases the clusters are built over
+DUPLICATE_DATASET = "analysis_meta"
+# Characters per shingle
+SHINGLE_CHARS = 5
+# Signature bins, and LSH bands of BAND_BINS bins each
+MINHASH_BINS = 64
+BAND_BINS = 4
+# Estimated Jaccard similarity from which two cases are duplicates
+DUPLICATE_SIMILARITY = float(os.getenv("DUPLICATE_SIMILARITY", "0.8"))
+# Texts shorter than this, once normalized, are not clustered
+DUPLICATE_MIN_CHARS = 50
+_EMPTY = np.uint64(np.iinfo(np.uint64).max)
+_BIN_BITS = 6  # log2(MINHASH_BINS)
+_NOISE = re.compile(r"[\W_]+")
+
+# dataset -> (generation, 链接 of the hashed rows, signatures, DuplicateClusters)
+_duplicate_tables: Dict[str, tuple] = {}
+_duplicate_lock = threading.Lock()
+
+
+def _mix(values):
+    """splitmix64 finalizer over a uint64 array"""
+    with np.errstate(over="ignore"):
+        values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return values ^ (values >> np.uint64(31))
+
+
+def normalize_text(text) -> str:
+    """Lowercased text without whitespace and punctuation"""
+    return _NOISE.sub("", text).lower() if isinstance(text, str) else ""
+
+
+def minhash_signatures(texts) -> np.ndarray:
+    """
+    One-permutation MinHash signatures of texts.
+
+    Args:
+        texts: Strings, normalized with normalize_text
+
+    Returns:
+        uint64 array of shape (len(texts), MINHASH_BINS); empty bins, and
+        every bin of a text shorter than DUPLICATE_MIN_CHARS, hold _EMPTY
+    """
+    signatures = np.full((len(texts), MINHASH_BINS), _EMPTY, dtype=np.uint64)
+    for start in range(0, len(texts), INDEX_BATCH_ROWS):
+        batch = [text if len(text) >= DUPLICATE_MIN_CHARS else "" for text in texts[start:start + INDEX_BATCH_ROWS]]
+        points = np.frombuffer("\0".join(batch).encode("utf-32-le", "surrogatepass"), dtype=np.uint32).astype(np.uint64)
+        count = len(points) - SHINGLE_CHARS + 1
+        if count <= 0:
+            continue
+        lengths = np.fromiter((len(text) for text in batch), dtype=np.int64, count=len(batch))
+        local = np.repeat(np.arange(len(batch), dtype=np.int64), lengths + 1)[:count]
+        hashes = np.zeros(count, dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            for offset in range(SHINGLE_CHARS):
+                hashes = hashes * np.uint64(1000003) + points[offset:offset + count]
+        # Shingles spanning the separator between two texts
+        separators = np.concatenate([[0], np.cumsum(points == 0)])
+        valid = separators[SHINGLE_CHARS:SHINGLE_CHARS + count] == separators[:count]
+        hashes, local = _mix(hashes[valid]), local[valid]
+        bins = (hashes & np.uint64(MINHASH_BINS - 1)).astype(np.int64)
+        values = hashes >> np.uint64(_BIN_BITS)
+        cells = local * MINHASH_BINS + bins
+        block = signatures[start:start + len(batch)].reshape(-1)
+        np.minimum.at(block, cells, values)
+        signatures[start:start + len(batch)] = block.reshape(len(batch), MINHASH_BINS)
+    return signatures
+
+
+def estimate_similarity(first, second) -> np.ndarray:
+    """
+    Estimated Jaccard similarity of aligned rows of two signature arrays.
+
+    Returns:
+        float64 array, 0 where both signatures are empty
+    """
+    filled = (first != _EMPTY) | (second != _EMPTY)
+    matches = ((first == second) & (first != _EMPTY)).sum(axis=1)
+    union = filled.sum(axis=1)
+    return np.divide(matches, union, out=np.zeros(len(matches)), where=union > 0)
+
+
+def _candidate_pairs(signatures) -> np.ndarray:
+    """
+    Rows colliding in an LSH band, each paired with the first and the
+    previous row of its bucket.
+
+    Returns:
+        Unique (row, earlier row) pairs as an int64 array of shape (n, 2)
+    """
+    pairs = []
+    for band in range(MINHASH_BINS // BAND_BINS):
+        cells = signatures[:, band * BAND_BINS:(band + 1) * BAND_BINS]
+        rows = np.flatnonzero((cells != _EMPTY).any(axis=1))
+        if len(rows) < 2:
+            continue
+        keys = np.zeros(len(rows), dtype=np.uint64)
+        for column in range(BAND_BINS):
+            keys = _mix(keys ^ cells[rows, column])
+        order = np.argsort(keys, kind="stable")
+        keys, rows = keys[order], rows[order]
+        same = np.flatnonzero(keys[1:] == keys[:-1]) + 1
+        if not len(same):
+            continue
+        starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+        firsts = rows[starts[np.searchsorted(starts, same, side="right") - 1]]
+        pairs.append(np.stack([rows[same], firsts], axis=1))
+        pairs.append(np.stack([rows[same], rows[same - 1]], axis=1))
+    if not pairs:
+        return np.empty((0, 2), dtype=np.int64)
+    pairs = np.concatenate(pairs)
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    return np.unique(np.sort(pairs, axis=1)[:, ::-1], axis=0)
+
+
+class DuplicateClusters:
+    """Clusters of near-duplicate rows"""
+
+    def __init__(self, signatures, threshold: float = DUPLICATE_SIMILARITY):
+        """
+        Args:
+            signatures: MinHash signatures of every row, _EMPTY rows are
+                never clustered
+            threshold: Estimated Jaccard similarity from which rows are
+                duplicates
+        """
+        pairs = _candidate_pairs(signatures)
+        similar = estimate_similarity(signatures[pairs[:, 0]], signatures[pairs[:, 1]]) >= threshold
+        parent = {}
+
+        def root(row):
+            while parent.get(row, row) != row:
+                parent[row] = parent.get(parent[row], parent[row])
+                row = parent[row]
+            return row
+
+        for row, other in pairs[similar].tolist():
+            a, b = root(row), root(other)
+            if a != b:
+                parent[max(a, b)] = min(a, b)
+        members = np.array(sorted(parent), dtype=np.int64)
+        roots = np.array([root(row) for row in members.tolist()], dtype=np.int64)
+        # Rows grouped by cluster, the cluster's first row first
+        clustered = np.unique(np.concatenate([members, roots]))
+        labels = np.array([root(row) for row in clustered.tolist()], dtype=np.int64)
+        order = np.lexsort((clustered, labels))
+        self.rows = clustered[order]
+        firsts, starts = np.unique(labels[order], return_index=True)
+        self.offsets = np.append(starts, len(self.rows)).astype(np.int64)
+        self.cluster_of = np.full(len(signatures), -1, dtype=np.int64)
+        self.cluster_of[self.rows] = np.repeat(np.arange(len(firsts)), np.diff(self.offsets))
+        # Estimated similarity of each clustered row to the first row of its cluster
+        self.similarity = estimate_similarity(signatures[self.rows], signatures[np.repeat(firsts, np.diff(self.offsets))])
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def members(self, cluster: int) -> np.ndarray:
+        """Rows of a cluster, its first row first"""
+        return self.rows[self.offsets[cluster]:self.offsets[cluster + 1]]
+
+    def sizes(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def memory_bytes(self) -> int:
+        return int(self.rows.nbytes + self.offsets.nbytes + self.cluster_of.nbytes + self.similarity.nbytes)
+
+
+def _signature_rows(frame, cached, entry):
+    """Rows whose signature has to be computed, given the cached signatures"""
+    links = frame[TEXT_KEY_COLUMN].to_numpy(dtype=object)
+    base_rows = len(cached[1]) if cached is not None else 0
+    if (cached is not None and entry.extends == cached[0] and len(links) >= base_rows
+            and np.array_equal(links[:base_rows], cached[1])):
+        rows = np.arange(base_rows, len(links))
+        # Texts are looked up by 链接, so older rows of a re-crawled case change too
+        rows = np.union1d(np.flatnonzero(np.isin(links[:base_rows], links[base_rows:])), rows)
+        return links, rows, True
+    return links, np.arange(len(links)), False
+
+
+def get_duplicate_clusters(dataset: DatasetRef = DUPLICATE_DATASET) -> Optional[DuplicateClusters]:
+    """
+    Near-duplicate clusters of the current generation of a dataset.
+
+    Returns:
+        DuplicateClusters over the dataset rows, or None when the dataset
+        has no 链接 column
+    """
+    entry = registry.resolve(dataset)
+    cached = _duplicate_tables.get(entry.name)
+    if cached is not None and cached[0] == entry.generation:
+        return cached[3]
+    with _duplicate_lock:
+        cached = _duplicate_tables.get(entry.name)
+        if cached is not None and cached[0] == entry.generation:
+            return cached[3]
+        frame = entry.frame
+        if TEXT_KEY_COLUMN not in frame.columns:
+            return None
+        start = time.time()
+        links, rows, updated = _signature_rows(frame, cached, entry)
+        signatures = np.full((len(links), MINHASH_BINS), _EMPTY, dtype=np.uint64)
+        if updated:
+            signatures[:len(cached[1])] = cached[2]
+        texts = get_case_texts(frame[TEXT_KEY_COLUMN].iloc[rows], load=True)
+        signatures[rows] = minhash_signatures([normalize_text(text) for text in texts.tolist()])
+        # One signature per 链接; repeated rows of a case are not its duplicates
+        signatures[get_pandas().Series(links).duplicated().to_numpy()] = _EMPTY
+        clusters = DuplicateClusters(signatures)
+        if cached is None or cached[0] < entry.generation:
+            _duplicate_tables[entry.name] = (entry.generation, links, signatures, clusters)
+        seconds = time.time() - start
+        mode = "updated" if updated else "built"
+        index_build_stats[f"{entry.name}:内容:minhash"] = {
+            "generation": entry.generation,
+            "mode": mode,
+            "rowsHashed": len(rows),
+            "clusters": len(clusters),
+            "duplicateRows": len(clusters.rows),
+            "memoryBytes": int(signatures.nbytes + clusters.memory_bytes()),
+            "seconds": round(seconds, 3),
+        }
+        print(f"Duplicate clusters {entry.name} {mode}: {len(rows)} rows hashed, {len(clusters)} clusters, {seconds:.2f} seconds")
+        return clusters
+
+
+def analyzed_mask(links) -> np.ndarray:
+    """True for the 链接 values that already have analysis results (are in the intersection)"""
+    index = get_key_index("intersection", TEXT_KEY_COLUMN)
+    if index is None:
+        return np.zeros(len(links), dtype=bool)
+    return index.keys.get_indexer(get_pandas().Index(list(links), dtype=object)) >= 0
+
+
+def case_cluster(case_id: str, dataset: DatasetRef = DUPLICATE_DATASET) -> Optional[np.ndarray]:
+    """
+    Rows of the cluster of a case.
+
+    Returns:
+        Row numbers, the cluster's first row first; None when the case has
+        no near duplicate or is unknown
+    """
+    dataset = registry.resolve(dataset)
+    clusters = get_duplicate_clusters(dataset)
+    index = get_key_index(dataset, TEXT_KEY_COLUMN)
+    if clusters is None or index is None:
+        return None
+    for row in index.lookup([case_id]).tolist():
+        if clusters.cluster_of[row] >= 0:
+            return clusters.members(clusters.cluster_of[row])
+    return None
+
+
+def collapse_duplicates(case_ids: List[str], skip_analyzed: bool = True,
+                        dataset: DatasetRef = DUPLICATE_DATASET) -> Tuple[List[str], List[dict]]:
+    """
+    Keep one case of each duplicate cluster among a list of cases.
+
+    A case is dropped when an earlier case of the list is in its cluster, or,
+    with skip_analyzed, when another case of its cluster already has
+    analysis results. Cases without duplicates are always kept.
+
+    Args:
+        case_ids: 链接 of the cases, in order
+        skip_analyzed: Also drop cases whose duplicate is already analyzed
+        dataset: Dataset the clusters are built over
+
+    Returns:
+        Tuple of (kept 链接 in order, [{"id", "duplicateOf"}] of the dropped ones)
+    """
+    dataset = registry.resolve(dataset)
+    clusters = get_duplicate_clusters(dataset)
+    index = get_key_index(dataset, TEXT_KEY_COLUMN)
+    if clusters is None or index is None:
+        return list(case_ids), []
+    links = dataset.frame[TEXT_KEY_COLUMN].to_numpy(dtype=object)
+    kept, skipped, seen = [], [], {}
+    analyzed = {}
+    for case_id in case_ids:
+        rows = index.lookup([case_id])
+        clustered = [row for row in rows.tolist() if clusters.cluster_of[row] >= 0]
+        if not clustered:
+            kept.append(case_id)
+            continue
+        cluster = int(clusters.cluster_of[clustered[0]])
+        if skip_analyzed and cluster not in analyzed:
+            members = links[clusters.members(cluster)]
+            done = members[analyzed_mask(members)]
+            analyzed[cluster] = done.tolist()
+        others = [link for link in analyzed.get(cluster, []) if link != case_id]
+        if others:
+            skipped.append({"id": case_id, "duplicateOf": others[0]})
+        elif cluster in seen:
+            skipped.append({"id": case_id, "duplicateOf": seen[cluster]})
+        else:
+            seen[cluster] = case_id
+            kept.append(case_id)
+    return kept, skipped
@@ -0,0 +1,1430 @@
+"""Character bigram inverted index for keyword search
+
+Keyword filters used to run ``str.contains`` over every case, 内容 included,
+on every request. The index keeps, for each indexed column of a dataset,
+the sorted row numbers containing each character bigram of the lowercased
+text. Chinese has no word boundaries, so overlapping bigrams are the usual
+indexing unit: a keyword can only occur in rows holding all of its bigrams,
+and intersecting those posting lists (shortest first) leaves a small
+candidate set. Only the candidates are then checked with the original
+``str.contains`` expression, so results are exactly those of a full scan.
+
+An index is built once per dataset generation. When the registry extended a
+generation append-only, only the new rows, and the older rows sharing a 链接
+with them (their 内容 may have been replaced), are tokenized and merged into
+the previous postings.
+
+Keywords shorter than a bigram or using regular-expression syntax keep the
+full scan.
+
+The postings also carry the bigram counts and per-row lengths BM25 needs,
+so ``sort=relevance`` ranks the matches with the keyword's bigrams as query
+terms, without touching the texts again.
+
+A date index per generation holds the rows sorted newest first with their
+publish dates, so date ranges are two binary searches and the default
+newest-first order is read off the permutation instead of re-sorting.
+
+An amount index per generation holds the parsed 罚款金额 of each row and
+the rows sorted by amount, so amount ranges are binary searches and amount
+histograms are read off the same arrays.
+
+Key indexes hash the values of an exact-match column (链接, 机构, 文号, id)
+to their rows, built on first use per generation, so ``lookup()`` finds
+the rows of k values in O(k) instead of comparing the whole column.
+
+A party index splits the people field of each case into its individual
+party names (one field lists several) and maps each distinct name to its
+rows. Names are kept sorted, so a party is found by exact name, by prefix
+with two binary searches, or within a small edit distance, and the lookup
+returns the cases naming that party rather than every case whose people
+text merely contains the query.
+
+Facet codes map each row of a column (机构, province, ...; the year for a
+date column) to an integer code once per generation, so the facet counts
+of a result are one ``bincount`` over the codes of its rows, linear in the
+number of matches.
+
+The same indexes give the search planner (search_planner.py) cheap row
+count estimates of keyword, key and date filters.
+
+Filtered, date-sorted results are kept as arrays of dataset row numbers in
+a byte-bounded LRU cache keyed by the normalized query and the dataset
+generation, so paging through a query filters once per generation.
+
+Search pages can also be fetched by cursor. A cursor is an opaque token
+holding the (date, 链接) of the last row served, its position in the date
+order and the generation it was taken from; the next page is read by
+walking the date order from that position and filtering only the rows it
+passes, instead of filtering and sorting the whole result again.
+
+Every function taking a dataset accepts its name or a DatasetEntry. A
+request resolves its dataset once (registry.resolve) and passes the entry
+on, so the indexes, row checks and cached results it uses all belong to
+the generation its frame was taken from, even when the dataset is reloaded
+meanwhile.
+"""
+
+import base64
+import bisect
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from data_service import TEXT_COLUMNS, TEXT_KEY_COLUMN, get_case_texts, get_pandas, get_publish_dates
+from dataset_registry import DatasetEntry, DatasetRef, registry
+
+INDEXED_COLUMNS = ("名称", "内容", "event", "people")
+# BM25 parameters and the weight of each column in the relevance score
+BM25_K1 = 1.2
+BM25_B = 0.75
+RELEVANCE_WEIGHTS = {"名称": 2.0, "内容": 1.0}
+# Rows tokenized per batch; bounds the temporary arrays of a build
+INDEX_BATCH_ROWS = 1024
+_BATCH_BITS = 10
+_CODE_BITS = 21  # enough for any Unicode code point
+_REGEX_CHARS = set(".^$*+?{}[]\\|()")
+# Memory bound of the query result cache
+QUERY_CACHE_MAX_BYTES = int(os.getenv("SEARCH_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# (dataset, column) -> (generation, 链接 of the indexed rows, NgramIndex)
+_indexes: Dict[tuple, tuple] = {}
+_index_locks: Dict[tuple, threading.Lock] = {}
+_index_locks_guard = threading.Lock()
+index_build_stats = {}
+# dataset -> (generation, DateIndex)
+_date_indexes: Dict[str, tuple] = {}
+# (dataset, column) -> (generation, AmountIndex)
+_amount_indexes: Dict[tuple, tuple] = {}
+# (dataset, column) -> (generation, KeyIndex)
+_key_indexes: Dict[tuple, tuple] = {}
+# (dataset, column) -> (generation, FacetCodes)
+_facet_codes: Dict[tuple, tuple] = {}
+# (dataset, column) -> (generation, PartyIndex)
+_party_indexes: Dict[tuple, tuple] = {}
+# Separators between the names of a people field, and notes in parentheses
+_PARTY_SEPARATORS = re.compile(r"[，,、；;／/\n\r\t]+")
+_PARTY_NOTES = re.compile(r"[（(][^（）()]*[）)]")
+PARTY_MATCH_MODES = ("exact", "prefix", "fuzzy")
+
+
+def _bigram_pairs(texts, rows):
+    """
+    Tokenize lowercased texts into unique (bigram code, row) pairs.
+
+    Returns:
+        Tuple of int64 bigram codes, their int32 rows and the uint16 number
+        of occurrences of each pair
+    """
+    codes_parts, rows_parts, counts_parts = [], [], []
+    for start in range(0, len(texts), INDEX_BATCH_ROWS):
+        batch = texts[start:start + INDEX_BATCH_ROWS]
+        batch_rows = rows[start:start + INDEX_BATCH_ROWS]
+        # One string per batch, texts separated by NUL, as code points
+        points = np.frombuffer("\0".join(batch).encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+        if len(points) < 2:
+            continue
+        lengths = np.fromiter((len(text) for text in batch), dtype=np.int64, count=len(batch))
+        local = np.repeat(np.arange(len(batch), dtype=np.int64), lengths + 1)[:len(points) - 1]
+        first, second = points[:-1].astype(np.int64), points[1:].astype(np.int64)
+        valid = (first != 0) & (second != 0)
+        # Code and batch-local row in one int64, so unique() sorts and dedupes both
+        keys, counts = np.unique((((first << _CODE_BITS) | second) << _BATCH_BITS | local)[valid], return_counts=True)
+        codes_parts.append(keys >> _BATCH_BITS)
+        rows_parts.append(np.asarray(batch_rows, dtype=np.int32)[keys & ((1 << _BATCH_BITS) - 1)])
+        counts_parts.append(np.minimum(counts, np.iinfo(np.uint16).max).astype(np.uint16))
+    if not codes_parts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32), np.empty(0, dtype=np.uint16)
+    return np.concatenate(codes_parts), np.concatenate(rows_parts), np.concatenate(counts_parts)
+
+
+def _bigram_lengths(texts):
+    return np.fromiter((max(len(text) - 1, 0) for text in texts), dtype=np.int32, count=len(texts))
+
+
+def _term_codes(term: str):
+    points = [ord(char) for char in term]
+    return np.unique([(a << _CODE_BITS) | b for a, b in zip(points, points[1:])])
+
+
+class NgramIndex:
+    """Bigram postings of one text column: sorted codes with their sorted row lists"""
+
+    def __init__(self, codes, rows, counts, lengths):
+        # Pairs sorted by code, rows ascending within a code
+        order = np.lexsort((rows, codes))
+        codes, self.rows, self.counts = codes[order], rows[order], counts[order]
+        self.codes, starts = np.unique(codes, return_index=True)
+        self.offsets = np.append(starts, len(codes))
+        # Bigrams in each row's text
+        self.lengths = lengths
+        self.average_length = float(lengths.mean()) if len(lengths) else 0.0
+
+    @classmethod
+    def build(cls, texts, rows=None):
+        """
+        Index a list of lowercased texts.
+
+        Args:
+            texts: Lowercased strings
+            rows: Row number of each text, defaults to 0..len(texts)-1
+        """
+        if rows is None:
+            rows = np.arange(len(texts), dtype=np.int32)
+        lengths = np.zeros(int(np.max(rows)) + 1 if len(rows) else 0, dtype=np.int32)
+        lengths[rows] = _bigram_lengths(texts)
+        return cls(*_bigram_pairs(texts, rows), lengths)
+
+    def update(self, texts, rows):
+        """
+        Index with the postings of the given rows replaced.
+
+        Args:
+            texts: Lowercased new texts of the rows
+            rows: Row numbers, either new or re-tokenized
+
+        Returns:
+            New NgramIndex; this one is left unchanged for concurrent readers
+        """
+        rows = np.asarray(rows, dtype=np.int32)
+        codes = np.repeat(self.codes, np.diff(self.offsets))
+        keep = ~np.isin(self.rows, rows)
+        new_codes, new_rows, new_counts = _bigram_pairs(texts, rows)
+        lengths = np.zeros(max(len(self.lengths), int(rows.max()) + 1 if len(rows) else 0), dtype=np.int32)
+        lengths[:len(self.lengths)] = self.lengths
+        lengths[rows] = _bigram_lengths(texts)
+        return NgramIndex(np.concatenate([codes[keep], new_codes]), np.concatenate([self.rows[keep], new_rows]),
+                          np.concatenate([self.counts[keep], new_counts]), lengths)
+
+    def _slice(self, code):
+        position = np.searchsorted(self.codes, code)
+        if position == len(self.codes) or self.codes[position] != code:
+            return slice(0, 0)
+        return slice(self.offsets[position], self.offsets[position + 1])
+
+    def postings(self, code):
+        return self.rows[self._slice(code)]
+
+    def candidates(self, term: str):
+        """
+        Rows that contain every bigram of a lowercased term.
+
+        Returns:
+            Sorted int32 row numbers, a superset of the rows containing the term
+        """
+        lists = sorted((self.postings(code) for code in _term_codes(term)), key=len)
+        result = lists[0]
+        for postings in lists[1:]:
+            if not len(result):
+                break
+            result = np.intersect1d(result, postings, assume_unique=True)
+        return result
+
+    def bm25(self, term: str, rows):
+        """
+        BM25 score of the given rows for a lowercased term, its bigrams being the query terms.
+
+        Args:
+            term: Lowercased query
+            rows: Int array of the rows to score
+
+        Returns:
+            float64 scores aligned with rows
+        """
+        rows = np.asarray(rows)
+        scores = np.zeros(len(rows))
+        if not len(rows) or not self.average_length:
+            return scores
+        # Scored rows sorted, to be matched against the sorted posting lists
+        order = np.argsort(rows, kind="stable")
+        ordered = rows[order]
+        total = len(self.lengths)
+        for code in _term_codes(term):
+            found = self._slice(code)
+            posting_rows = self.rows[found]
+            if not len(posting_rows):
+                continue
+            idf = np.log((total - len(posting_rows) + 0.5) / (len(posting_rows) + 0.5) + 1.0)
+            # Search the longer of the two sorted lists for the shorter one
+            if len(ordered) < len(posting_rows):
+                at = np.minimum(np.searchsorted(posting_rows, ordered), len(posting_rows) - 1)
+                hit = posting_rows[at] == ordered
+                targets, picked = order[hit], found.start + at[hit]
+            else:
+                at = np.minimum(np.searchsorted(ordered, posting_rows), len(ordered) - 1)
+                hit = ordered[at] == posting_rows
+                targets, picked = order[at[hit]], found.start + np.flatnonzero(hit)
+            tf = self.counts[picked].astype(np.float64)
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[self.rows[picked]] / self.average_length)
+            scores[targets] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return scores
+
+    def memory_bytes(self) -> int:
+        return int(self.codes.nbytes + self.offsets.nbytes + self.rows.nbytes + self.counts.nbytes + self.lengths.nbytes)
+
+
+def _lowered(values):
+    return [value.lower() if isinstance(value, str) else "" for value in values.astype(object).tolist()]
+
+
+def _column_values(frame, column: str):
+    """Values of a column; full-text columns are fetched by 链接 when the frame has only metadata"""
+    if column in frame.columns:
+        return frame[column]
+    if column in TEXT_COLUMNS and TEXT_KEY_COLUMN in frame.columns:
+        return get_case_texts(frame[TEXT_KEY_COLUMN], load=True)
+    return None
+
+
+def _index_lock(key) -> threading.Lock:
+    with _index_locks_guard:
+        return _index_locks.setdefault(key, threading.Lock())
+
+
+def _replaces(cached, entry: DatasetEntry) -> bool:
+    """True when an index built for entry may replace the cached one
+
+    A request still holding an older generation gets an index of its own,
+    without evicting the one of the current generation.
+    """
+    return cached is None or cached[0] < entry.generation
+
+
+def get_ngram_index(dataset: DatasetRef, column: str) -> Optional[NgramIndex]:
+    """
+    Bigram index of a column for the current generation of a dataset.
+
+    Args:
+        dataset: Registry dataset name, e.g. "intersection", or its DatasetEntry
+        column: One of INDEXED_COLUMNS
+
+    Returns:
+        NgramIndex, or None when the dataset has no such column
+    """
+    entry = registry.resolve(dataset)
+    key = (entry.name, column)
+    cached = _indexes.get(key)
+    if cached is not None and cached[0] == entry.generation:
+        return cached[2]
+
+    with _index_lock(key):
+        cached = _indexes.get(key)
+        if cached is not None and cached[0] == entry.generation:
+            return cached[2]
+        frame = entry.frame
+        values = _column_values(frame, column)
+        if values is None or TEXT_KEY_COLUMN not in frame.columns:
+            return None
+
+        start = time.time()
+        links = frame[TEXT_KEY_COLUMN].to_numpy(dtype=object)
+        base_rows = len(cached[1]) if cached is not None else 0
+        if (cached is not None and entry.extends == cached[0] and len(links) >= base_rows
+                and np.array_equal(links[:base_rows], cached[1])):
+            rows = np.arange(base_rows, len(links))
+            if column in TEXT_COLUMNS:
+                # Texts are looked up by 链接, so older rows of a re-crawled case change too
+                rows = np.union1d(np.flatnonzero(np.isin(links[:base_rows], links[base_rows:])), rows)
+            index = cached[2].update(_lowered(values.iloc[rows]), rows)
+            mode = "updated"
+        else:
+            rows = np.arange(len(links))
+            index = NgramIndex.build(_lowered(values))
+            mode = "built"
+        if _replaces(cached, entry):
+            _indexes[key] = (entry.generation, links, index)
+        seconds = time.time() - start
+        index_build_stats[f"{entry.name}:{column}"] = {
+            "generation": entry.generation,
+            "mode": mode,
+            "rowsTokenized": len(rows),
+            "bigrams": len(index.codes),
+            "postings": len(index.rows),
+            "memoryBytes": index.memory_bytes(),
+            "seconds": round(seconds, 3),
+        }
+        print(f"Search index {entry.name}:{column} {mode}: {len(rows)} rows tokenized, {len(index.rows)} postings, {seconds:.2f} seconds")
+        return index
+
+
+class DateIndex:
+    """Rows sorted by publish date, newest first, undated rows last"""
+
+    def __init__(self, dates):
+        """
+        Args:
+            dates: datetime64[ns] array of the publish date of each row
+        """
+        self.dates = dates
+        values = dates.view(np.int64)
+        dated = np.flatnonzero(~np.isnat(dates))
+        # Stable, so rows of the same day keep the dataset order
+        newest_first = dated[np.argsort(-values[dated], kind="stable")]
+        self.order = np.concatenate([newest_first, np.flatnonzero(np.isnat(dates))])
+        # Negated dates of order's dated prefix, ascending for searchsorted
+        self.keys = -values[newest_first]
+        self._rank = None
+
+    @property
+    def rank(self):
+        """Position of each row in order"""
+        if self._rank is None:
+            rank = np.empty(len(self.order), dtype=np.int64)
+            rank[self.order] = np.arange(len(self.order))
+            self._rank = rank
+        return self._rank
+
+    def bounds(self, date_from=None, date_to=None):
+        """Start and end positions in order of the rows within an inclusive date range"""
+        if date_from is None and date_to is None:
+            return 0, len(self.order)
+        lo = 0 if date_to is None else int(np.searchsorted(self.keys, -date_to, side="left"))
+        hi = len(self.keys) if date_from is None else int(np.searchsorted(self.keys, -date_from, side="right"))
+        return lo, max(lo, hi)
+
+    def rows(self, date_from=None, date_to=None):
+        """
+        Rows newest first, limited to a date range when a bound is given.
+
+        Args:
+            date_from, date_to: Inclusive bounds as nanosecond timestamps;
+                rows without a date fall outside any range
+
+        Returns:
+            Row numbers, newest first
+        """
+        lo, hi = self.bounds(date_from, date_to)
+        return self.order[lo:hi]
+
+
+def get_date_index(dataset: DatasetRef) -> DateIndex:
+    """Date index of the current generation of a dataset"""
+    entry = registry.resolve(dataset)
+    cached = _date_indexes.get(entry.name)
+    if cached is not None and cached[0] == entry.generation:
+        return cached[1]
+    with _index_lock((entry.name, "date")):
+        cached = _date_indexes.get(entry.name)
+        if cached is not None and cached[0] == entry.generation:
+            return cached[1]
+        index = DateIndex(_publish_dates(entry.frame))
+        if _replaces(cached, entry):
+            _date_indexes[entry.name] = (entry.generation, index)
+        return index
+
+
+def _publish_dates(frame):
+    return get_publish_dates(frame).to_numpy(dtype="datetime64[ns]")
+
+
+def _timestamp(value):
+    """A date string as nanoseconds, None when not given"""
+    return None if not value else get_pandas().Timestamp(value).value
+
+
+def _row_positions(df, entry: DatasetEntry):
+    """Row numbers of df within a dataset generation, or None when df is not a row subset of it"""
+    positions = df.index.to_numpy()
+    if positions.dtype.kind not in "iu" or (len(positions) and positions.max() >= len(entry.frame)):
+        return None
+    return positions
+
+
+def _pick(positions, rows, total: int):
+    """Positions (for df.iloc) of the given dataset rows within a df at the given row positions, in rows order"""
+    if len(positions) == total and (positions == np.arange(total)).all():
+        return rows
+    slot = np.full(total, -1, dtype=np.int64)
+    slot[positions] = np.arange(len(positions))
+    picked = slot[rows]
+    return picked[picked >= 0]
+
+
+def _date_rows(df, date_from, date_to, dataset: DatasetRef):
+    """Positions (for df.iloc) of the rows of df in the date range, newest first"""
+    dataset = registry.resolve(dataset)
+    positions = _row_positions(df, dataset)
+    if positions is None:
+        return DateIndex(_publish_dates(df)).rows(_timestamp(date_from), _timestamp(date_to))
+    index = get_date_index(dataset)
+    return _pick(positions, index.rows(_timestamp(date_from), _timestamp(date_to)), len(index.order))
+
+
+def sort_newest_first(df, date_from=None, date_to=None, dataset: DatasetRef = "intersection"):
+    """
+    Rows of df published within a date range, newest first.
+
+    Args:
+        df: Rows of the current generation of the dataset, with its original index
+        date_from, date_to: Optional inclusive 'YYYY-MM-DD' bounds
+        dataset: Registry dataset df was taken from, or its DatasetEntry
+
+    Returns:
+        Reordered subset of df; rows without a date come last and are
+        dropped when a bound is given
+    """
+    return df.iloc[_date_rows(df, date_from, date_to, dataset)]
+
+
+def date_range_mask(df, date_from=None, date_to=None, dataset: DatasetRef = "intersection"):
+    """Boolean Series aligned with df, True for rows published within the inclusive range"""
+    result = np.zeros(len(df), dtype=bool)
+    result[_date_rows(df, date_from, date_to, dataset)] = True
+    return get_pandas().Series(result, index=df.index)
+
+
+def count_date_range(date_from=None, date_to=None, dataset: DatasetRef = "intersection") -> int:
+    """Number of rows of a dataset published within the inclusive range"""
+    lo, hi = get_date_index(dataset).bounds(_timestamp(date_from), _timestamp(date_to))
+    return hi - lo
+
+
+class AmountIndex:
+    """Rows sorted by amount, with the rows lacking a numeric amount kept apart"""
+
+    def __init__(self, values):
+        """
+        Args:
+            values: Series of the amount column; blank and non-numeric values
+                count as missing
+        """
+        amounts = get_pandas().to_numeric(values, errors="coerce").to_numpy(dtype=np.float64)
+        self.amounts = amounts
+        self.missing = np.flatnonzero(np.isnan(amounts))
+        present = np.flatnonzero(~np.isnan(amounts))
+        # Stable, so rows of the same amount keep the dataset order
+        self.order = present[np.argsort(amounts[present], kind="stable")]
+        self.sorted = amounts[self.order]
+
+    def bounds(self, min_amount=None, max_amount=None):
+        """Start and end positions in order of the rows with an amount in the inclusive range"""
+        lo = 0 if min_amount is None else int(np.searchsorted(self.sorted, min_amount, side="left"))
+        hi = len(self.sorted) if max_amount is None else int(np.searchsorted(self.sorted, max_amount, side="right"))
+        return lo, max(lo, hi)
+
+    def _counts_missing(self, min_amount, max_amount, missing_as_zero: bool) -> bool:
+        return missing_as_zero and (min_amount is None or min_amount <= 0) and (max_amount is None or max_amount >= 0)
+
+    def rows(self, min_amount=None, max_amount=None, missing_as_zero: bool = True):
+        """
+        Rows with an amount within an inclusive range.
+
+        Args:
+            min_amount, max_amount: Optional bounds
+            missing_as_zero: Count rows without an amount as 0, like the
+                search filter does; otherwise they match no range
+
+        Returns:
+            Sorted row numbers
+        """
+        lo, hi = self.bounds(min_amount, max_amount)
+        rows = self.order[lo:hi]
+        if self._counts_missing(min_amount, max_amount, missing_as_zero):
+            rows = np.concatenate([rows, self.missing])
+        return np.sort(rows)
+
+    def count(self, min_amount=None, max_amount=None, missing_as_zero: bool = True) -> int:
+        """Number of rows rows() would return, without materializing them"""
+        lo, hi = self.bounds(min_amount, max_amount)
+        return hi - lo + (len(self.missing) if self._counts_missing(min_amount, max_amount, missing_as_zero) else 0)
+
+    def histogram(self, edges, rows=None):
+        """
+        Number of rows per amount bucket.
+
+        Args:
+            edges: Ascending bucket edges; bucket i holds edges[i] <= amount < edges[i + 1]
+                and the last bucket is open-ended
+            rows: Row numbers to count, all rows when None
+
+        Returns:
+            Tuple of (counts per bucket, rows without an amount)
+        """
+        edges = np.asarray(edges, dtype=np.float64)
+        if rows is None:
+            # Bucket boundaries are binary searches in the sorted amounts
+            starts = np.searchsorted(self.sorted, edges, side="left")
+            counts = np.diff(np.append(starts, len(self.sorted)))
+            return counts, len(self.missing)
+        amounts = self.amounts[np.asarray(rows, dtype=np.int64)]
+        present = amounts[~np.isnan(amounts)]
+        buckets = np.searchsorted(edges, present, side="right") - 1
+        counts = np.bincount(buckets[buckets >= 0], minlength=len(edges))
+        return counts, len(amounts) - len(present)
+
+    def memory_bytes(self) -> int:
+        return int(self.amounts.nbytes + self.missing.nbytes + self.order.nbytes + self.sorted.nbytes)
+
+
+def get_amount_index(dataset: DatasetRef, column: str = "罚款金额") -> Optional[AmountIndex]:
+    """
+    Amount index of a column for the current generation of a dataset.
+
+    Returns:
+        AmountIndex, or None when the dataset has no such column
+    """
+    entry = registry.resolve(dataset)
+    key = (entry.name, column)
+    cached = _amount_indexes.get(key)
+    if cached is not None and cached[0] == entry.generation:
+        return cached[1]
+    with _index_lock(key + ("amount",)):
+        cached = _amount_indexes.get(key)
+        if cached is not None and cached[0] == entry.generation:
+            return cached[1]
+        if column not in entry.frame.columns:
+            return None
+        start = time.time()
+        index = AmountIndex(entry.frame[column])
+        if _replaces(cached, entry):
+            _amount_indexes[key] = (entry.generation, index)
+        index_build_stats[f"{entry.name}:{column}:amount"] = {
+            "generation": entry.generation,
+            "rows": len(index.amounts),
+            "missing": len(index.missing),
+            "memoryBytes": index.memory_bytes(),
+            "seconds": round(time.time() - start, 3),
+        }
+        return index
+
+
+def amount_mask(df, min_amount=None, max_amount=None, missing_as_zero: bool = True,
+                column: str = "罚款金额", dataset: DatasetRef = "intersection"):
+    """
+    Boolean Series aligned with df, True for rows with an amount in the inclusive range.
+
+    Args:
+        df: Rows of the current generation of the dataset, with its original index
+        min_amount, max_amount: Optional bounds
+        missing_as_zero: Count blank or non-numeric amounts as 0
+        column: Amount column
+        dataset: Registry dataset df was taken from, or its DatasetEntry
+    """
+    pandas = get_pandas()
+    dataset = registry.resolve(dataset)
+    positions = _row_positions(df, dataset)
+    index = get_amount_index(dataset, column) if positions is not None else None
+    if index is None:
+        amounts = pandas.to_numeric(df[column], errors="coerce")
+        if missing_as_zero:
+            amounts = amounts.fillna(0)
+        mask = amounts.notna()
+        if min_amount is not None:
+            mask &= amounts >= min_amount
+        if max_amount is not None:
+            mask &= amounts <= max_amount
+        return mask
+    result = np.zeros(len(df), dtype=bool)
+    result[_pick(positions, index.rows(min_amount, max_amount, missing_as_zero), len(index.amounts))] = True
+    return pandas.Series(result, index=df.index)
+
+
+def amount_histogram(rows, edges, column: str = "罚款金额", dataset: DatasetRef = "intersection"):
+    """
+    Amount buckets of a set of rows.
+
+    Args:
+        rows: Row numbers in the current generation of the dataset, or None for all rows
+        edges: Ascending bucket edges, the last bucket being open-ended
+
+    Returns:
+        List of {"min", "max", "count"} per bucket (max None for the last
+        one) and a final {"min": None, "max": None, "count"} of the rows
+        without an amount; empty when the dataset has no such column
+    """
+    index = get_amount_index(dataset, column)
+    if index is None:
+        return []
+    counts, missing = index.histogram(edges, rows)
+    uppers = list(edges[1:]) + [None]
+    buckets = [{"min": edges[i], "max": uppers[i], "count": int(counts[i])} for i in range(len(edges))]
+    buckets.append({"min": None, "max": None, "count": int(missing)})
+    return buckets
+
+
+class KeyIndex:
+    """Hash map from the distinct values of a column to their rows"""
+
+    def __init__(self, values):
+        """
+        Args:
+            values: Series of the column; missing values are not indexed
+        """
+        pandas = get_pandas()
+        codes, uniques = pandas.factorize(values)
+        self.keys = pandas.Index(uniques)
+        order = np.argsort(codes, kind="stable")
+        # Rows grouped by value, ascending within a value; missing values sort first
+        self.rows = order[np.count_nonzero(codes < 0):]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(codes[codes >= 0], minlength=len(uniques)))])
+
+    def lookup(self, values):
+        """
+        Rows holding any of the given values.
+
+        Returns:
+            Sorted int64 row numbers
+        """
+        codes = self.keys.get_indexer(get_pandas().Index(list(values)))
+        codes = np.unique(codes[codes >= 0])
+        if len(codes) == 1:
+            return self.rows[self.offsets[codes[0]]:self.offsets[codes[0] + 1]]
+        parts = [self.rows[self.offsets[code]:self.offsets[code + 1]] for code in codes]
+        return np.sort(np.concatenate(parts)) if parts else self.rows[:0]
+
+    def memory_bytes(self) -> int:
+        return int(self.keys.memory_usage(deep=False) + self.rows.nbytes + self.offsets.nbytes)
+
+
+def get_key_index(dataset: DatasetRef, column: str) -> Optional[KeyIndex]:
+    """
+    Key index of a column for the current generation of a dataset.
+
+    Returns:
+        KeyIndex, or None when the dataset has no such column
+    """
+    entry = registry.resolve(dataset)
+    key = (entry.name, column)
+    cached = _key_indexes.get(key)
+    if cached is not None and cached[0] == entry.generation:
+        return cached[1]
+    with _index_lock(key + ("key",)):
+        cached = _key_indexes.get(key)
+        if cached is not None and cached[0] == entry.generation:
+            return cached[1]
+        if column not in entry.frame.columns:
+            return None
+        start = time.time()
+        index = KeyIndex(entry.frame[column])
+        if _replaces(cached, entry):
+            _key_indexes[key] = (entry.generation, index)
+        index_build_stats[f"{entry.name}:{column}:key"] = {
+            "generation": entry.generation,
+            "keys": len(index.keys),
+            "memoryBytes": index.memory_bytes(),
+            "seconds": round(time.time() - start, 3),
+        }
+        return index
+
+
+def lookup(dataset: DatasetRef, column: str, values):
+    """
+    Rows of the current generation of a dataset whose column equals any of the values.
+
+    Args:
+        dataset: Registry dataset name, e.g. "analysis"
+        column: Exact-match column such as 链接, 机构, 文号 or id
+        values: Iterable of values to find
+
+    Returns:
+        Sorted row numbers (for .iloc on the dataset); empty when the
+        dataset has no such column
+    """
+    index = get_key_index(dataset, column)
+    if index is None:
+        return np.empty(0, dtype=np.int64)
+    return index.lookup(values)
+
+
+def key_rows(df, column: str, values, dataset: DatasetRef):
+    """
+    Positions (for df.iloc) of the rows of df whose column equals any of the values.
+
+    Args:
+        df: Rows of the current generation of the dataset, with its original index
+        column: Column to match
+        values: Iterable of values to find
+        dataset: Registry dataset df was taken from, or its DatasetEntry
+
+    Returns:
+        Positions within df, in dataset row order
+    """
+    dataset = registry.resolve(dataset)
+    positions = _row_positions(df, dataset)
+    index = get_key_index(dataset, column) if positions is not None else None
+    if index is None:
+        return np.flatnonzero(df[column].isin(list(values)).to_numpy(dtype=bool))
+    return _pick(positions, index.lookup(values), len(dataset.frame))
+
+
+def key_mask(df, column: str, value, dataset: DatasetRef = "intersection"):
+    """Boolean Series aligned with df, True where the column equals value"""
+    result = np.zeros(len(df), dtype=bool)
+    result[key_rows(df, column, [value], dataset)] = True
+    return get_pandas().Series(result, index=df.index)
+
+
+def split_parties(text) -> List[str]:
+    """
+    Individual party names of a people field.
+
+    Names are separated by commas, 、 or semicolons; notes in parentheses
+    and labels such as "当事人：" are dropped.
+    """
+    if not isinstance(text, str):
+        return []
+    names = []
+    for part in _PARTY_SEPARATORS.split(_PARTY_NOTES.sub("", text)):
+        name = re.split(r"[：:]", part)[-1].strip()
+        if name:
+            names.append(name)
+    return names
+
+
+def _edit_distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein distance of two strings, or limit + 1 once it is known to exceed limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char in enumerate(a, 1):
+        current = [i]
+        for j, other in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char != other)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def _deletions(word: str, depth: int) -> set:
+    """word and the distinct strings left by deleting up to depth of its characters"""
+    found = frontier = {word}
+    for _ in range(depth):
+        frontier = {part[:i] + part[i + 1:] for part in frontier for i in range(len(part))}
+        found = found | frontier
+    return found
+
+
+class PartyIndex:
+    """
+    Sorted distinct party names, lowercased, with the rows naming each.
+
+    Fuzzy lookups use deletion neighbourhoods: two names within d edits
+    share a string left by deleting at most d characters from each, so a
+    query only checks the names sharing one of its deletions. The hashes of
+    every name's deletions are kept sorted per depth; depth 1 is built with
+    the index, deeper ones on their first lookup.
+    """
+
+    def __init__(self, values):
+        """
+        Args:
+            values: Series of the people column
+        """
+        pandas = get_pandas()
+        per_row = [split_parties(value) for value in values.tolist()]
+        rows = np.repeat(np.arange(len(per_row), dtype=np.int64), [len(names) for names in per_row])
+        keys = pandas.Index([name.lower() for names in per_row for name in names], dtype=object)
+        codes, uniques = pandas.factorize(keys, sort=True)
+        # A row listing a name twice is posted once
+        pairs = np.unique(np.stack([codes.astype(np.int64), rows]), axis=1) if len(rows) else np.empty((2, 0), dtype=np.int64)
+        self.names = list(uniques)
+        self.rows = pairs[1]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(pairs[0], minlength=len(self.names)))])
+        # depth -> (sorted deletion hashes, name id of each)
+        self._neighbourhoods: Dict[int, tuple] = {}
+        self._neighbourhood(1)
+
+    def _neighbourhood(self, depth: int) -> tuple:
+        table = self._neighbourhoods.get(depth)
+        if table is None:
+            per_name = [[hash(part) for part in _deletions(name, depth)] for name in self.names]
+            hashes = np.fromiter((value for parts in per_name for value in parts), dtype=np.int64)
+            ids = np.repeat(np.arange(len(per_name), dtype=np.int32), [len(parts) for parts in per_name])
+            order = np.argsort(hashes, kind="stable")
+            table = self._neighbourhoods[depth] = (hashes[order], ids[order])
+        return table
+
+    def postings(self, name_id: int):
+        return self.rows[self.offsets[name_id]:self.offsets[name_id + 1]]
+
+    def exact(self, name: str) -> List[int]:
+        """Ids of the name equal to name, ignoring case"""
+        key = name.strip().lower()
+        position = bisect.bisect_left(self.names, key)
+        return [position] if position < len(self.names) and self.names[position] == key else []
+
+    def prefix(self, prefix: str) -> List[int]:
+        """Ids of the names starting with prefix, ignoring case"""
+        key = prefix.strip().lower()
+        if not key:
+            return []
+        return list(range(bisect.bisect_left(self.names, key), bisect.bisect_left(self.names, key + "\U0010ffff")))
+
+    def fuzzy(self, name: str, max_distance: int = 1) -> List[int]:
+        """Ids of the names within max_distance edits of name, closest first"""
+        key = name.strip().lower()
+        if not key:
+            return []
+        hashes, ids = self._neighbourhood(max_distance)
+        probes = np.fromiter((hash(part) for part in _deletions(key, max_distance)), dtype=np.int64)
+        starts = np.searchsorted(hashes, probes, side="left")
+        ends = np.searchsorted(hashes, probes, side="right")
+        candidates = np.unique(np.concatenate([ids[start:end] for start, end in zip(starts, ends)]))
+        found = []
+        # Hash collisions and shared deletions of farther names are dropped here
+        for name_id in candidates.tolist():
+            distance = _edit_distance(key, self.names[name_id], max_distance)
+            if distance <= max_distance:
+                found.append((distance, name_id))
+        return [name_id for _, name_id in sorted(found)]
+
+    def lookup(self, name: str, mode: str = "exact", max_distance: int = 1) -> List[int]:
+        """Ids of the names matching name in one of PARTY_MATCH_MODES"""
+        if mode == "prefix":
+            return self.prefix(name)
+        if mode == "fuzzy":
+            return self.fuzzy(name, max_distance)
+        return self.exact(name)
+
+    def rows_of(self, name_ids) -> np.ndarray:
+        """Sorted rows naming any of the given names"""
+        parts = [self.postings(name_id) for name_id in name_ids]
+        if len(parts) == 1:
+            return parts[0]
+        return np.unique(np.concatenate(parts)) if parts else self.rows[:0]
+
+    def memory_bytes(self) -> int:
+        tables = sum(hashes.nbytes + ids.nbytes for hashes, ids in self._neighbourhoods.values())
+        return int(sum(len(name) for name in self.names) * 4 + self.rows.nbytes + self.offsets.nbytes + tables)
+
+
+def get_party_index(dataset: DatasetRef, column: str = "people") -> Optional[PartyIndex]:
+    """
+    Party index of a people column for the current generation of a dataset.
+
+    Returns:
+        PartyIndex, or None when the dataset has no such column
+    """
+    entry = registry.resolve(dataset)
+    key = (entry.name, column)
+    cached = _party_indexes.get(key)
+    if cached is not None and cached[0] == entry.generation:
+        return cached[1]
+    with _index_lock(key + ("party",)):
+        cached = _party_indexes.get(key)
+        if cached is not None and cached[0] == entry.generation:
+            return cached[1]
+        if column not in entry.frame.columns:
+            return None
+        start = time.time()
+        index = PartyIndex(entry.frame[column])
+        if _replaces(cached, entry):
+            _party_indexes[key] = (entry.generation, index)
+        index_build_stats[f"{entry.name}:{column}:party"] = {
+            "generation": entry.generation,
+            "names": len(index.names),
+            "postings": len(index.rows),
+            "memoryBytes": index.memory_bytes(),
+            "seconds": round(time.time() - start, 3),
+        }
+        return index
+
+
+def find_parties(name: str, mode: str = "exact", max_distance: int = 1, limit: Optional[int] = None,
+                 dataset: DatasetRef = "intersection", column: str = "people"):
+    """
+    Party names matching a query, with the rows of the cases naming each.
+
+    Args:
+        name: Party name, prefix or misspelling
+        mode: "exact", "prefix" or "fuzzy"
+        max_distance: Edit distance allowed in fuzzy mode
+        limit: Maximum number of names; prefix matches with the most cases come first
+        dataset: Registry dataset to search
+        column: People column
+
+    Returns:
+        List of (lowercased name, sorted row numbers)
+    """
+    index = get_party_index(dataset, column)
+    if index is None:
+        return []
+    name_ids = index.lookup(name, mode, max_distance)
+    if mode == "prefix":
+        name_ids = sorted(name_ids, key=lambda name_id: index.offsets[name_id] - index.offsets[name_id + 1])
+    if limit is not None:
+        name_ids = name_ids[:limit]
+    return [(index.names[name_id], index.postings(name_id)) for name_id in name_ids]
+
+
+def party_rows(name: str, mode: str = "exact", max_distance: int = 1,
+               dataset: DatasetRef = "intersection", column: str = "people") -> np.ndarray:
+    """Sorted rows of the cases naming a party that matches name; see find_parties"""
+    index = get_party_index(dataset, column)
+    if index is None:
+        return np.empty(0, dtype=np.int64)
+    return index.rows_of(index.lookup(name, mode, max_distance))
+
+
+def rows_mask(df, rows, dataset: DatasetRef = "intersection"):
+    """
+    Boolean Series aligned with df, True for the given dataset rows.
+
+    Raises:
+        ValueError: When df is not a row subset of the dataset
+    """
+    dataset = registry.resolve(dataset)
+    positions = _row_positions(df, dataset)
+    if positions is None:
+        raise ValueError("rows_mask needs rows of the current dataset generation")
+    result = np.zeros(len(df), dtype=bool)
+    result[_pick(positions, rows, len(dataset.frame))] = True
+    return get_pandas().Series(result, index=df.index)
+
+
+class FacetCodes:
+    """Integer code of each row's value in a column; -1 for missing and blank values"""
+
+    def __init__(self, values):
+        """
+        Args:
+            values: Series of the column; a datetime column is coded by year
+        """
+        pandas = get_pandas()
+        if pandas.api.types.is_datetime64_any_dtype(values):
+            years = values.dt.year
+            first = int(years.min()) if years.notna().any() else 0
+            self.codes = (years - first).fillna(-1).to_numpy(dtype=np.int32)
+            self.labels = list(range(first, int(years.max()) + 1)) if years.notna().any() else []
+            return
+        if isinstance(values.dtype, pandas.CategoricalDtype):
+            codes, labels = values.cat.codes.to_numpy(dtype=np.int32), values.cat.categories
+        else:
+            codes, labels = pandas.factorize(values)
+            codes = codes.astype(np.int32)
+        self.labels = pandas.Index(labels).astype(str).tolist()
+        blank = np.array([not label.strip() for label in self.labels], dtype=bool)
+        if blank.any():
+            codes = np.where((codes >= 0) & blank[np.maximum(codes, 0)], -1, codes)
+        self.codes = codes
+
+    def counts(self, rows, top: int):
+        """
+        Most frequent values among the given rows.
+
+        Args:
+            rows: Row numbers of the matches
+            top: Number of values to return
+
+        Returns:
+            List of (value, count), most frequent first; ties in label order
+        """
+        codes = self.codes[rows]
+        counts = np.bincount(codes[codes >= 0], minlength=len(self.labels))
+        present = np.flatnonzero(counts)
+        if len(present) > top:
+            present = present[np.argpartition(-counts[present], top - 1)[:top]]
+        present = present[np.lexsort((present, -counts[present]))]
+        return [(self.labels[code], int(counts[code])) for code in present]
+
+    def memory_bytes(self) -> int:
+        return int(self.codes.nbytes)
+
+
+def get_facet_codes(dataset: DatasetRef, column: str) -> Optional[FacetCodes]:
+    """
+    Facet codes of a column for the current generation of a dataset.
+
+    Returns:
+        FacetCodes, or None when the dataset has no such column
+    """
+    entry = registry.resolve(dataset)
+    key = (entry.name, column)
+    cached = _facet_codes.get(key)
+    if cached is not None and cached[0] == entry.generation:
+        return cached[1]
+    with _index_lock(key + ("facet",)):
+        cached = _facet_codes.get(key)
+        if cached is not None and cached[0] == entry.generation:
+            return cached[1]
+        if column not in entry.frame.columns:
+            return None
+        start = time.time()
+        facet = FacetCodes(entry.frame[column])
+        if _replaces(cached, entry):
+            _facet_codes[key] = (entry.generation, facet)
+        index_build_stats[f"{entry.name}:{column}:facet"] = {
+            "generation": entry.generation,
+            "values": len(facet.labels),
+            "memoryBytes": facet.memory_bytes(),
+            "seconds": round(time.time() - start, 3),
+        }
+        return facet
+
+
+def facet_counts(rows, columns: Dict[str, str], top: int = 10, dataset: DatasetRef = "intersection") -> Dict[str, list]:
+    """
+    Top values of several columns among a set of rows.
+
+    Args:
+        rows: Row numbers of the matches in the current generation of the dataset
+        columns: Facet name -> column, e.g. {"org": "机构"}
+        top: Number of values per facet
+        dataset: Registry dataset the rows belong to, or its DatasetEntry
+
+    Returns:
+        Facet name -> list of {"value", "count"}, most frequent first; empty
+        for a column the dataset does not have
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    dataset = registry.resolve(dataset)
+    result = {}
+    for name, column in columns.items():
+        facet = get_facet_codes(dataset, column)
+        counts = facet.counts(rows, top) if facet is not None else []
+        result[name] = [{"value": value, "count": count} for value, count in counts]
+    return result
+
+
+def _is_indexable(keyword: str) -> bool:
+    """True for literal keywords long enough to have a bigram"""
+    return len(keyword) >= 2 and "\0" not in keyword and not any(char in _REGEX_CHARS for char in keyword)
+
+
+def _scan_mask(frame, keyword: str, columns):
+    """The original filter: case-insensitive contains over any of the columns"""
+    mask = None
+    for column in columns:
+        values = _column_values(frame, column)
+        if values is None:
+            continue
+        matches = values.str.contains(keyword, na=False, case=False)
+        mask = matches if mask is None else mask | matches
+    if mask is None:
+        return get_pandas().Series(False, index=frame.index)
+    return mask.astype(bool)
+
+
+def keyword_mask(df, keyword: str, columns=("名称", "内容"), dataset: DatasetRef = "intersection"):
+    """
+    Rows of df containing keyword in any of the given columns.
+
+    Same result as ``df[col].str.contains(keyword, na=False, case=False)``
+    OR-ed over the columns, but only the rows the bigram index proposes are
+    scanned.
+
+    Args:
+        df: Rows of the current generation of the dataset, with its original index
+        keyword: Search keyword
+        columns: Columns to search, from INDEXED_COLUMNS
+        dataset: Registry dataset df was taken from, or its DatasetEntry
+
+    Returns:
+        Boolean Series aligned with df
+    """
+    if not _is_indexable(keyword) or df.empty or not all(column in INDEXED_COLUMNS for column in columns):
+        return _scan_mask(df, keyword, columns)
+    dataset = registry.resolve(dataset)
+    positions = _row_positions(df, dataset)
+    if positions is None:
+        return _scan_mask(df, keyword, columns)
+
+    term = keyword.lower()
+    candidates = []
+    for column in columns:
+        index = get_ngram_index(dataset, column)
+        if index is not None:
+            candidates.append(index.candidates(term))
+    if not candidates:
+        return _scan_mask(df, keyword, columns)
+    selected = np.flatnonzero(np.isin(positions, np.unique(np.concatenate(candidates))))
+
+    result = np.zeros(len(df), dtype=bool)
+    if len(selected):
+        matched = _scan_mask(df.iloc[selected], keyword, columns).to_numpy(dtype=bool)
+        result[selected[matched]] = True
+    return get_pandas().Series(result, index=df.index)
+
+
+def estimate_keyword_rows(keyword: str, columns=("名称", "内容"), dataset: DatasetRef = "intersection") -> Optional[int]:
+    """
+    Upper bound of the rows of a dataset containing keyword in any of the columns.
+
+    Each column contributes the length of the shortest posting list among
+    the keyword's bigrams; nothing is intersected or scanned.
+
+    Returns:
+        Row count bound, or None when the keyword cannot use the index
+    """
+    if not _is_indexable(keyword) or not all(column in INDEXED_COLUMNS for column in columns):
+        return None
+    codes = _term_codes(keyword.lower())
+    dataset = registry.resolve(dataset)
+    rows = 0
+    for column in columns:
+        index = get_ngram_index(dataset, column)
+        if index is None:
+            return None
+        rows += min(len(index.postings(code)) for code in codes)
+    return rows
+
+
+def rank_by_relevance(df, keyword: str, k: int, dataset: DatasetRef = "intersection"):
+    """
+    Order the rows of df by the BM25 score of keyword over 名称 and 内容.
+
+    Only the k best rows are sorted: the k-th best score is found with a
+    linear-time partition and the rows at or above it are ranked, so the
+    sorting cost depends on k rather than on the number of matches. Equal
+    scores keep the order of df.
+
+    Args:
+        df: Rows of the current generation of the dataset, with its original index
+        keyword: Search keyword
+        k: Number of leading rows needed, e.g. the end of the requested page
+        dataset: Registry dataset df was taken from, or its DatasetEntry
+
+    Returns:
+        Positions (for df.iloc) of the first min(k, len(df)) rows by relevance
+    """
+    k = min(k, len(df))
+    dataset = registry.resolve(dataset)
+    positions = _row_positions(df, dataset)
+    if k <= 0 or not _is_indexable(keyword) or positions is None:
+        return np.arange(k)
+
+    term = keyword.lower()
+    scores = np.zeros(len(df))
+    for column, weight in RELEVANCE_WEIGHTS.items():
+        index = get_ngram_index(dataset, column)
+        if index is not None:
+            scores += weight * index.bm25(term, positions)
+    threshold = np.partition(scores, len(scores) - k)[len(scores) - k]
+    # Rows above the k-th score, then rows tied with it in df order up to k
+    above = np.flatnonzero(scores > threshold)
+    top = np.concatenate([above, np.flatnonzero(scores == threshold)[:k - len(above)]])
+    # Highest score first, ties in df order
+    return top[np.lexsort((top, -scores[top]))]
+
+
+def query_fingerprint(**params) -> str:
+    """Short digest of the search parameters a cursor is bound to"""
+    payload = json.dumps({key: value for key, value in params.items() if value is not None}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def encode_cursor(payload: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str) -> dict:
+    """Decode a cursor token; ValueError when it is malformed"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode("utf-8"))
+        if not isinstance(payload, dict) or not {"g", "p", "d", "l", "t", "f"} <= set(payload):
+            raise ValueError("missing fields")
+        return payload
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+
+def cursor_after(row: int, total: int, fingerprint: str, dataset: DatasetRef = "intersection") -> str:
+    """
+    Cursor of the page following a dataset row.
+
+    Args:
+        row: Dataset row number of the last row served
+        total: Number of matches of the query, carried along to later pages
+        fingerprint: query_fingerprint() of the search parameters
+        dataset: Registry dataset the rows come from, or its DatasetEntry
+    """
+    entry = registry.resolve(dataset)
+    index = get_date_index(entry)
+    date = index.dates[row]
+    return encode_cursor({
+        "g": entry.generation,
+        "p": int(index.rank[row]) + 1,
+        "d": None if np.isnat(date) else int(date.astype(np.int64)),
+        "l": str(entry.frame[TEXT_KEY_COLUMN].iloc[row]),
+        "t": int(total),
+        "f": fingerprint,
+    })
+
+
+def _resume_position(cursor: dict, index: DateIndex, frame) -> int:
+    """Position in the date order of a newer generation right after the cursor's (date, 链接)"""
+    if cursor["d"] is None:
+        lo, hi = len(index.keys), len(index.order)
+    else:
+        lo = int(np.searchsorted(index.keys, -cursor["d"], side="left"))
+        hi = int(np.searchsorted(index.keys, -cursor["d"], side="right"))
+    links = frame[TEXT_KEY_COLUMN].to_numpy(dtype=object)[index.order[lo:hi]]
+    found = np.flatnonzero(links == cursor["l"])
+    # A case that disappeared resumes at the start of its day
+    return lo + int(found[-1]) + 1 if len(found) else lo
+
+
+def page_after_cursor(df, token: str, fingerprint: str, limit: int, filter_rows,
+                      date_from=None, date_to=None, dataset: DatasetRef = "intersection"):
+    """
+    Fetch the page after a cursor, newest first.
+
+    The date order is walked from the cursor in growing chunks, and only
+    the rows walked are filtered, until limit matches and one more are found.
+
+    Args:
+        df: The whole current generation of the dataset
+        token: Cursor returned with the previous page
+        fingerprint: query_fingerprint() of the search parameters
+        limit: Page size
+        filter_rows: Function applying the search filters to a frame of rows
+            and returning the matching ones in the same order
+        date_from, date_to: Optional inclusive 'YYYY-MM-DD' bounds
+        dataset: Registry dataset df was taken from, or its DatasetEntry
+
+    Returns:
+        Tuple of (page rows, whether more rows follow, total carried by the
+        cursor or None when the generation changed and the caller has to
+        count again)
+
+    Raises:
+        ValueError: The cursor is malformed or was issued for another query
+    """
+    cursor = decode_cursor(token)
+    if cursor["f"] != fingerprint:
+        raise ValueError("Cursor was issued for different search parameters")
+    entry = registry.resolve(dataset)
+    index = get_date_index(entry)
+    if len(df) != len(index.order):
+        raise ValueError("Cursor pagination needs the whole dataset")
+    same_generation = cursor["g"] == entry.generation
+    position = int(cursor["p"]) if same_generation else _resume_position(cursor, index, df)
+    lo, hi = index.bounds(_timestamp(date_from), _timestamp(date_to))
+    position = max(position, lo)
+
+    matched = []
+    chunk = max(4 * limit, 256)
+    while position < hi and len(matched) <= limit:
+        rows = index.order[position:min(hi, position + chunk)]
+        kept = filter_rows(df.iloc[rows]).index.to_numpy()
+        matched.extend((position + np.flatnonzero(np.isin(rows, kept))).tolist())
+        position += len(rows)
+        chunk = min(chunk * 2, 65536)
+
+    page = df.iloc[index.order[matched[:limit]]]
+    return page, len(matched) > limit, int(cursor["t"]) if same_generation else None
+
+
+class QueryResultCache:
+    """Byte-bounded LRU cache of row-number arrays, keyed by dataset generation and query"""
+
+    # Rough per-entry overhead of the key and the bookkeeping
+    ENTRY_OVERHEAD = 200
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generations: Dict[str, int] = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _size(self, rows) -> int:
+        return rows.nbytes + self.ENTRY_OVERHEAD
+
+    def _drop(self, key):
+        self.bytes -= self._size(self._entries.pop(key))
+
+    def get(self, dataset: str, generation: int, query):
+        key = (dataset, generation, query)
+        with self._lock:
+            rows = self._entries.get(key)
+            if rows is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return rows
+
+    def put(self, dataset: str, generation: int, query, rows):
+        """Cache a result; results of older generations of the dataset are dropped"""
+        size = self._size(rows)
+        if size > self.max_bytes:
+            return
+        rows.flags.writeable = False
+        with self._lock:
+            if generation < self._generations.get(dataset, generation):
+                # Computed by a request that still held an older generation
+                return
+            if self._generations.get(dataset) != generation:
+                self._generations[dataset] = generation
+                for stale in [key for key in self._entries if key[0] == dataset and key[1] != generation]:
+                    self._drop(stale)
+            key = (dataset, generation, query)
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = rows
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "maxBytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hitRate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+query_cache = QueryResultCache(QUERY_CACHE_MAX_BYTES)
+
+
+def normalize_query(**params):
+    """Hashable form of search parameters: blank values dropped, numbers as floats, sorted by name"""
+    normalized = []
+    for name, value in sorted(params.items()):
+        if value is None or value == "":
+            continue
+        normalized.append((name, float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else value))
+    return tuple(normalized)
+
+
+def cached_rows(df, query, compute, dataset: DatasetRef = "intersection"):
+    """
+    Positions of the rows matching a query, from the query result cache when possible.
+
+    Only a df holding the whole current generation of the dataset is cached;
+    for any other df the query is computed, and its index has to be unique.
+
+    Args:
+        df: Frame to search, normally the whole dataset
+        query: normalize_query() of the search parameters
+        compute: Function returning the matching rows of df, in result order
+        dataset: Registry dataset df was taken from, or its DatasetEntry
+
+    Returns:
+        Array of positions (for df.iloc) in result order
+    """
+    entry = registry.resolve(dataset)
+    pandas = get_pandas()
+    whole = (isinstance(df.index, pandas.RangeIndex) and df.index.start == 0 and df.index.step == 1
+             and len(df) == len(entry.frame))
+    if not whole:
+        return df.index.get_indexer(compute().index)
+    rows = query_cache.get(entry.name, entry.generation, query)
+    if rows is None:
+        rows = compute().index.to_numpy().astype(np.int32 if len(df) < 2 ** 31 else np.int64)
+        query_cache.put(entry.name, entry.generation, query, rows)
+    return rows
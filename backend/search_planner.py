@@ -0,0 +1,105 @@
+"""Selectivity-aware ordering of the search filters
+
+The search filters are conjunctive and each keeps the row order, so they
+give the same result in any order. They used to run in a fixed order with
+the keyword scan first, so the most expensive filter always saw the whole
+corpus. A plan estimates the fraction of rows each filter keeps, from index
+statistics where there are some (key index counts, date index bounds,
+bigram posting lengths) and from a small stride sample of the rows
+otherwise, and runs the filters by increasing cost / (1 - selectivity):
+cheap filters that drop many rows first, substring scans last.
+"""
+
+from typing import Callable, List, Optional
+
+from dataset_registry import DatasetRef
+from search_index import estimate_keyword_rows
+
+# Rows a filter without index statistics is tried on to estimate its selectivity
+PLAN_SAMPLE_ROWS = 512
+# Relative cost per input row of each kind of filter
+FILTER_COSTS = {
+    "key": 1.0,        # key or date index lookup
+    "amount": 2.0,     # numeric comparison
+    "index": 5.0,      # bigram candidates, then a scan of the candidates
+    "scan": 20.0,      # substring scan of a short column
+    "textScan": 200.0, # substring scan of 内容
+}
+
+
+class FilterStep:
+    """One filter of a plan"""
+
+    def __init__(self, name: str, apply: Callable, cost: float, rows: Optional[int] = None):
+        """
+        Args:
+            name: Filter name shown in the plan
+            apply: Function returning the matching rows of a frame, in order
+            cost: Relative cost per input row, from FILTER_COSTS
+            rows: Estimated matching rows in the whole dataset from an
+                index, or None to estimate on a sample
+        """
+        self.name = name
+        self.apply = apply
+        self.cost = cost
+        self.rows = rows
+        self.selectivity = 1.0
+        self.source = "index" if rows is not None else "sample"
+
+    @property
+    def rank(self) -> float:
+        return self.cost / max(1.0 - self.selectivity, 1e-6)
+
+
+def keyword_filter_cost(keyword: str, columns=("名称", "内容"), dataset: DatasetRef = "intersection"):
+    """
+    Cost and row estimate of a keyword filter.
+
+    Returns:
+        Tuple of (cost, rows or None) for FilterStep
+    """
+    rows = estimate_keyword_rows(keyword, columns, dataset)
+    if rows is not None:
+        return FILTER_COSTS["index"], rows
+    return FILTER_COSTS["textScan" if "内容" in columns else "scan"], None
+
+
+class QueryPlan:
+    """Filters ordered by estimated cost and selectivity"""
+
+    def __init__(self, df, steps: List[FilterStep]):
+        """
+        Args:
+            df: The whole dataset the filters will run on
+            steps: Filters in their default order; ties keep it
+        """
+        sample = None
+        for step in steps:
+            if step.rows is not None:
+                step.selectivity = min(1.0, step.rows / len(df)) if len(df) else 0.0
+                continue
+            if sample is None:
+                sample = df.iloc[::max(1, len(df) // PLAN_SAMPLE_ROWS)].iloc[:PLAN_SAMPLE_ROWS]
+            step.selectivity = len(step.apply(sample)) / len(sample) if len(sample) else 0.0
+        self.steps = sorted(steps, key=lambda step: step.rank)
+
+    def apply(self, df, log: Optional[Callable] = None):
+        """
+        Run the filters in plan order.
+
+        Args:
+            df: Rows to filter
+            log: Optional function (name, frame) called after each filter
+
+        Returns:
+            The matching rows of df, in their original order
+        """
+        for step in self.steps:
+            df = step.apply(df)
+            if log is not None:
+                log(step.name, df)
+        return df
+
+    def describe(self) -> str:
+        """Filters in plan order with their estimated selectivity, e.g. 'organization~1.2%(index) > keyword~3.0%(index)'"""
+        return " > ".join(f"{step.name}~{step.selectivity:.1%}({step.source})" for step in self.steps) or "none"
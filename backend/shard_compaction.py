@@ -0,0 +1,259 @@
+"""Shard compaction for the csrc2 data directory
+
+Every crawl, label save and attachment-text update adds another small CSV
+shard, and rows for the same case (by 链接 or id) pile up across them. The
+compaction job merges each shard family into a single deduplicated, sorted,
+gzip-compressed file, ``<family>-compacted.csv.gz``, keeps the merged shards in
+an archive folder and records what it merged in a JSON manifest next to it.
+
+The swap is safe while readers are active: the new file is written under a
+temporary name, the manifest is written next, and only then is the file
+swapped in with os.replace. Readers skip the merged shards only while the
+compacted file on disk is the one the manifest describes (see
+data_service.list_shard_files), so at any moment they either see the old
+files or the new ones, possibly with duplicates, but never lose rows.
+
+Usage:
+    python shard_compaction.py [--family detail --family cat ...] [--dry-run]
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from data_service import (
+    get_compacted_path,
+    get_compaction_manifest_path,
+    get_csrc2_dir,
+    get_pandas,
+    get_shard_signature,
+    list_shard_files,
+    read_compaction_manifest,
+    read_csv_shards,
+)
+
+# Shard family and dedupe key of each compactable dataset. csrclenanalysis is
+# left out: it is rewritten as a whole rather than sharded.
+COMPACTION_FAMILIES = {
+    "detail": ("csrcdtlall", "链接"),
+    "analysis": ("csrc2analysis", "链接"),
+    "label": ("csrc2label", "id"),
+    "cat": ("csrccat", "id"),
+    "split": ("csrcsplit", "id"),
+}
+
+# Merged shards are moved here rather than deleted
+ARCHIVE_DIRNAME = ".compacted"
+
+_compaction_lock = threading.Lock()
+
+
+def _lock_path(penfolder: str) -> str:
+    return os.path.join(penfolder, ".compaction.lock")
+
+
+def _acquire_folder_lock(penfolder: str, stale_seconds: int = 3600) -> bool:
+    """Take the cross-process compaction lock of a folder; stale locks are broken"""
+    path = _lock_path(penfolder)
+    try:
+        if os.path.exists(path) and time.time() - os.path.getmtime(path) > stale_seconds:
+            os.remove(path)
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, "w") as f:
+        f.write(str(os.getpid()))
+    return True
+
+
+def _release_folder_lock(penfolder: str):
+    try:
+        os.remove(_lock_path(penfolder))
+    except OSError:
+        pass
+
+
+def _write_json_atomic(path: str, payload):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _read_raw(files):
+    """Read shards as text so values are written back exactly as they were stored"""
+    started = time.time()
+    dflist, _, skipped = read_csv_shards(files, dtype=str)
+    return dflist, skipped, time.time() - started
+
+
+def compact_family(penfolder: str, beginwith: str, key: str, dry_run: bool = False) -> Dict:
+    """
+    Merge the shards of one family into its compacted file.
+
+    Rows are concatenated in shard order, deduplicated on the key column
+    keeping the last (newest) occurrence, stably sorted by the key and
+    written gzip-compressed. A previous compacted file takes part like any
+    other shard, so repeated runs fold new shards into it.
+
+    Args:
+        penfolder: Folder holding the shard family
+        beginwith: Shard name prefix, e.g. "csrcdtlall"
+        key: Dedupe key column; whole rows are compared when it is missing
+        dry_run: Only report what would be merged
+
+    Returns:
+        Dict describing the run: shard count, rows, duplicates dropped,
+        bytes and raw load seconds before and after
+    """
+    compacted_path = get_compacted_path(penfolder, beginwith)
+    compacted_name = os.path.basename(compacted_path)
+    files = list_shard_files(penfolder, beginwith)
+    shards = [f for f in files if os.path.basename(f) != compacted_name]
+    result = {"family": beginwith, "shards": len(shards), "compacted": False}
+    if not shards:
+        result["message"] = "Nothing to compact"
+        return result
+
+    signature = get_shard_signature(files)
+    bytes_before = sum(entry[1] for entry in signature)
+    dflist, skipped, seconds_before = _read_raw(files)
+    if skipped:
+        result["message"] = f"{skipped} shards could not be read, not compacting"
+        return result
+
+    pandas = get_pandas()
+    merged = pandas.concat(dflist, ignore_index=True) if dflist else pandas.DataFrame()
+    rows_before = len(merged)
+    if key in merged.columns:
+        merged = merged.drop_duplicates(subset=[key], keep="last")
+        merged = merged.sort_values(key, kind="stable", na_position="last")
+    else:
+        merged = merged.drop_duplicates(keep="last")
+    result.update({
+        "key": key if key in merged.columns else None,
+        "rowsBefore": rows_before,
+        "rows": len(merged),
+        "duplicatesDropped": rows_before - len(merged),
+        "bytesBefore": bytes_before,
+        "loadSecondsBefore": round(seconds_before, 3),
+    })
+    if dry_run:
+        return result
+
+    # Hidden name, so the shard listing never picks up a half-written file
+    tmp_path = os.path.join(penfolder, f".{os.getpid()}.{compacted_name}")
+    try:
+        merged.to_csv(tmp_path, index=False, encoding="utf-8-sig")
+        # Verify the new file before it replaces anything
+        check, skipped, seconds_after = _read_raw([tmp_path])
+        if skipped or len(check[0]) != len(merged):
+            raise ValueError(f"compacted file has {len(check[0]) if check else 0} rows, expected {len(merged)}")
+        # A shard rewritten in place while we were reading would lose its update
+        if get_shard_signature(files) != signature:
+            raise RuntimeError("shards changed during compaction, try again")
+
+        previous = read_compaction_manifest(penfolder, beginwith) or {}
+        merged_names = sorted(set(previous.get("shards", [])) | {os.path.basename(f) for f in shards})
+        stat = os.stat(tmp_path)
+        manifest = {
+            "family": beginwith,
+            "compacted": compacted_name,
+            "size": stat.st_size,
+            "mtimeNs": stat.st_mtime_ns,
+            "key": result["key"],
+            "rows": len(merged),
+            "shards": merged_names,
+            "archive": ARCHIVE_DIRNAME,
+            "compactedAt": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        # Manifest first: until the swap it describes a file readers cannot see
+        _write_json_atomic(get_compaction_manifest_path(penfolder, beginwith), manifest)
+        os.replace(tmp_path, compacted_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    archive_dir = os.path.join(penfolder, ARCHIVE_DIRNAME, f"{beginwith}-{time.strftime('%Y%m%d%H%M%S')}")
+    os.makedirs(archive_dir, exist_ok=True)
+    for filepath in shards:
+        os.replace(filepath, os.path.join(archive_dir, os.path.basename(filepath)))
+
+    result.update({
+        "compacted": True,
+        "file": compacted_name,
+        "archivedTo": os.path.relpath(archive_dir, penfolder),
+        "bytesAfter": stat.st_size,
+        "bytesSaved": bytes_before - stat.st_size,
+        "loadSecondsAfter": round(seconds_after, 3),
+        "loadSecondsSaved": round(seconds_before - seconds_after, 3),
+    })
+    print(f"Compacted {len(shards)} {beginwith} shards: {rows_before} -> {len(merged)} rows, "
+          f"{bytes_before} -> {stat.st_size} bytes, load {seconds_before:.2f} -> {seconds_after:.2f} seconds")
+    return result
+
+
+def compact_shards(families: Optional[List[str]] = None, penfolder: Optional[str] = None,
+                   dry_run: bool = False) -> Dict:
+    """
+    Compact the shard families of the csrc2 data directory.
+
+    Args:
+        families: Dataset names from COMPACTION_FAMILIES; all when omitted
+        penfolder: Folder to compact, defaults to the csrc2 data directory
+        dry_run: Only report what would be merged
+
+    Returns:
+        Dict with a per-family report and the totals saved
+    """
+    penfolder = penfolder or get_csrc2_dir()
+    names = families or list(COMPACTION_FAMILIES)
+    unknown = [name for name in names if name not in COMPACTION_FAMILIES]
+    if unknown:
+        raise ValueError(f"Unknown shard families: {', '.join(unknown)}")
+    if not os.path.exists(penfolder):
+        raise FileNotFoundError(f"Directory does not exist: {penfolder}")
+
+    with _compaction_lock:
+        if not _acquire_folder_lock(penfolder):
+            raise RuntimeError("Another compaction is running on this folder")
+        try:
+            report = {}
+            for name in names:
+                beginwith, key = COMPACTION_FAMILIES[name]
+                try:
+                    report[name] = compact_family(penfolder, beginwith, key, dry_run)
+                except Exception as e:
+                    print(f"Compaction of {beginwith} failed: {e}")
+                    report[name] = {"family": beginwith, "compacted": False, "error": str(e)}
+        finally:
+            _release_folder_lock(penfolder)
+
+    done = [entry for entry in report.values() if entry.get("compacted")]
+    return {
+        "families": report,
+        "bytesSaved": sum(entry["bytesSaved"] for entry in done),
+        "loadSecondsSaved": round(sum(entry["loadSecondsSaved"] for entry in done), 3),
+        "duplicatesDropped": sum(entry.get("duplicatesDropped", 0) for entry in report.values()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact the CSV shard families of the csrc2 data directory")
+    parser.add_argument("--family", action="append", choices=sorted(COMPACTION_FAMILIES),
+                        help="Shard family to compact (repeatable, default: all)")
+    parser.add_argument("--folder", help="Data folder (default: data/penalty/csrc2)")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would be merged without writing")
+    args = parser.parse_args()
+
+    report = compact_shards(args.family, args.folder, args.dry_run)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
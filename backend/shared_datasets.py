@@ -0,0 +1,111 @@
+"""Arrow IPC files of the registry datasets, memory-mapped by every worker
+
+With several uvicorn workers each process used to hold its own pandas copy
+of every dataset. When sharing is enabled, the worker that loads a dataset
+first publishes it as an uncompressed Arrow IPC file; every other worker,
+and the publisher itself, memory-maps that file read-only instead of
+keeping a private copy. String columns come back as ``string[pyarrow]``
+arrays over the mapped buffers, so they live once in the page cache no
+matter how many workers there are.
+
+A published file is tagged with the dataset key (the shard signature the
+frame was loaded from) and a version stamp of the loading code. A newer
+generation is written under a temporary name and swapped in with
+os.replace; workers still mapping the old file keep reading it until they
+move on to the new one.
+"""
+
+import json
+import os
+from typing import Any
+
+SHARED_KEY_METADATA = b"dbcsrc_shared_key"
+
+
+class SharedDatasetStore:
+    """Directory of published Arrow IPC files, one per dataset"""
+
+    def __init__(self, directory: str, version: Any = None):
+        self.directory = directory
+        self.version = version
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.arrow")
+
+    def _tag(self, key) -> bytes:
+        return json.dumps({"key": key, "version": self.version}, sort_keys=True).encode("utf-8")
+
+    def read(self, name: str, key):
+        """
+        Memory-map the published copy of a dataset.
+
+        Returns:
+            DataFrame backed by the mapped file, or None when nothing matching
+            the key has been published
+        """
+        import pyarrow
+        import pyarrow.ipc
+        path = self._path(name)
+        if not os.path.exists(path):
+            return None
+        try:
+            reader = pyarrow.ipc.open_file(pyarrow.memory_map(path, "r"))
+            if (reader.schema.metadata or {}).get(SHARED_KEY_METADATA) != self._tag(key):
+                return None
+            return _to_pandas(reader.read_all())
+        except Exception as e:
+            print(f"Failed to map shared dataset {path}: {e}")
+            return None
+
+    def publish(self, name: str, key, frame):
+        """
+        Publish a dataset and return it re-opened from the mapped file.
+
+        Frames with object columns holding anything but strings are not
+        published, since Arrow would have to change their values.
+
+        Returns:
+            Mapped DataFrame, or None when the frame was not published
+        """
+        import pyarrow
+        import pyarrow.ipc
+        if frame.empty or not _is_shareable(frame):
+            return None
+        path = self._path(name)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            table = pyarrow.Table.from_pandas(frame, preserve_index=False)
+            metadata = dict(table.schema.metadata or {})
+            metadata[SHARED_KEY_METADATA] = self._tag(key)
+            table = table.replace_schema_metadata(metadata)
+            with pyarrow.OSFile(tmp_path, "wb") as sink:
+                with pyarrow.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Failed to publish shared dataset {path}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+        return self.read(name, key)
+
+
+def _is_shareable(frame) -> bool:
+    """True when every object column of the frame holds only strings"""
+    import pandas
+    for col in frame.columns:
+        if frame[col].dtype == object:
+            if pandas.api.types.infer_dtype(frame[col], skipna=False) not in ("string", "empty"):
+                print(f"Column {col} is not all strings, keeping a private copy")
+                return False
+    return True
+
+
+def _to_pandas(table):
+    """Convert a mapped table without copying its string buffers"""
+    import pandas
+    import pyarrow
+    string_dtype = pandas.StringDtype("pyarrow")
+    types = {pyarrow.string(): string_dtype, pyarrow.large_string(): string_dtype}
+    return table.to_pandas(types_mapper=types.get, split_blocks=True)
@@ -0,0 +1,295 @@
+"""Local TF-IDF and LSA "similar cases" search
+
+Finding cases similar to a decision used to mean calling the LLM, once per
+(key, sentence) pair in calculate_similar. Here similarity is computed
+offline from the character bigram postings of 内容 the keyword search
+already keeps (search_index.py): the postings are a sparse case x bigram
+count matrix, and their lengths are the document frequencies. Each count
+is weighted by sublinear TF-IDF, and the cases most similar to one case
+are the top-k by cosine, accumulated over the postings of that case's own
+bigrams only. Those postings are gathered in bounded chunks, and bigrams
+found in more than SIMILAR_MAX_DF of the cases (公司, 处罚, 证券...) are
+left out of the dot products: their postings span nearly the whole corpus
+while adding an almost uniform amount to every case.
+
+The postings are updated incrementally when new cases arrive, so a new
+generation only re-weights them (IDF shifts with the corpus size), which
+is a single vectorized pass.
+
+When scikit-learn is installed, ``method=lsa`` ranks by cosine of
+truncated-SVD embeddings of the TF-IDF rows instead, which also matches
+cases sharing related rather than identical wording. The SVD is fit once;
+later generations fold their rows into the fitted components and it is
+refit only after the corpus grew by SVD_REFIT_GROWTH.
+"""
+
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import numpy as np
+
+from dataset_registry import DatasetRef, registry
+from search_index import NgramIndex, get_ngram_index, index_build_stats
+
+try:
+    from scipy import sparse
+    from sklearn.decomposition import TruncatedSVD
+except ImportError:
+    sparse = None
+    TruncatedSVD = None
+
+SIMILAR_COLUMN = "内容"
+SIMILAR_METHODS = ("tfidf", "lsa")
+# Dimensions of the LSA embeddings
+SVD_COMPONENTS = int(os.getenv("SIMILAR_SVD_COMPONENTS", "128"))
+# Growth of the corpus since the last fit after which the SVD is refit
+SVD_REFIT_GROWTH = 0.25
+# Postings gathered per step of a similarity query; bounds its temporary arrays
+SIMILAR_CHUNK_POSTINGS = int(os.getenv("SIMILAR_CHUNK_POSTINGS", str(1 << 18)))
+# Fraction of the cases above which a bigram is skipped in the dot products
+SIMILAR_MAX_DF = float(os.getenv("SIMILAR_MAX_DF", "0.5"))
+
+# dataset -> (NgramIndex, TfidfModel)
+_tfidf_models: Dict[str, tuple] = {}
+# dataset -> (NgramIndex, LsaModel)
+_lsa_models: Dict[str, tuple] = {}
+_similar_lock = threading.Lock()
+
+
+def lsa_available() -> bool:
+    return TruncatedSVD is not None
+
+
+def _top_k(scores, k: int):
+    """Rows of the k highest positive scores, best first, ties by row"""
+    candidates = np.flatnonzero(scores > 0)
+    if len(candidates) > k:
+        candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order], scores[candidates[order]]
+
+
+class TfidfModel:
+    """Sublinear TF-IDF weights of the bigram postings of one NgramIndex"""
+
+    def __init__(self, index: NgramIndex, total_rows: int):
+        """
+        Args:
+            index: Bigram postings of the similarity column
+            total_rows: Rows of the dataset, including rows without text
+        """
+        self.index = index
+        self.total_rows = total_rows
+        frequencies = np.diff(index.offsets)
+        # Smoothed IDF, as scikit-learn's TfidfVectorizer
+        self.idf = np.log((1 + total_rows) / (1 + frequencies)) + 1.0
+        self.term_ids = np.repeat(np.arange(len(index.codes), dtype=np.int32), frequencies)
+        self.weights = (1.0 + np.log(index.counts.astype(np.float64))) * self.idf[self.term_ids]
+        self.norms = np.sqrt(np.bincount(index.rows, weights=self.weights ** 2, minlength=total_rows))
+        # Postings of each row, for the terms of a query case
+        self.by_row = np.argsort(index.rows, kind="stable").astype(np.int64)
+        self.row_offsets = np.searchsorted(index.rows[self.by_row], np.arange(total_rows + 1))
+
+    def row_terms(self, row: int):
+        """Posting positions of a row's bigrams"""
+        return self.by_row[self.row_offsets[row]:self.row_offsets[row + 1]]
+
+    def scores(self, row: int, max_df: float = SIMILAR_MAX_DF):
+        """
+        Cosine similarity of every row to one row.
+
+        Args:
+            row: Row of the query case
+            max_df: Bigrams in more than this fraction of the rows are left
+                out of the dot products; the norms still include them. 1.0
+                gives the exact cosine
+
+        Returns:
+            float64 scores aligned with the dataset rows, 0 for rows sharing
+            no bigram and for rows without text
+        """
+        terms = self.row_terms(row)
+        scores = np.zeros(self.total_rows)
+        if not len(terms) or not self.norms[row]:
+            return scores
+        term_ids = self.term_ids[terms]
+        starts = self.index.offsets[term_ids]
+        lengths = self.index.offsets[term_ids + 1] - starts
+        keep = lengths <= max_df * self.total_rows
+        terms, starts, lengths = terms[keep], starts[keep], lengths[keep]
+        # Consecutive bigrams of about SIMILAR_CHUNK_POSTINGS postings at a time
+        chunk_of = (np.cumsum(lengths) - lengths) // SIMILAR_CHUNK_POSTINGS
+        for chunk in np.split(np.arange(len(terms)), np.flatnonzero(np.diff(chunk_of)) + 1):
+            if not len(chunk):
+                continue
+            chunk_starts, chunk_lengths = starts[chunk], lengths[chunk]
+            # Positions of the postings of the chunk's bigrams, one run per bigram
+            positions = (np.repeat(chunk_starts - np.cumsum(chunk_lengths) + chunk_lengths, chunk_lengths)
+                         + np.arange(chunk_lengths.sum()))
+            products = np.repeat(self.weights[terms[chunk]], chunk_lengths) * self.weights[positions]
+            scores += np.bincount(self.index.rows[positions], weights=products, minlength=self.total_rows)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scores = np.where(self.norms > 0, scores / (self.norms * self.norms[row]), 0.0)
+        return scores
+
+    def matrix(self, term_ids=None, vocabulary: int = None):
+        """
+        L2-normalized TF-IDF rows as a scipy CSR matrix.
+
+        Args:
+            term_ids: Column of each posting, defaults to the index's own
+                bigram order; -1 drops a posting
+            vocabulary: Number of columns
+        """
+        term_ids = self.term_ids if term_ids is None else term_ids
+        keep = term_ids >= 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            values = self.weights[keep] / self.norms[self.index.rows[keep]]
+        return sparse.csr_matrix((values, (self.index.rows[keep], term_ids[keep])),
+                                 shape=(self.total_rows, vocabulary or len(self.index.codes)))
+
+    def memory_bytes(self) -> int:
+        return int(self.idf.nbytes + self.term_ids.nbytes + self.weights.nbytes + self.norms.nbytes
+                   + self.by_row.nbytes + self.row_offsets.nbytes)
+
+
+class LsaModel:
+    """Truncated-SVD embeddings of the TF-IDF rows"""
+
+    def __init__(self, svd, codes, fitted_rows: int, tfidf: TfidfModel):
+        """
+        Args:
+            svd: Fitted TruncatedSVD
+            codes: Bigram codes of the SVD's columns
+            fitted_rows: Rows of the corpus it was fit on
+            tfidf: TF-IDF model whose rows to embed
+        """
+        self.svd = svd
+        self.codes = codes
+        self.fitted_rows = fitted_rows
+        # Column of each posting in the fitted vocabulary, -1 for bigrams it lacks
+        positions = np.minimum(np.searchsorted(codes, tfidf.index.codes), len(codes) - 1)
+        columns = np.where(codes[positions] == tfidf.index.codes, positions, -1)
+        embeddings = svd.transform(tfidf.matrix(columns[tfidf.term_ids], len(codes)))
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        self.embeddings = np.divide(embeddings, norms, out=np.zeros_like(embeddings), where=norms > 0).astype(np.float32)
+
+    @classmethod
+    def fit(cls, tfidf: TfidfModel, components: int = SVD_COMPONENTS):
+        components = max(1, min(components, len(tfidf.index.codes) - 1, tfidf.total_rows - 1))
+        svd = TruncatedSVD(n_components=components, random_state=0).fit(tfidf.matrix())
+        return cls(svd, tfidf.index.codes, tfidf.total_rows, tfidf)
+
+    def fold_in(self, tfidf: TfidfModel):
+        """Embeddings of a later generation's rows with the same fitted components"""
+        return LsaModel(self.svd, self.codes, self.fitted_rows, tfidf)
+
+    def scores(self, row: int):
+        return self.embeddings @ self.embeddings[row]
+
+    def memory_bytes(self) -> int:
+        return int(self.embeddings.nbytes + self.svd.components_.nbytes + self.codes.nbytes)
+
+
+def get_tfidf_model(dataset: DatasetRef = "intersection") -> Optional[TfidfModel]:
+    """
+    TF-IDF model of the current generation of a dataset.
+
+    Returns:
+        TfidfModel, or None when the dataset has no case texts
+    """
+    entry = registry.resolve(dataset)
+    index = get_ngram_index(entry, SIMILAR_COLUMN)
+    if index is None:
+        return None
+    cached = _tfidf_models.get(entry.name)
+    if cached is not None and cached[0] is index:
+        return cached[1]
+    with _similar_lock:
+        cached = _tfidf_models.get(entry.name)
+        if cached is not None and cached[0] is index:
+            return cached[1]
+        start = time.time()
+        model = TfidfModel(index, len(entry.frame))
+        _tfidf_models[entry.name] = (index, model)
+        seconds = time.time() - start
+        index_build_stats[f"{entry.name}:{SIMILAR_COLUMN}:tfidf"] = {
+            "generation": entry.generation,
+            "terms": len(index.codes),
+            "postings": len(index.rows),
+            "memoryBytes": model.memory_bytes(),
+            "seconds": round(seconds, 3),
+        }
+        print(f"TF-IDF model {entry.name} weighted: {len(index.rows)} postings, {seconds:.2f} seconds")
+        return model
+
+
+def get_lsa_model(dataset: DatasetRef = "intersection") -> Optional[LsaModel]:
+    """
+    LSA model of the current generation of a dataset.
+
+    Returns:
+        LsaModel, or None when scikit-learn is not installed or the dataset
+        has no case texts
+    """
+    if not lsa_available():
+        return None
+    entry = registry.resolve(dataset)
+    tfidf = get_tfidf_model(entry)
+    if tfidf is None:
+        return None
+    cached = _lsa_models.get(entry.name)
+    if cached is not None and cached[0] is tfidf.index:
+        return cached[1]
+    with _similar_lock:
+        cached = _lsa_models.get(entry.name)
+        if cached is not None and cached[0] is tfidf.index:
+            return cached[1]
+        start = time.time()
+        previous = cached[1] if cached is not None else None
+        if previous is not None and tfidf.total_rows <= previous.fitted_rows * (1 + SVD_REFIT_GROWTH):
+            model = previous.fold_in(tfidf)
+            mode = "folded"
+        else:
+            model = LsaModel.fit(tfidf)
+            mode = "fitted"
+        _lsa_models[entry.name] = (tfidf.index, model)
+        seconds = time.time() - start
+        index_build_stats[f"{entry.name}:{SIMILAR_COLUMN}:lsa"] = {
+            "generation": entry.generation,
+            "mode": mode,
+            "components": model.embeddings.shape[1],
+            "fittedRows": model.fitted_rows,
+            "memoryBytes": model.memory_bytes(),
+            "seconds": round(seconds, 3),
+        }
+        print(f"LSA model {entry.name} {mode}: {model.embeddings.shape[1]} components, {seconds:.2f} seconds")
+        return model
+
+
+def similar_rows(row: int, k: int = 10, method: str = "tfidf", dataset: DatasetRef = "intersection", exclude=None):
+    """
+    Rows most similar to one row of a dataset.
+
+    Args:
+        row: Row number of the query case
+        k: Number of rows to return
+        method: One of SIMILAR_METHODS
+        dataset: Registry dataset name, or its DatasetEntry
+        exclude: Optional row numbers never returned (e.g. other rows of the
+            same case); the query row itself is always excluded
+
+    Returns:
+        Tuple of (rows, cosine scores), best first; None when the model is
+        unavailable
+    """
+    model = get_lsa_model(dataset) if method == "lsa" else get_tfidf_model(dataset)
+    if model is None:
+        return None
+    scores = np.array(model.scores(row), dtype=np.float64)
+    scores[row] = 0.0
+    if exclude is not None:
+        scores[np.asarray(exclude, dtype=np.int64)] = 0.0
+    return _top_k(scores, k)
@@ -30,6 +30,9 @@ from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
+import data_service
+from dataset_registry import registry
+
 # Directory paths
 pencsrc2 = "../data/penalty/csrc2"
 
@@ -211,64 +214,16 @@ def get_now():
 
 
 def get_csvdf(penfolder, beginwith, include_filename=False):
-    """Get concatenated dataframe from CSV files."""
-    import os
-    pattern = os.path.join(penfolder, beginwith + "*.csv")
-    files2 = glob.glob(pattern, recursive=False)
-    dflist = []
-    for filepath in files2:
-        try:
-            pendf = get_pandas().read_csv(filepath, encoding='utf-8-sig')
-            
-            # Add filename column if requested
-            if include_filename and not pendf.empty:
-                filename = os.path.basename(filepath)
-                pendf['source_filename'] = filename
-            
-            dflist.append(pendf)
-        except Exception as e:
-            # Error reading file
-            pass
+    """Get concatenated dataframe from CSV files.
     
-    if len(dflist) > 0:
-        df = get_pandas().concat(dflist)
-        df.reset_index(drop=True, inplace=True)
-    else:
-        df = get_pandas().DataFrame()
-    return df
+    Shares the loader (and its snapshot cache) with data_service.get_csvdf.
+    """
+    return data_service.get_csvdf(penfolder, beginwith, include_filename=include_filename)
 
 
 def get_csrc2detail():
-    """Get CSRC detail data."""
-    pendf = get_csvdf(pencsrc2, "csrcdtlall")
-    if not pendf.empty:
-        # Format date - handle both timestamp and date formats
-        if "发文日期" in pendf.columns:
-            # First try to convert timestamps (numeric values) to datetime
-            def convert_date(date_val):
-                if get_pandas().isna(date_val) or date_val == "":
-                    return ""
-                
-                # If it's a numeric timestamp, convert it
-                try:
-                    # Check if it's a numeric timestamp (seconds or milliseconds)
-                    if str(date_val).replace('.', '').isdigit():
-                        timestamp = float(date_val)
-                        # If timestamp is in milliseconds (> 1e10), convert to seconds
-                        if timestamp > 1e10:
-                            timestamp = timestamp / 1000
-                        return get_pandas().to_datetime(timestamp, unit='s').date()
-                    else:
-                        # Try to parse as regular date string
-                        return get_pandas().to_datetime(date_val, errors='coerce').date()
-                except (ValueError, TypeError, OverflowError):
-                    # If conversion fails, return empty string
-                    return ""
-            
-            pendf["发文日期"] = pendf["发文日期"].apply(convert_date)
-        # Fill na
-        pendf = pendf.fillna("")
-    return pendf
+    """Get CSRC detail data from the shared dataset registry."""
+    return data_service.get_csrc2detail()
 
 
 def get_url_backend(orgname, selected_ids=None):
@@ -306,6 +261,7 @@ def savedf_backend(df, basename):
     savename = basename + ".csv"
     savepath = os.path.join(pencsrc2, savename)
     os.makedirs(os.path.dirname(savepath), exist_ok=True)
+    df = data_service.drop_derived_columns(df)
     df.to_csv(savepath, index=False, escapechar="\\", encoding='utf-8-sig')
 
 
@@ -493,27 +449,8 @@ def get_sumeventdf_backend(orgname, start, end, selected_ids=None):
 
 
 def get_csrc2analysis():
-    """Get CSRC analysis data including source filename"""
-    # Use absolute path to ensure it works from any working directory
-    import os
-    # Get the project root directory (dbcsrc)
-    current_file = os.path.abspath(__file__)
-    backend_dir = os.path.dirname(current_file)
-    project_root = os.path.dirname(backend_dir)
-    pencsrc2_abs = os.path.join(project_root, "data", "penalty", "csrc2")
-    
-    pendf = get_csvdf(pencsrc2_abs, "csrc2analysis", include_filename=True)
-    if not pendf.empty:
-        # Format date with error handling
-        try:
-            pendf["发文日期"] = get_pandas().to_datetime(pendf["发文日期"], format='mixed', errors='coerce').dt.date
-        except Exception as e:
-            # Date formatting warning
-            # Try alternative format
-            pendf["发文日期"] = get_pandas().to_datetime(pendf["发文日期"], errors='coerce').dt.date
-        # Fill na
-        pendf = pendf.fillna("")
-    return pendf
+    """Get CSRC analysis data including source filename from the shared dataset registry."""
+    return data_service.get_csrc2analysis()
 
 def savetemp(df, basename):
     """Save dataframe to temp directory
@@ -534,6 +471,7 @@ def savetemp(df, basename):
     # Use basename.csv
     savename = basename + ".csv"
     savepath = os.path.join(tempdir, savename)
+    df = data_service.drop_derived_columns(df)
     df.to_csv(savepath, index=False, encoding='utf-8-sig')
 
 def content_length_analysis(length, download_filter):
@@ -603,6 +541,7 @@ def content_length_analysis(length, download_filter):
         # save misdf
         try:
             savetemp(misdf1, savename)
+            registry.invalidate("lenanalysis")
             print(f"Successfully saved csrclenanalysis with {len(misdf1)} records")
         except Exception as save_error:
             print(f"Error saving csrclenanalysis: {str(save_error)}")
@@ -642,6 +581,7 @@ def update_sumeventdf_backend(currentsum):
         nowstr = get_now()
         savename = "csrcdtlall" + nowstr
         savedf_backend(newdf, savename)
+        registry.invalidate("detail")
         # Saved new records to csrcdtlall
         
         # Also update csrc2analysis files
@@ -703,6 +643,7 @@ def update_csrc2analysis_backend():
             nowstr = get_now()
             savename = f"csrc2analysis{nowstr}"
             savedf_backend(upddf, savename)
+            registry.invalidate("analysis")
             # Saved new csrc2analysis records with timestamp
         else:
             # No new records to add to csrc2analysis
@@ -761,18 +702,8 @@ def get_chrome_driver():
 
 
 def get_csrclenanalysis():
-    """Get CSRC length analysis dataframe including source filename."""
-    # Define tempdir using absolute path
-    import os
-    current_file = os.path.abspath(__file__)
-    backend_dir = os.path.dirname(current_file)
-    project_root = os.path.dirname(backend_dir)
-    tempdir = os.path.join(project_root, "data", "penalty", "csrc2", "temp")
-    
-    pendf = get_csvdf(tempdir, "csrclenanalysis", include_filename=True)
-    if not pendf.empty:
-        pendf = pendf.fillna("")
-    return pendf
+    """Get CSRC length analysis dataframe including source filename from the shared dataset registry."""
+    return data_service.get_csrclenanalysis()
 
 
 def download_attachment(down_list=None, progress_callback=None):
@@ -1259,8 +1190,8 @@ def download_attachment(down_list=None, progress_callback=None):
             existing_analysis = get_csrclenanalysis()
             
             if existing_analysis is not None and not existing_analysis.empty:
-                # Use existing DataFrame directly
-                analysis_df = existing_analysis
+                # Work on a private copy, the registry copy is read-only
+                analysis_df = existing_analysis.copy()
                 
                 # Update content for matching URLs
                 updated_count = 0
@@ -1286,6 +1217,7 @@ def download_attachment(down_list=None, progress_callback=None):
                     # Save updated analysis data
                     savename = "csrclenanalysis"
                     savetemp(analysis_df, savename)
+                    registry.invalidate("lenanalysis")
                     print(f"Successfully updated csrclenanalysis content field for {updated_count} records")
                 else:
                     print("No matching records found in csrclenanalysis to update with extracted text")